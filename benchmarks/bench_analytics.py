@@ -0,0 +1,84 @@
+"""Сравнение векторной статистики с поотчетными суммами на Python
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_analytics --reports 1000000
+
+Старый путь - сумма свойств ORM-объектов Report (как в
+get_country_stats_by_id), новый - ReportExtract: перевод строк выборки в
+колонки (from_rows) и векторный расчет итогов и группировки.
+"""
+import argparse
+import datetime
+import time
+import numpy as np
+from data.models import Report
+from data.analytics import ReportExtract
+
+
+def make_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2024, 1, 1)
+    minutes = rng.integers(0, 365 * 24 * 60, count)
+    bets = rng.integers(100, 100_000, count)
+    returns = (bets * rng.uniform(0, 2, count)).astype(np.int64)
+    errors = rng.random(count) < 0.05
+    percentages = rng.choice([5.0, 7.5, 10.0], count)
+    countries = rng.integers(1, 25, count)
+    sources = rng.integers(1, 10, count)
+    bookmakers = rng.integers(1, 300, count)
+    employees = rng.integers(1, 40, count)
+    return [(i, start + datetime.timedelta(minutes=int(minutes[i])),
+             int(bets[i]), int(returns[i]), bool(errors[i]),
+             float(percentages[i]), int(countries[i]), int(sources[i]),
+             int(bookmakers[i]), int(employees[i]))
+            for i in range(count)]
+
+
+def timed(label, func):
+    started = time.perf_counter()
+    result = func()
+    print(f"{label:<40} {time.perf_counter() - started:8.3f} s")
+    return result
+
+
+def python_totals(reports):
+    return (sum(r.bet_amount for r in reports),
+            sum(r.real_profit for r in reports),
+            sum(r.real_salary for r in reports))
+
+
+def python_by_country(reports):
+    groups = {}
+    for r in reports:
+        bet, profit, salary = groups.get(r.country_id, (0, 0, 0))
+        groups[r.country_id] = (bet + r.bet_amount, profit + r.real_profit,
+                                salary + r.real_salary)
+    return groups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    rows = timed(f"generate {args.reports} rows",
+                 lambda: make_rows(args.reports))
+    reports = timed("build Report objects", lambda: [
+        Report(id=row[0], date=row[1], bet_amount=row[2] / 100,
+               return_amount=row[3] / 100, is_error=row[4],
+               _salary_percentage=row[5], country_id=row[6])
+        for row in rows])
+    timed("python: totals", lambda: python_totals(reports))
+    timed("python: group by country", lambda: python_by_country(reports))
+
+    extract = timed("numpy: from_rows", lambda: ReportExtract.from_rows(rows))
+    timed("numpy: totals", extract.totals)
+    timed("numpy: group by country", lambda: extract.group_by("country"))
+    timed("numpy: group by country, month",
+          lambda: extract.group_by("country", "month"))
+    timed("numpy: group by employee, week",
+          lambda: extract.group_by("employee", "week"))
+
+
+if __name__ == "__main__":
+    main()
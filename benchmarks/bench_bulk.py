@@ -0,0 +1,95 @@
+"""Сравнение пакетных операций Model с построчными
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_bulk --rows 5000
+
+Старый путь - цикл по Model.create, Model.update и update(is_deleted=True)
+(своя сессия и транзакция на строку), новый - bulk_create, bulk_update и
+bulk_soft_delete (запрос на пачку строк, одна транзакция). База - файл
+SQLite во временной папке (или DATABASE_URL), как у бота в работе.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL",
+                      f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+
+from data.config import async_engine  # noqa: E402
+from data.base import Model  # noqa: E402
+from data.models import Wallet  # noqa: E402
+
+
+async def timed(label, coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {elapsed:8.3f} s")
+    return elapsed, result
+
+
+def rows(count, prefix):
+    return [{"name": f"{prefix} {i}", "general_wallet_type": "Binance",
+             "wallet_type": "Общий", "deposit": i, "adjustment": 0}
+            for i in range(count)]
+
+
+async def create_loop(count):
+    return [await Wallet.create(**row) for row in rows(count, "loop")]
+
+
+async def update_loop(wallets):
+    for wallet in wallets:
+        await wallet.update(adjustment=wallet.adjustment + 1)
+
+
+async def soft_delete_loop(wallets):
+    for wallet in wallets:
+        await wallet.update(is_deleted=True)
+
+
+async def run(count):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Model.metadata.drop_all)
+        await conn.run_sync(Model.metadata.create_all)
+
+    print(f"{count} строк, {os.environ['DATABASE_URL']}\n")
+    results = []
+
+    loop_time, wallets = await timed("create: цикл Model.create",
+                                     create_loop(count))
+    bulk_time, ids = await timed(
+        "create: bulk_create(return_ids=True)",
+        Wallet.bulk_create(rows(count, "bulk"), return_ids=True))
+    results.append(("create", loop_time, bulk_time))
+
+    loop_time, _ = await timed("update: цикл Model.update",
+                               update_loop(wallets))
+    bulk_time, _ = await timed("update: bulk_update", Wallet.bulk_update(
+        {wallet_id: {"adjustment": 1} for wallet_id in ids}))
+    results.append(("update", loop_time, bulk_time))
+
+    loop_time, _ = await timed("soft delete: цикл Model.update",
+                               soft_delete_loop(wallets))
+    bulk_time, _ = await timed("soft delete: bulk_soft_delete",
+                               Wallet.bulk_soft_delete(Wallet.id.in_(ids)))
+    results.append(("soft delete", loop_time, bulk_time))
+
+    print()
+    for name, loop_time, bulk_time in results:
+        print(f"{name:<12} ускорение x{loop_time / bulk_time:.0f}")
+    await async_engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.rows))
+
+
+if __name__ == "__main__":
+    main()
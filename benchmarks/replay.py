@@ -0,0 +1,390 @@
+"""Нагрузочный прогон обновлений через настоящий Dispatcher
+
+Запуск из корня проекта:
+    python -m benchmarks.replay --updates 2000 --concurrency 1,8,32
+    python -m benchmarks.replay --recorded updates.jsonl --concurrency 16
+
+Dispatcher собирается тем же create_dispatcher, что и в main.py, но с
+FakeBot: запросы к Telegram не уходят в сеть, а записываются (с
+необязательной задержкой --api-latency), скачивание файлов копирует
+локальные файлы. База в памяти заполняется синтетическими странами,
+букмекерами, сотрудниками и отчетами.
+
+Синтетическая смесь - сценарии пользователей: сотрудник смотрит
+"📊 Баланс", администраторы открывают статистику балансов, страны, БК и
+зарплаты, загружают Excel-файл отчетов через process_report_file.
+Обновления одного сценария идут по очереди (как у живого пользователя),
+а --concurrency сценариев выполняются одновременно. Записанные
+обновления (--recorded, по одному JSON Update на строку) группируются по
+пользователю так же.
+
+Для каждого уровня параллельности печатаются пропускная способность и
+p50/p95/p99 времени по обработчикам; потолок пропускной способности -
+максимум по уровням.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import openpyxl
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from sqlalchemy import insert
+
+from data.config import async_engine
+from data.base import Model
+from data.models import *
+from data.migrations import apply_migrations
+from bot.ingest_queue import ingest_queue
+from main import create_dispatcher
+
+ADMIN_IDS = range(1, 6)
+EMPLOYEE_ID_START = 1000
+
+
+class FakeBot(Bot):
+    """
+    Bot без сети
+
+    Поля:
+    calls -- количество вызовов по методам Bot API
+    files -- file_id -> путь к локальному файлу для download_file
+    latency -- имитация времени ответа Telegram, секунды
+    """
+
+    def __init__(self, files=None, latency=0.0):
+        super().__init__(token="123456:replay-harness")
+        self.calls = Counter()
+        self.files = files or {}
+        self.latency = latency
+        self._message_ids = itertools.count(1)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = data or {}
+        if method == "getFile":
+            return {"file_id": data["file_id"],
+                    "file_unique_id": data["file_id"],
+                    "file_path": data["file_id"]}
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "replay",
+                    "username": "replay_bot"}
+        if method.startswith(("send", "edit", "copy", "forward")):
+            return {"message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": int(data.get("chat_id") or 0),
+                             "type": "private"},
+                    "text": data.get("text") or ""}
+        return True
+
+    async def download_file(self, file_path, destination=None, **kwargs):
+        shutil.copyfile(self.files[file_path], destination)
+        return destination
+
+
+class LatencyRecorder(BaseMiddleware):
+    """Время каждого вызова обработчика: имя -> список секунд"""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = defaultdict(list)
+
+    async def _start(self, data):
+        data["_replay_handler"] = getattr(current_handler.get(), "__name__",
+                                          "unknown")
+        data["_replay_started"] = time.perf_counter()
+
+    async def _finish(self, data):
+        started = data.pop("_replay_started", None)
+        if started is not None:
+            self.samples[data.pop("_replay_handler")].append(
+                time.perf_counter() - started)
+
+    async def on_process_message(self, message, data):
+        await self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        await self._finish(data)
+
+    async def on_process_callback_query(self, call, data):
+        await self._start(data)
+
+    async def on_post_process_callback_query(self, call, results, data):
+        await self._finish(data)
+
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id, text=None, document=None):
+    message = {"message_id": next(_update_ids), "date": int(time.time()),
+               "from": {"id": user_id, "is_bot": False,
+                        "first_name": f"user{user_id}",
+                        "username": f"user{user_id}"},
+               "chat": {"id": user_id, "type": "private"}}
+    if text is not None:
+        message["text"] = text
+    if document is not None:
+        message["document"] = document
+    return types.Update(update_id=message["message_id"], message=message)
+
+
+def callback_update(user_id, data):
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}",
+            "username": f"user{user_id}"}
+    return types.Update(update_id=update_id, callback_query={
+        "id": str(update_id), "from": user, "chat_instance": "replay",
+        "data": data,
+        "message": {"message_id": update_id, "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": user, "text": "replay"}})
+
+
+class World:
+    """Синтетические данные и сценарии пользователей"""
+
+    # file_id файла загрузки, FakeBot.files сопоставляет его с путем
+    UPLOAD_FILE_ID = "replay-upload"
+
+    def __init__(self, countries, bookmakers, employees, upload_file):
+        self.countries = countries
+        self.bookmakers = bookmakers
+        self.employees = employees
+        self.upload_file = upload_file
+
+    def employee_balance(self, rng):
+        return [message_update(rng.choice(self.employees), "📊 Баланс")]
+
+    def balance_stats(self, rng):
+        return [message_update(rng.choice(ADMIN_IDS),
+                               "Общая статистика балансов")]
+
+    def country_stats(self, rng):
+        admin = rng.choice(ADMIN_IDS)
+        return [message_update(admin, "Статистика по стране"),
+                callback_update(admin,
+                                f"country_stats:{rng.choice(self.countries)}")]
+
+    def bookmaker_stats(self, rng):
+        return [callback_update(rng.choice(ADMIN_IDS),
+                                f"bookmaker_stats:"
+                                f"{rng.choice(self.bookmakers)}")]
+
+    def salary_stats(self, rng):
+        return [message_update(rng.choice(ADMIN_IDS),
+                               "Общая статистика зарплаты")]
+
+    def upload(self, rng):
+        admin = rng.choice(ADMIN_IDS)
+        file_id = self.UPLOAD_FILE_ID
+        return [message_update(admin, "📝 Сделать отчет"),
+                message_update(admin, document={
+                    "file_id": file_id, "file_unique_id": file_id,
+                    "file_name": "reports.xlsx"})]
+
+
+# сценарий -> вес в смеси
+MIX = {
+    "employee_balance": 40,
+    "balance_stats": 15,
+    "country_stats": 15,
+    "bookmaker_stats": 15,
+    "salary_stats": 10,
+    "upload": 5,
+}
+
+
+async def seed(args, workdir) -> World:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+        await conn.run_sync(apply_migrations)
+        countries = [{"id": i, "name": f"Country {i}", "flag": "🏳"}
+                     for i in range(1, args.countries + 1)]
+        await conn.execute(insert(Country), countries)
+        await conn.execute(insert(Source), [{"id": 1, "name": "Telegram"}])
+        bookmakers = [{"id": i, "name": f"Login{i}", "bk_name": "Bet",
+                       "country_id": (i - 1) % args.countries + 1,
+                       "salary_percentage": 10, "is_active": True}
+                      for i in range(1, args.bookmakers + 1)]
+        await conn.execute(insert(Bookmaker), bookmakers)
+        employees = list(range(EMPLOYEE_ID_START,
+                               EMPLOYEE_ID_START + args.employees))
+        await conn.execute(insert(Employee), [
+            {"id": i, "name": f"Employee {i}", "username": f"user{i}"}
+            for i in employees])
+        rng = random.Random(0)
+        start = datetime.datetime.now() - datetime.timedelta(days=365)
+        reports = [{"date": start + datetime.timedelta(
+                        minutes=rng.randrange(365 * 24 * 60)),
+                    "source_id": 1,
+                    "country_id": bk["country_id"],
+                    "bookmaker_id": bk["id"],
+                    "employee_id": rng.choice(employees),
+                    "bet_amount": rng.randrange(10, 1000),
+                    "return_amount": rng.randrange(0, 2000),
+                    "is_error": rng.random() < 0.05}
+                   for bk in (rng.choice(bookmakers)
+                              for _ in range(args.reports))]
+        for chunk in range(0, len(reports), 10_000):
+            await conn.execute(insert(Report), reports[chunk:chunk + 10_000])
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Дата', 'Источник', 'Страна', 'Букмекер', 'Профиль',
+                  'Сумма Проставленных', 'Возврат', 'Является Ли Ошибочным',
+                  'userID', 'nickName'])
+    for _ in range(args.upload_rows):
+        bk = rng.choice(bookmakers)
+        sheet.append([datetime.datetime.now(), "Telegram",
+                      f"Country {bk['country_id']}", bk["bk_name"],
+                      bk["name"], rng.randrange(10, 1000),
+                      rng.randrange(0, 2000), "Нет", rng.choice(employees),
+                      "nick"])
+    upload_path = os.path.join(workdir, "upload.xlsx")
+    workbook.save(upload_path)
+    return World([c["id"] for c in countries], [b["id"] for b in bookmakers],
+                 employees, upload_path)
+
+
+def synthetic_sessions(world: World, count: int, seed_value=0):
+    """Сценарии по весам MIX, пока не наберется count обновлений"""
+    rng = random.Random(seed_value)
+    names, weights = zip(*MIX.items())
+    total = 0
+    while total < count:
+        updates = getattr(world, rng.choices(names, weights)[0])(rng)
+        total += len(updates)
+        yield updates
+
+
+def recorded_sessions(path):
+    """Записанные обновления, сгруппированные по пользователю"""
+    sessions = defaultdict(list)
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                update = types.Update(**json.loads(line))
+                event = update.message or update.callback_query
+                user = event.from_user.id if event and event.from_user \
+                    else None
+                sessions[user].append(update)
+    return list(sessions.values())
+
+
+async def run_level(dp: Dispatcher, sessions, concurrency: int) -> dict:
+    recorder = LatencyRecorder()
+    dp.middleware.setup(recorder)
+    sessions = iter(sessions)
+    processed = 0
+    errors = Counter()
+
+    async def worker():
+        nonlocal processed
+        for updates in sessions:
+            for update in updates:
+                try:
+                    await dp.process_updates([update])
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                processed += 1
+            user = updates[0].message or updates[0].callback_query
+            if user is not None:
+                await dp.storage.finish(chat=user.from_user.id,
+                                        user=user.from_user.id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    dp.middleware.applications.remove(recorder)
+    return {"concurrency": concurrency, "updates": processed,
+            "seconds": elapsed, "samples": recorder.samples,
+            "errors": errors}
+
+
+def print_level(level: dict):
+    print(f"\nconcurrency {level['concurrency']}: {level['updates']} "
+          f"updates in {level['seconds']:.2f} s, "
+          f"{level['updates'] / level['seconds']:.1f} updates/s")
+    print(f"{'handler':<32} {'calls':>7} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9}")
+    for name, samples in sorted(level["samples"].items()):
+        p50, p95, p99 = np.percentile(np.array(samples) * 1000,
+                                      [50, 95, 99])
+        print(f"{name:<32} {len(samples):>7} {p50:>9.1f} {p95:>9.1f} "
+              f"{p99:>9.1f}")
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    # process_report_file сохраняет файлы в reports_folder текущего каталога
+    os.chdir(workdir)
+    world = await seed(args, workdir)
+    bot = FakeBot(files={world.UPLOAD_FILE_ID: world.upload_file},
+                  latency=args.api_latency)
+    dp = create_dispatcher(bot)
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await ingest_queue.start(bot)
+
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            if args.recorded:
+                sessions = recorded_sessions(args.recorded)
+            else:
+                sessions = synthetic_sessions(world, args.updates,
+                                              seed_value=concurrency)
+            level = await run_level(dp, sessions, concurrency)
+            print_level(level)
+            levels.append(level)
+        await asyncio.wait_for(ingest_queue.join(), args.drain)
+    finally:
+        await ingest_queue.shutdown()
+        await (await bot.get_session()).close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    best = max(levels, key=lambda level: level["updates"] / level["seconds"])
+    print(f"\nthroughput ceiling: "
+          f"{best['updates'] / best['seconds']:.1f} updates/s "
+          f"at concurrency {best['concurrency']}")
+    print("bot api calls: " + ", ".join(
+        f"{method} {count}" for method, count in bot.calls.most_common()))
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=1000,
+                        help="синтетических обновлений на уровень")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        type=lambda value: [int(v) for v in value.split(",")],
+                        help="уровни параллельности через запятую")
+    parser.add_argument("--recorded", help="файл JSON Update по строкам")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="задержка ответа Telegram, секунды")
+    parser.add_argument("--reports", type=int, default=20_000)
+    parser.add_argument("--countries", type=int, default=20)
+    parser.add_argument("--bookmakers", type=int, default=200)
+    parser.add_argument("--employees", type=int, default=40)
+    parser.add_argument("--upload-rows", type=int, default=200)
+    parser.add_argument("--drain", type=float, default=60,
+                        help="сколько ждать фоновые загрузки, секунды")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,10 @@ from aiogram.dispatcher import FSMContext
 from bot.utils import *
 from bot.keyboards import *
 from bot.states import *
+from bot.pagination import Paginator
 from report_logic.excel_reports import *
+from bot.ingest_queue import ingest_queue
+from report_logic.transfer_import import import_transfers, TRANSFER_COLUMNS
 
 
 @admin_required
@@ -97,6 +100,9 @@ async def process_add_source(message: types.Message, state: FSMContext):
     if source_name.lower() == "отмена":
         await state.finish()
         await message.answer("Добавление источника отменено")
+    elif await is_source_exists(source_name):
+        await state.finish()
+        await message.answer("Источник с таким названием уже существует")
     else:
         await add_source_to_db(source_name)
         await state.finish()
@@ -118,17 +124,29 @@ async def cancel_adding_source(callback_query: types.CallbackQuery,
 """УПРАВЛЕНИЕ СОТРУДНИКАМИ"""
 
 
+async def fetch_employees(arg, user_id, offset, limit):
+    return await get_employee_rows(offset=offset, limit=limit)
+
+
+def employee_list_text(employees, page):
+    message_text = "Список сотрудников:\n"
+    for employee in employees:
+        message_text += f"{employee.name} (@{employee.username}) - {employee.id}\n"
+    return message_text
+
+
+employee_list_paginator = Paginator("employee_list", fetch_employees,
+                                    make_text=employee_list_text)
+
+
 @admin_required
 async def employee_list(message: types.Message):
     """Список сотрудников"""
-    employees = await get_employees()
-    if not employees:
+    page = await employee_list_paginator.render()
+    if not page.rows:
         await message.answer("Нет сотрудников")
         return
-    message_text = "Список сотрудников:\n"
-    for employee in employees:
-        message_text += f"{employee.name} (@{employee.username}) - {employee.id}\n"
-    await message.answer(message_text)
+    await message.answer(page.text, reply_markup=page.keyboard)
 
 
 @admin_required
@@ -357,6 +375,9 @@ async def process_add_country(message: types.Message, state: FSMContext):
     if country_name.lower() == "отмена":
         await state.finish()
         await message.answer("Добавление страны отменено")
+    elif await is_country_exists(country_name):
+        await message.answer("Страна с таким названием уже существует")
+        await state.finish()
     else:
         await state.update_data(country_name=country_name)
         await message.answer(
@@ -391,21 +412,26 @@ async def cancel_adding_country(callback_query: types.CallbackQuery,
         await callback_query.message.answer("Добавление страны отменено")
 
 
+async def fetch_countries(arg, user_id, offset, limit):
+    return await get_country_rows(offset=offset, limit=limit)
+
+
+remove_country_paginator = Paginator(
+    "remove_country", fetch_countries,
+    make_button=lambda country: types.InlineKeyboardButton(
+        f"{country.flag} {country.name}",
+        callback_data=f"remove_country_|_{country.id}"))
+
+
 @admin_required
 async def remove_country(message: types.Message):
     """Удалить страну"""
-    countries = await get_countries()
-    if not countries:
+    page = await remove_country_paginator.render()
+    if not page.rows:
         await message.answer("Нет стран")
         return
-    keyboard = types.InlineKeyboardMarkup()
-    for country in countries:
-        button_remove_country = types.InlineKeyboardButton(
-            f"{country.flag} {country.name}",
-            callback_data=f"remove_country_|_{country.id}")
-        keyboard.add(button_remove_country)
     await message.answer("Выберите страну для удаления",
-                         reply_markup=keyboard)
+                         reply_markup=page.keyboard)
 
 
 """УПРАВЛЕНИЕ ШАБЛОНАМИ БК"""
@@ -538,7 +564,7 @@ async def remove_template(message: types.Message):
         return
     keyboard = types.InlineKeyboardMarkup()
     for country in countries:
-        button_country = types.InlineKeyboardButton(f{country.flag} {country.name}",
+        button_country = types.InlineKeyboardButton(f"{country.flag} {country.name}",
                                                     callback_data=f"remove_template_country_|_{country.id}")
         keyboard.add(button_country)
     await message.answer("Выберите страну для удаления шаблона",
@@ -735,6 +761,22 @@ async def cancel_editing_bk(callback_query: types.CallbackQuery,
                                             reply_markup=management_bk_keyboard)
 
 
+async def fetch_bks_by_template(arg, user_id, offset, limit):
+    """Букмекеры шаблона с балансами по журналу: (букмекер, баланс)"""
+    bks = await get_bk_by_template_id(int(arg), offset=offset, limit=limit)
+    balances = await get_ledger_balances("bookmaker", (bk.id for bk in bks))
+    return [(bk, balances[bk.id]) for bk in bks]
+
+
+edit_bk_paginator = Paginator(
+    "edit_bk", fetch_bks_by_template,
+    make_button=lambda row: types.InlineKeyboardButton(
+        f"{row[0].name} | {round(row[1], 3)}",
+        callback_data=f"edit_bk_by_profile_|_{row[0].id}"),
+    footer=[types.InlineKeyboardButton("Отмена",
+                                       callback_data="cancel_editing_bk")])
+
+
 @admin_required
 async def process_edit_bk_by_template(callback_query: types.CallbackQuery,
                                       state: FSMContext):
@@ -746,24 +788,14 @@ async def process_edit_bk_by_template(callback_query: types.CallbackQuery,
     await state.update_data(template_id=template_id)
     await callback_query.answer()
 
-    bks = await get_bk_by_template_id(template_id)
-    if not bks:
+    page = await edit_bk_paginator.render(0, template_id)
+    if not page.rows:
         await callback_query.message.answer(
             "Нет профилей БК для этого шаблона")
         return
-    keyboard = types.InlineKeyboardMarkup()
-    for bk in bks:
-        button_edit_bk = types.InlineKeyboardButton(
-            f"{bk.name} | {round(bk.get_balance(), 3)}",
-            callback_data=f"edit_bk_by_profile_|_{bk.id}")
-        keyboard.add(button_edit_bk)
-
-    cancel_button = types.InlineKeyboardButton("Отмена",
-                                               callback_data="cancel_editing_bk")
-    keyboard.add(cancel_button)
     await callback_query.message.answer(
         "Выберите профиль БК для редактирования",
-        reply_markup=keyboard)
+        reply_markup=page.keyboard)
 
 
 @admin_required
@@ -805,9 +837,11 @@ async def process_edit_bk_by_profile(callback_query: types.CallbackQuery,
     await EditBkState.waiting_for_action.set()
     await state.update_data(bk_id=bk_id)
     bk_info = await get_bk_by_id(bk_id)
+    deposit = await get_ledger_balance("bookmaker", bk_id, "deposit")
+    balance = await get_ledger_balance("bookmaker", bk_id)
 
     await callback_query.message.answer(
-        f"Профиль БК {bk_info.name}\nПроцент: {bk_info.salary_percentage}\nСтрана: {bk_info.country.flag} {bk_info.country.name}\nШаблон: {bk_info.template.name}\nАктивен: {bk_info.is_active}\nДепозит: {bk_info.get_deposit()}\nБаланс: {bk_info.get_balance()}\nВыберите действие",
+        f"Профиль БК {bk_info.name}\nПроцент: {bk_info.salary_percentage}\nСтрана: {bk_info.country.flag} {bk_info.country.name}\nШаблон: {bk_info.template.name}\nАктивен: {bk_info.is_active}\nДепозит: {deposit}\nБаланс: {balance}\nВыберите действие",
         reply_markup=keyboard)
 
 
@@ -861,6 +895,11 @@ async def process_edit_profile_name(message: types.Message,
             await state.finish()
             return
         bk = await get_bk_by_id(bk_id)
+        if name_key(profile_name) != bk.name_key and await is_bk_exists(
+                bk.template_id, bk.country_id, bk.bk_name, profile_name):
+            await message.answer("Профиль БК с таким именем уже существует")
+            await state.finish()
+            return
         await edit_bk_name(bk_id, profile_name)
         await state.finish()
         await message.answer(
@@ -1210,26 +1249,57 @@ async def delite_wallet(message: types.Message):
                          reply_markup=keyboard)
 
 
+async def fetch_wallets_by_country(arg, user_id, offset, limit):
+    """
+    Кошельки страны (для "O" - общие кошельки) с балансами по журналу:
+    (кошелек, баланс)
+    """
+    if arg == "O":
+        wallets = await get_wallets_by_wallet_type("Общий", offset=offset,
+                                                   limit=limit)
+    else:
+        wallets = await get_wallets_by_country_id(arg, offset=offset,
+                                                  limit=limit)
+    balances = await get_ledger_balances("wallet", (w.id for w in wallets))
+    return [(wallet, balances[wallet.id]) for wallet in wallets]
+
+
+async def fetch_wallet_rows_by_country(arg, user_id, offset, limit):
+    """То же без балансов: только id и названия кошельков"""
+    if arg == "O":
+        criteria = [Wallet.wallet_type == "Общий"]
+    else:
+        criteria = [Wallet.country_id == int(arg)]
+    return await get_wallet_rows(*criteria, offset=offset, limit=limit)
+
+
+remove_wallet_paginator = Paginator(
+    "remove_wallet", fetch_wallet_rows_by_country,
+    make_button=lambda wallet: types.InlineKeyboardButton(
+        wallet.name, callback_data=f"remove_wallet_|_{wallet.id}"))
+edit_wallet_paginator = Paginator(
+    "edit_wallet", fetch_wallets_by_country,
+    make_button=lambda row: types.InlineKeyboardButton(
+        f"{row[0].name} | {round(row[1], 3)}",
+        callback_data=f"edit_wallet_by_wallet_|_{row[0].id}"))
+transfer_wallet_paginator = Paginator(
+    "transfer_wallet", fetch_wallet_rows_by_country,
+    make_button=lambda wallet: types.InlineKeyboardButton(
+        wallet.name, callback_data=f"transfer_wallet_{wallet.id}"))
+
+
 @admin_required
 async def process_remove_wallet_country(callback_query: types.CallbackQuery):
     """Обработка выбора страны для удаления кошелька"""
     await callback_query.answer()
     country_id = callback_query.data.split('_|_')[-1]
-    if country_id == "O":
-        wallets = await get_wallets_by_wallet_type("Общий")
-    else:
-        wallets = await get_wallets_by_country_id(country_id)
-    if not wallets:
+    page = await remove_wallet_paginator.render(0, country_id)
+    if not page.rows:
         await callback_query.message.answer(
             "Нет кошельков для этой страны, выберите другую")
         return
-    keyboard = types.InlineKeyboardMarkup()
-    for wallet in wallets:
-        button_remove_wallet = types.InlineKeyboardButton(wallet.name,
-                                                          callback_data=f"remove_wallet_|_{wallet.id}")
-        keyboard.add(button_remove_wallet)
     await callback_query.message.answer("Выберите кошелек для удаления",
-                                        reply_markup=keyboard)
+                                        reply_markup=page.keyboard)
 
 
 @admin_required
@@ -1277,23 +1347,14 @@ async def process_edit_wallet_country(callback_query: types.CallbackQuery,
     """Обработка выбора страны для редактирования кошелька"""
     await callback_query.answer()
     country_id = callback_query.data.split('_|_')[-1]
-    if country_id == "O":
-        wallets = await get_wallets_by_wallet_type("Общий")
-    else:
-        wallets = await get_wallets_by_country_id(country_id)
-    if not wallets:
+    page = await edit_wallet_paginator.render(0, country_id)
+    if not page.rows:
         await callback_query.message.answer(
             "Нет кошельков для этой страны, выберите другую")
         return
     await state.update_data(country_id=country_id)
-    keyboard = types.InlineKeyboardMarkup()
-    for wallet in wallets:
-        button_edit_wallet = types.InlineKeyboardButton(
-            f"{wallet.name} | {round(wallet.get_balance(), 3)}",
-            callback_data=f"edit_wallet_by_wallet_|_{wallet.id}")
-        keyboard.add(button_edit_wallet)
     await callback_query.message.answer("Выберите кошелек для редактирования",
-                                        reply_markup=keyboard)
+                                        reply_markup=page.keyboard)
     await EditWalletState.waiting_for_wallet_id.set()
 
 
@@ -1308,8 +1369,9 @@ async def process_edit_wallet(callback_query: types.CallbackQuery,
         return
     await state.update_data(wallet_id=wallet_id)
     data_wallet = await get_wallet_by_id(wallet_id)
+    balance = await get_ledger_balance("wallet", data_wallet.id)
     await callback_query.message.answer(
-        f"""Кошелек: {data_wallet.name}\nСтрана: {data_wallet.country.flag + ' ' + data_wallet.country.name if data_wallet.country else "Общий"}\nБаланс: {data_wallet.get_balance()}\nВыберите действие""",
+        f"""Кошелек: {data_wallet.name}\nСтрана: {data_wallet.country.flag + ' ' + data_wallet.country.name if data_wallet.country else "Общий"}\nБаланс: {balance}\nВыберите действие""",
         reply_markup=edit_wallet_keyboard)
     await EditWalletState.waiting_for_action.set()
 
@@ -1341,9 +1403,9 @@ async def process_edit_balans_wallet(message: types.Message,
     wallet = await get_wallet_by_id(wallet_id)
     await edit_wallet_balans(wallet_id, adjustment)
     await state.finish()
-    data_wallet = await get_wallet_by_id(wallet_id)
+    balance = await get_ledger_balance("wallet", wallet.id)
     await message.answer(
-        f"Баланс кошелька изменен \nБаланс: {data_wallet.get_balance()}",
+        f"Баланс кошелька изменен \nБаланс: {balance}",
         reply_markup=wallets_keyboard)
     await state.finish()
     await add_to_history(message.from_user.id, "wallet",
@@ -1525,21 +1587,14 @@ async def process_transfer_country(callback_query: types.CallbackQuery,
     await state.update_data(country_id=callback_query.data.split("_|_")[-1])
     data = await state.get_data()
     if data.get("second_variant") == "wallet":
-        if data.get("country_id") == "O":
-            wallets = await get_wallets_by_wallet_type("Общий")
-        else:
-            wallets = await get_wallets_by_country_id(data.get("country_id"))
-        if not wallets:
+        page = await transfer_wallet_paginator.render(0,
+                                                      data.get("country_id"))
+        if not page.rows:
             await callback_query.message.answer(
                 "Нет кошельков для этой страны, выберите другую")
             return
-        keyboard = types.InlineKeyboardMarkup()
-        for wallet in wallets:
-            button_wallet = types.InlineKeyboardButton(wallet.name,
-                                                       callback_data=f"transfer_wallet_{wallet.id}")
-            keyboard.add(button_wallet)
         await callback_query.message.answer("Выберите кошелек",
-                                            reply_markup=keyboard)
+                                            reply_markup=page.keyboard)
         await TransferMoneyState.waiting_for_second_variant_id.set()
     elif data.get("second_variant") == "bk":
         templates = await get_templates_by_country_id(data.get("country_id"))
@@ -1750,7 +1805,8 @@ async def process_transfer_received_sum(message: types.Message,
                 f"при {'пополнении' if replenish else 'переводе'} "
                 f"с {source_entity} '{source_name}' на {target_entity} '{target_name}' "
                 f"пользователем {message.from_user.username}"
-            )
+            ),
+            transaction_id=ans.id
         )
     else:
         if not bk:
@@ -1762,6 +1818,66 @@ async def process_transfer_received_sum(message: types.Message,
     await state.finish()
 
 
+@admin_required
+async def import_transfers_file(message: types.Message):
+    """Загрузка переводов файлом"""
+    await ImportTransfersState.waiting_for_file.set()
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(
+        "Отмена", callback_data="cancel_editing_wallet"))
+    await message.answer(
+        f"Загрузите файл .xlsx или .csv с колонками: "
+        f"{', '.join(TRANSFER_COLUMNS)}.\n"
+        f"Кошелек указывается названием, БК - «БК / профиль» (или "
+        f"«БК / профиль / страна»), также можно указать id: wallet:12, "
+        f"bk:7. Корзина БК - balance или deposit",
+        reply_markup=keyboard)
+
+
+@admin_required
+async def process_import_transfers_file(message: types.Message,
+                                        state: FSMContext):
+    """Проверка файла и создание всех переводов одной транзакцией"""
+    file_name = message.document.file_name or ""
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in (".xlsx", ".csv"):
+        await message.answer("Файл должен быть формата .xlsx или .csv")
+        return
+
+    dir_path = 'transfers_folder'
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    file_id = message.document.file_id
+    destination_path = os.path.join(dir_path, file_id + extension)
+    file_info = await message.bot.get_file(file_id)
+    await message.bot.download_file(file_info.file_path,
+                                    destination=destination_path)
+
+    result = await import_transfers(destination_path,
+                                    user_id=message.from_user.id,
+                                    username=message.from_user.username)
+    if not result.ok:
+        errors = "\n".join(f"Строка {number}: {error}"
+                           for number, error in result.errors[:20])
+        more = len(result.errors) - 20
+        if more > 0:
+            errors += f"\n... и еще {more}"
+        await message.answer(
+            f"Переводы не загружены, ошибок: {len(result.errors)}. "
+            f"Исправьте файл и отправьте снова.\n{errors}")
+        return
+    if not result.created:
+        await message.answer("В файле нет переводов")
+        return
+
+    await state.finish()
+    await message.answer(
+        f"Загружено переводов: {result.created}\n"
+        f"Отправлено: {result.sent}\n"
+        f"Комиссия: {result.commission}",
+        reply_markup=management_menu_keyboard)
+
+
 """СОЗДАНИЕ ОТЧЕТОВ"""
 
 
@@ -1782,7 +1898,7 @@ async def process_report_file(message: types.Message, state: FSMContext):
     if not message.document:
         await message.answer("Пожалуйста, загрузите файл excel для отчета")
         return
-    # скачивание файла и обработка process_excel_file
+    # скачивание файла и постановка в очередь загрузки
     file_id = message.document.file_id
     file_info = await message.bot.get_file(file_id)
     file_path = file_info.file_path
@@ -1806,19 +1922,16 @@ async def process_report_file(message: types.Message, state: FSMContext):
 
     await message.bot.download_file(file_path, destination=destination_path)
 
-    ans = await process_excel_file(destination_path)
-    if ans:
-        await message.answer("Файл excel обработан.")
-        await add_to_history(message.from_user.id, "report",
-                             f"Создан отчет пользователем {message.from_user.username}")
-    else:
-        with open('errors.xlsx', 'rb') as file:
-            await message.bot.send_document(message.chat.id,
-                                            file,
-                                            caption="В вашем файле найдены ошибки. Пожалуйста, исправьте их в этом файле и отправьте снова.")
-            await add_to_history(message.from_user.id, "report",
-                                 f"Найдены ошибки при создании отчета пользователем {message.from_user.username}")
-    await state.finish()
+    progress = await message.answer("Файл поставлен в очередь на загрузку")
+    job = await create_ingest_job(destination_path,
+                                  user_id=message.from_user.id,
+                                  username=message.from_user.username,
+                                  chat_id=message.chat.id,
+                                  message_id=progress.message_id)
+    position = ingest_queue.submit(job.id)
+    await progress.edit_text(
+        f"Загрузка № {job.id} в очереди (место {position}). Можно отправить "
+        f"следующий файл или нажать «Отмена»")
 
 
 @admin_required
@@ -1946,6 +2059,11 @@ def register_wallets_handlers(dp):
                                 state=TransferMoneyState.waiting_for_sent_sum)
     dp.register_message_handler(process_transfer_received_sum,
                                 state=TransferMoneyState.waiting_for_received_sum)
+    dp.register_message_handler(import_transfers_file, lambda
+        message: message.text == "💳 Загрузить переводы")
+    dp.register_message_handler(process_import_transfers_file,
+                                state=ImportTransfersState.waiting_for_file,
+                                content_types=types.ContentType.DOCUMENT)
 
 
 def register_bk_management_handlers(dp):
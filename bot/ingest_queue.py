@@ -0,0 +1,151 @@
+"""Очередь фоновой загрузки файлов отчетов
+
+Загруженный файл становится задачей IngestJob в базе и обрабатывается
+одним из INGEST_WORKERS обработчиков, так что администратор сразу может
+продолжать работу и ставить в очередь следующие файлы. Ход загрузки
+показывается редактированием одного сообщения, не чаще раза в
+PROGRESS_INTERVAL секунд. Прогресс хранится в базе, поэтому после
+перезапуска бота незавершенные задачи продолжаются с места остановки.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import MessageNotModified, TelegramAPIError
+
+from data.utils import get_unfinished_ingest_jobs, add_to_history
+from data.models import IngestJob
+from report_logic.excel_ingest import run_ingest_job
+from bot.profiler import profiler
+
+_logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = 2
+PROGRESS_INTERVAL = 2
+
+
+def format_progress(job_id, result, done=False) -> str:
+    total = f"/{result.total}" if result.total else ""
+    status = "завершена" if done else "в работе"
+    return (f"Загрузка № {job_id} {status}: {result.rows}{total} строк, "
+            f"добавлено отчетов: {result.created}, ошибок: {result.errors}")
+
+
+class _ProgressMessage:
+    """Редактирование сообщения с прогрессом с ограничением частоты"""
+
+    def __init__(self, bot: Bot, job: IngestJob):
+        self.bot = bot
+        self.job = job
+        self._last_edit = 0.0
+
+    async def edit(self, text: str, force=False):
+        if not self.job.chat_id or not self.job.message_id:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_INTERVAL:
+            return
+        self._last_edit = now
+        try:
+            await self.bot.edit_message_text(text, self.job.chat_id,
+                                             self.job.message_id)
+        except MessageNotModified:
+            pass
+        except TelegramAPIError as e:
+            _logger.warning("ingest job %s: progress not updated: %s",
+                            self.job.id, e)
+
+    async def update(self, result):
+        await self.edit(format_progress(self.job.id, result))
+
+
+class IngestQueue:
+    """
+    Пул обработчиков задач загрузки
+
+    Поля:
+    workers -- количество одновременно обрабатываемых файлов
+    """
+
+    def __init__(self, workers=INGEST_WORKERS):
+        self.workers = workers
+        self.bot = None
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def start(self, bot: Bot):
+        """Запуск обработчиков и возобновление незавершенных задач"""
+        self.bot = bot
+        for job in await get_unfinished_ingest_jobs():
+            _logger.info("resuming ingest job %s", job.id)
+            self._queue.put_nowait(job.id)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"ingest-worker:{n}")
+            for n in range(self.workers)]
+
+    def submit(self, job_id: int) -> int:
+        """Постановка задачи в очередь, возвращает ее место в очереди"""
+        self._queue.put_nowait(job_id)
+        return self._queue.qsize()
+
+    async def join(self):
+        """Ожидание обработки всех задач в очереди"""
+        await self._queue.join()
+
+    async def shutdown(self):
+        # прерванные задачи останутся running и продолжатся при запуске
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                async with profiler.capture("ingest_job"):
+                    await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception("ingest job %s failed", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id: int):
+        job = await IngestJob.get(id=job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return
+        progress = _ProgressMessage(self.bot, job)
+        try:
+            result, errors_path = await run_ingest_job(
+                job_id, on_progress=progress.update)
+        except Exception as e:
+            await progress.edit(f"Загрузка № {job_id} прервана: {e}",
+                                force=True)
+            raise
+
+        await progress.edit(format_progress(job_id, result, done=True),
+                            force=True)
+        if errors_path is None:
+            await add_to_history(job.user_id, "report",
+                                 f"Создан отчет пользователем {job.username}")
+            return
+        if job.chat_id:
+            with open(errors_path, 'rb') as file:
+                await self.bot.send_document(
+                    job.chat_id, types.InputFile(file),
+                    caption=f"В файле загрузки № {job_id} найдены ошибки "
+                            f"({result.errors}). Пожалуйста, исправьте их в "
+                            f"этом файле и отправьте снова.")
+        await add_to_history(job.user_id, "report",
+                             f"Найдены ошибки при создании отчета "
+                             f"пользователем {job.username}")
+
+
+ingest_queue = IngestQueue()
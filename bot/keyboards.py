@@ -82,8 +82,9 @@ wallets_keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
 button_add_wallet = types.KeyboardButton("💳 Добавить кошелек")
 button_edit_wallet = types.KeyboardButton("💳 Изменить кошелек")
 button_remove_wallet = types.KeyboardButton("💳 Удалить кошелек")
+button_import_transfers = types.KeyboardButton("💳 Загрузить переводы")
 wallets_keyboard.add(button_add_wallet, button_edit_wallet)
-wallets_keyboard.add(button_remove_wallet)
+wallets_keyboard.add(button_remove_wallet, button_import_transfers)
 wallets_keyboard.add(button_menu)
 
 """Клавиатура для редактирования кошелька"""
@@ -177,6 +178,7 @@ general_stats_keyboard = types.ReplyKeyboardMarkup(
         ],
         [
             types.KeyboardButton(text="📑 История операций"),
+            types.KeyboardButton(text="Сводная статистика"),
         ],
         [
             button_admin_menu,
@@ -212,6 +214,7 @@ balance_stats_keyboard = types.ReplyKeyboardMarkup(
             types.KeyboardButton(text="Статистика по направлению"),
         ],
         [
+            types.KeyboardButton(text="Балансы на дату"),
             button_admin_menu,
         ]
     ],
@@ -237,6 +240,9 @@ history_stats_keyboard = types.ReplyKeyboardMarkup(
             types.KeyboardButton(text="История комиссий"),
             types.KeyboardButton(text="История операций"),
         ],
+        [
+            types.KeyboardButton(text="Статистика комиссий"),
+        ],
         [
             button_admin_menu,
         ]
@@ -0,0 +1,143 @@
+"""Метрики бота на локальном HTTP-порту
+
+GET http://127.0.0.1:METRICS_PORT/metrics отдает реестр data.metrics в
+текстовом формате Prometheus. MetricsMiddleware считает входящие
+обновления и время каждого обработчика (метка handler - имя функции,
+зарегистрированной в register_*_handlers). Состояние пула соединений и
+кэша статистики снимается при каждом запросе метрик. METRICS_PORT=0
+отключает сервер.
+"""
+import logging
+import os
+import time
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from data.config import async_engine
+from data.cache import cache_metrics
+from data.metrics import registry
+
+
+_logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+UPDATES = registry.counter(
+    "bot_updates_total", "Telegram updates received", ("type",))
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds", "Handler execution time", ("event", "handler"))
+DB_POOL = registry.gauge(
+    "db_pool_connections", "Database pool connections", ("state",))
+CACHE_HITS = registry.gauge(
+    "stats_cache_hits", "Statistics cache hits", ("function",))
+CACHE_MISSES = registry.gauge(
+    "stats_cache_misses", "Statistics cache misses", ("function",))
+CACHE_SIZE = registry.gauge(
+    "stats_cache_entries", "Statistics cache entries", ("function",))
+
+
+@registry.collector
+def _collect_pool():
+    pool = async_engine.pool
+    # у пула базы в памяти (StaticPool) нет счетчиков
+    if hasattr(pool, "checkedout"):
+        DB_POOL.set(pool.checkedout(), state="checked_out")
+        DB_POOL.set(pool.checkedin(), state="idle")
+        DB_POOL.set(pool.overflow(), state="overflow")
+
+
+@registry.collector
+def _collect_cache():
+    for name, metrics in cache_metrics().items():
+        CACHE_HITS.set(metrics.hits, function=name)
+        CACHE_MISSES.set(metrics.misses, function=name)
+        CACHE_SIZE.set(metrics.size, function=name)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Счетчик обновлений и время обработчиков сообщений и кнопок"""
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        for update_type in ("message", "callback_query", "inline_query",
+                            "edited_message", "my_chat_member"):
+            if getattr(update, update_type, None) is not None:
+                break
+        else:
+            update_type = "other"
+        UPDATES.inc(type=update_type)
+
+    @staticmethod
+    def _start(data: dict):
+        handler = current_handler.get()
+        data["_metrics_handler"] = getattr(handler, "__name__", "unknown")
+        data["_metrics_started"] = time.perf_counter()
+
+    @staticmethod
+    def _finish(event: str, data: dict):
+        started = data.pop("_metrics_started", None)
+        if started is not None:
+            HANDLER_SECONDS.observe(time.perf_counter() - started,
+                                    event=event,
+                                    handler=data.pop("_metrics_handler"))
+
+    async def on_process_message(self, message, data: dict):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict):
+        self._finish("message", data)
+
+    async def on_process_callback_query(self, call, data: dict):
+        self._start(data)
+
+    async def on_post_process_callback_query(self, call, results,
+                                             data: dict):
+        self._finish("callback_query", data)
+
+    async def on_process_inline_query(self, query, data: dict):
+        self._start(data)
+
+    async def on_post_process_inline_query(self, query, results,
+                                           data: dict):
+        self._finish("inline_query", data)
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(),
+                        content_type="text/plain", charset="utf-8")
+
+
+class MetricsServer:
+    """HTTP-сервер /metrics в цикле событий бота"""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", _metrics_view)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            # занятый порт не должен мешать запуску бота
+            _logger.warning("metrics server not started: %s", e)
+            await self.shutdown()
+            return
+        _logger.info("metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def shutdown(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics_server = MetricsServer()
@@ -0,0 +1,109 @@
+"""Постраничные inline-клавиатуры для длинных списков
+
+Каждый список описывается объектом Paginator с уникальным именем. Кнопки
+навигации несут в callback_data только имя списка, номер страницы и
+короткий аргумент (например id шаблона или период), поэтому при
+перелистывании из базы читается только одна страница (LIMIT/OFFSET).
+"""
+from dataclasses import dataclass
+from typing import Optional
+from aiogram import types
+from aiogram.utils.exceptions import MessageNotModified
+
+PAGE_SIZE = 10
+PAGE_CALLBACK_PREFIX = "page"
+
+# реестр всех постраничных списков: имя -> Paginator
+paginators = {}
+
+
+@dataclass
+class Page:
+    rows: list
+    text: Optional[str]
+    keyboard: types.InlineKeyboardMarkup
+
+
+class Paginator:
+    """
+    Постраничный список
+
+    Поля:
+    name -- уникальное имя списка (попадает в callback_data)
+    fetch -- корутина fetch(arg, user_id, offset, limit), возвращающая строки
+    make_button -- функция, строящая кнопку по строке (необязательно)
+    make_text -- функция make_text(rows, page), строящая текст страницы
+                 (необязательно)
+    footer -- кнопки, добавляемые под списком на каждой странице
+    page_size -- количество строк на странице
+    """
+
+    def __init__(self, name, fetch, make_button=None, make_text=None,
+                 footer=(), page_size=PAGE_SIZE):
+        self.name = name
+        self.fetch = fetch
+        self.make_button = make_button
+        self.make_text = make_text
+        self.footer = list(footer)
+        self.page_size = page_size
+        paginators[name] = self
+
+    def callback_data(self, page: int, arg="") -> str:
+        return f"{PAGE_CALLBACK_PREFIX}_|_{self.name}_|_{page}_|_{arg}"
+
+    async def render(self, page: int = 0, arg="", user_id=None) -> Page:
+        """Загрузка одной страницы и построение клавиатуры"""
+        # берем на одну строку больше, чтобы узнать, есть ли следующая страница
+        rows = list(await self.fetch(arg, user_id, page * self.page_size,
+                                     self.page_size + 1))
+        has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        keyboard = types.InlineKeyboardMarkup()
+        if self.make_button:
+            for row in rows:
+                keyboard.add(self.make_button(row))
+        navigation = []
+        if page > 0:
+            navigation.append(types.InlineKeyboardButton(
+                "◀️", callback_data=self.callback_data(page - 1, arg)))
+        if page > 0 or has_next:
+            navigation.append(types.InlineKeyboardButton(
+                f"стр. {page + 1}", callback_data=self.callback_data(page, arg)))
+        if has_next:
+            navigation.append(types.InlineKeyboardButton(
+                "▶️", callback_data=self.callback_data(page + 1, arg)))
+        if navigation:
+            keyboard.row(*navigation)
+        for button in self.footer:
+            keyboard.add(button)
+
+        text = self.make_text(rows, page) if self.make_text else None
+        return Page(rows=rows, text=text, keyboard=keyboard)
+
+
+async def process_page(call: types.CallbackQuery):
+    """Перелистывание страницы любого постраничного списка"""
+    await call.answer()
+    _, name, page, arg = call.data.split("_|_", 3)
+    paginator = paginators.get(name)
+    if paginator is None:
+        return
+    page = await paginator.render(int(page), arg, call.from_user.id)
+    if not page.rows:
+        await call.message.answer("Список пуст")
+        return
+    try:
+        if page.text is not None:
+            await call.message.edit_text(page.text,
+                                         reply_markup=page.keyboard)
+        else:
+            await call.message.edit_reply_markup(reply_markup=page.keyboard)
+    except MessageNotModified:
+        # нажата кнопка текущей страницы
+        pass
+
+
+def register_pagination_handlers(dp):
+    dp.register_callback_query_handler(process_page, lambda
+        c: c.data.startswith(f"{PAGE_CALLBACK_PREFIX}_|_"), state="*")
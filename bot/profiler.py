@@ -0,0 +1,211 @@
+"""Профилирование по запросу администратора
+
+Команда /profile включает cProfile на следующие N обработанных обновлений
+или на N вызовов обработчика с заданным именем (в том числе "ingest_job" -
+фоновая загрузка файла отчетов). Вместе с профилем собирается время
+SQL-запросов. По окончании окна администратору отправляется файл с
+самыми горячими функциями и запросами.
+
+ProfilerMiddleware регистрируется в create_dispatcher один раз и, пока
+профилировщик не включен, сразу возвращается (if not profiler.armed), а
+обработчики событий движка подключаются только на время окна. Обработчики
+asyncio выполняются вперемешку, и в профиль попадает все, что
+выполнялось, пока профилируемый обработчик не закончился.
+"""
+import cProfile
+import io
+import logging
+import pstats
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from aiogram import Bot, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from sqlalchemy import event
+
+from data.config import async_engine
+
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TOP = 30
+# длина текста запроса в отчете
+SQL_TEXT_LIMIT = 300
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    def __init__(self, profiler: 'Profiler'):
+        super().__init__()
+        self.profiler = profiler
+
+    async def _start(self, data: dict):
+        if not self.profiler.armed:
+            return
+        handler = getattr(current_handler.get(), "__name__", "unknown")
+        if self.profiler.wants(handler):
+            data["_profiler_token"] = self.profiler.start()
+
+    async def _finish(self, data: dict):
+        token = data.pop("_profiler_token", None)
+        if token is not None:
+            await self.profiler.finish(token)
+
+    async def on_process_message(self, message, data: dict):
+        await self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict):
+        await self._finish(data)
+
+    async def on_process_callback_query(self, call, data: dict):
+        await self._start(data)
+
+    async def on_post_process_callback_query(self, call, results,
+                                             data: dict):
+        await self._finish(data)
+
+    async def on_process_inline_query(self, query, data: dict):
+        await self._start(data)
+
+    async def on_post_process_inline_query(self, query, results,
+                                           data: dict):
+        await self._finish(data)
+
+
+class Profiler:
+    """
+    Окно профилирования
+
+    Поля:
+    remaining -- сколько вызовов еще профилировать (0 - выключен)
+    handler -- имя обработчика (None - любой)
+    top -- сколько функций и запросов включать в отчет
+    chat_id -- куда отправить отчет
+    """
+
+    def __init__(self):
+        self.remaining = 0
+        self.handler: Optional[str] = None
+        self.top = DEFAULT_TOP
+        self.chat_id = None
+        self._bot: Optional[Bot] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._active = 0
+        self._captured = []
+        self._sql = defaultdict(lambda: [0, 0.0])
+
+    @property
+    def armed(self) -> bool:
+        return self.remaining > 0
+
+    def arm(self, bot: Bot, chat_id, count=1, handler=None,
+            top=DEFAULT_TOP):
+        """Включение профилирования на count вызовов"""
+        if self.armed:
+            self.disarm()
+        self.remaining = count
+        self.handler = handler
+        self.top = top
+        self.chat_id = chat_id
+        self._bot = bot
+        self._profile = cProfile.Profile()
+        self._captured = []
+        self._sql.clear()
+        sync_engine = async_engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute",
+                     self._before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute",
+                     self._after_cursor_execute)
+
+    def disarm(self):
+        """Выключение: обработчики событий движка снимаются"""
+        self.remaining = 0
+        sync_engine = async_engine.sync_engine
+        for name, listener in (
+                ("before_cursor_execute", self._before_cursor_execute),
+                ("after_cursor_execute", self._after_cursor_execute)):
+            if event.contains(sync_engine, name, listener):
+                event.remove(sync_engine, name, listener)
+        if self._active and self._profile is not None:
+            self._profile.disable()
+        self._active = 0
+
+    def wants(self, name: str) -> bool:
+        return self.armed and (self.handler is None or self.handler == name)
+
+    def start(self):
+        """Начало профилируемого вызова, возвращает метку для finish"""
+        self.remaining -= 1
+        if not self._active:
+            self._profile.enable()
+        self._active += 1
+        return self._profile, time.perf_counter()
+
+    async def finish(self, token):
+        profile, started = token
+        if profile is not self._profile:
+            return
+        self._captured.append(time.perf_counter() - started)
+        self._active -= 1
+        if not self._active:
+            profile.disable()
+        if not self.armed and not self._active:
+            chat_id, bot = self.chat_id, self._bot
+            text = self.report()
+            self.disarm()
+            await self._send(bot, chat_id, text)
+
+    @asynccontextmanager
+    async def capture(self, name: str):
+        """Профилирование участка кода вне обработчиков (фоновых задач)"""
+        if not self.wants(name):
+            yield
+            return
+        token = self.start()
+        try:
+            yield
+        finally:
+            await self.finish(token)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if self._active:
+            conn.info.setdefault("profiler_started", []).append(
+                time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        started = conn.info.get("profiler_started")
+        if started:
+            stats = self._sql[" ".join(statement.split())[:SQL_TEXT_LIMIT]]
+            stats[0] += 1
+            stats[1] += time.perf_counter() - started.pop()
+
+    def report(self) -> str:
+        output = io.StringIO()
+        target = self.handler or "любой обработчик"
+        output.write(f"Профиль: {target}, вызовов {len(self._captured)}, "
+                     f"время {sum(self._captured):.3f} с\n\n")
+        output.write(f"SQL (топ {self.top} по времени):\n")
+        queries = sorted(self._sql.items(), key=lambda item: -item[1][1])
+        for statement, (count, seconds) in queries[:self.top]:
+            output.write(f"{seconds:9.4f} с  {count:6d}×  {statement}\n")
+        output.write(f"\nФункции (топ {self.top} по общему времени):\n")
+        pstats.Stats(self._profile, stream=output) \
+            .sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        return output.getvalue()
+
+    @staticmethod
+    async def _send(bot: Bot, chat_id, text: str):
+        file = types.InputFile(io.BytesIO(text.encode()),
+                               filename="profile.txt")
+        try:
+            await bot.send_document(chat_id, file,
+                                    caption="Профилирование завершено")
+        except Exception as e:
+            _logger.error("profile report not sent: %s", e)
+
+
+profiler = Profiler()
@@ -0,0 +1,307 @@
+"""Планировщик фоновых задач внутри процесса бота
+
+Задачи описываются cron-выражением из пяти полей (минута, час, день месяца,
+месяц, день недели; 0 и 7 - воскресенье), поддерживаются *, списки,
+диапазоны и шаг: "5 0 * * *", "*/15 * * * *", "0 3 * * 1-5". Как в
+стандартном cron, если ограничены и день месяца, и день недели (оба поля
+не начинаются с *), достаточно совпадения любого из них: "0 0 1 * 1" -
+первое число каждого месяца и каждый понедельник.
+
+Каждая задача выполняется в своем цикле: ждет ближайшего времени по
+расписанию плюс случайную задержку (jitter) и запускается, только если
+предыдущий запуск уже закончился (single-flight).
+"""
+import asyncio
+import datetime
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+_logger = logging.getLogger(__name__)
+
+CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+)
+
+# ограничение поиска следующего запуска (выражения вида "0 0 31 2 *")
+MAX_LOOKAHEAD = datetime.timedelta(days=366 * 4)
+
+
+def _parse_cron_field(value: str, low: int, high: int) -> frozenset:
+    result = set()
+    for part in value.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step <= 0:
+                raise ValueError(f"invalid cron step: {value}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+        else:
+            start = end = int(part)
+            if step != 1:
+                end = high
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron value out of range: {value}")
+        result.update(range(start, end + 1, step))
+    return frozenset(result)
+
+
+class CronSchedule:
+    """
+    Расписание в формате cron
+
+    Поля:
+    expression -- исходное выражение
+    minute, hour, day, month, weekday -- множества допустимых значений
+                                         (день недели: 0 - воскресенье)
+    day_or_weekday -- ограничены оба поля дня, достаточно совпадения одного
+    """
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != len(CRON_FIELDS):
+            raise ValueError(f"cron expression must have 5 fields: "
+                             f"{expression}")
+        self.expression = expression
+        for part, (name, low, high) in zip(parts, CRON_FIELDS):
+            setattr(self, name, _parse_cron_field(part, low, high))
+        if 7 in self.weekday:
+            self.weekday = self.weekday - {7} | {0}
+        self.day_or_weekday = not (parts[2].startswith("*") or
+                                   parts[4].startswith("*"))
+
+    @staticmethod
+    def _weekday(moment: datetime.datetime) -> int:
+        return moment.isoweekday() % 7
+
+    def _day_matches(self, moment: datetime.datetime) -> bool:
+        day = moment.day in self.day
+        weekday = self._weekday(moment) in self.weekday
+        if self.day_or_weekday:
+            return day or weekday
+        return day and weekday
+
+    def matches(self, moment: datetime.datetime) -> bool:
+        return (moment.minute in self.minute and moment.hour in self.hour
+                and moment.month in self.month and self._day_matches(moment))
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """Ближайшее время запуска строго после moment"""
+        candidate = moment.replace(second=0, microsecond=0) + \
+            datetime.timedelta(minutes=1)
+        limit = moment + MAX_LOOKAHEAD
+        while candidate <= limit:
+            if candidate.month not in self.month or \
+                    not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(
+                    hour=0, minute=0)
+            elif candidate.hour not in self.hour:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(
+                    minute=0)
+            elif candidate.minute not in self.minute:
+                candidate += datetime.timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron expression never fires: {self.expression}")
+
+
+@dataclass
+class JobMetrics:
+    """
+    Статистика выполнения задачи
+
+    Поля:
+    runs -- количество завершенных запусков
+    failures -- количество запусков, завершившихся ошибкой
+    skipped -- запуски, пропущенные из-за незавершенного предыдущего
+    total_seconds -- суммарное время выполнения
+    last_seconds -- время выполнения последнего запуска
+    max_seconds -- максимальное время выполнения
+    last_started -- время начала последнего запуска
+    last_error -- текст последней ошибки
+    """
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    total_seconds: float = 0
+    last_seconds: float = 0
+    max_seconds: float = 0
+    last_started: Optional[datetime.datetime] = None
+    last_error: Optional[str] = None
+
+    @property
+    def avg_seconds(self) -> float:
+        return self.total_seconds / self.runs if self.runs else 0
+
+
+class Job:
+    """
+    Фоновая задача
+
+    Поля:
+    name -- уникальное имя задачи
+    func -- корутинная функция без аргументов
+    schedule -- расписание CronSchedule
+    jitter -- максимальная случайная задержка запуска в секундах
+    timeout -- ограничение времени выполнения в секундах (необязательно)
+    metrics -- статистика выполнения
+    """
+
+    def __init__(self, name, func, schedule: CronSchedule, jitter=0,
+                 timeout=None):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.timeout = timeout
+        self.metrics = JobMetrics()
+        self.next_run: Optional[datetime.datetime] = None
+        self._running: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._running is not None and not self._running.done()
+
+    def spawn(self) -> Optional[asyncio.Task]:
+        """
+        Запуск задачи в отдельной asyncio-задаче с учетом single-flight
+
+        Возвращает None, если предыдущий запуск еще не закончился.
+        """
+        if self.is_running:
+            self.metrics.skipped += 1
+            _logger.warning("job %s is still running, skipped", self.name)
+            return None
+        self._running = asyncio.create_task(self._execute(),
+                                            name=f"job-run:{self.name}")
+        return self._running
+
+    async def run(self) -> bool:
+        """Однократный запуск с ожиданием завершения"""
+        task = self.spawn()
+        if task is None:
+            return False
+        await task
+        return True
+
+    async def _execute(self):
+        self.metrics.last_started = datetime.datetime.now()
+        started = time.perf_counter()
+        try:
+            if self.timeout:
+                await asyncio.wait_for(self.func(), self.timeout)
+            else:
+                await self.func()
+            self.metrics.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.metrics.failures += 1
+            self.metrics.last_error = repr(e)
+            _logger.exception("job %s failed", self.name)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.runs += 1
+            self.metrics.total_seconds += elapsed
+            self.metrics.last_seconds = elapsed
+            self.metrics.max_seconds = max(self.metrics.max_seconds, elapsed)
+
+
+class Scheduler:
+    """Набор фоновых задач с общим запуском и остановкой"""
+
+    def __init__(self):
+        self.jobs = {}
+        self._tasks = {}
+
+    def add_job(self, name, func, cron: str, jitter=0, timeout=None) -> Job:
+        if name in self.jobs:
+            raise ValueError(f"job {name} already registered")
+        job = Job(name, func, CronSchedule(cron), jitter, timeout)
+        self.jobs[name] = job
+        if self._tasks:
+            self._start_job(job)
+        return job
+
+    def job(self, cron: str, name=None, jitter=0, timeout=None):
+        """Декоратор регистрации задачи"""
+
+        def decorator(func):
+            self.add_job(name or func.__name__, func, cron, jitter, timeout)
+            return func
+
+        return decorator
+
+    async def _job_loop(self, job: Job):
+        while True:
+            now = datetime.datetime.now()
+            job.next_run = job.schedule.next_after(now)
+            delay = (job.next_run - now).total_seconds()
+            if job.jitter:
+                delay += random.uniform(0, job.jitter)
+            await asyncio.sleep(delay)
+            # запуск в отдельной задаче, чтобы долгое выполнение не сдвигало
+            # расписание; повторный запуск отсекается в Job.spawn
+            job.spawn()
+
+    def _start_job(self, job: Job):
+        self._tasks[job.name] = asyncio.create_task(self._job_loop(job),
+                                                    name=f"job:{job.name}")
+
+    def start(self):
+        for job in self.jobs.values():
+            if job.name not in self._tasks:
+                self._start_job(job)
+
+    async def run_now(self, name, wait=True) -> bool:
+        """
+        Внеплановый запуск задачи (тоже single-flight)
+
+        С wait=False задача только запускается в фоне, а shutdown отменит
+        ее вместе с остальными. Возвращает False, если предыдущий запуск
+        еще не закончился.
+        """
+        job = self.jobs[name]
+        if wait:
+            return await job.run()
+        return job.spawn() is not None
+
+    async def shutdown(self):
+        """Остановка расписаний и отмена выполняющихся задач"""
+        tasks = list(self._tasks.values())
+        tasks += [job._running for job in self.jobs.values()
+                  if job.is_running]
+        self._tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def metrics(self) -> dict:
+        return {name: job.metrics for name, job in self.jobs.items()}
+
+    def format_metrics(self) -> str:
+        lines = []
+        for name, job in self.jobs.items():
+            m = job.metrics
+            next_run = job.next_run.strftime('%d.%m.%Y %H:%M') \
+                if job.next_run else "-"
+            lines.append(
+                f"{name} [{job.schedule.expression}]: запусков {m.runs}, "
+                f"ошибок {m.failures}, пропущено {m.skipped}, "
+                f"среднее {m.avg_seconds:.2f} с, макс. {m.max_seconds:.2f} с, "
+                f"следующий {next_run}")
+        return "\n".join(lines) or "Нет фоновых задач"
+
+
+scheduler = Scheduler()
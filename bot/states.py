@@ -55,6 +55,10 @@ class TransferMoneyState(StatesGroup):
     waiting_for_second_variant_template_id = State()
 
 
+class ImportTransfersState(StatesGroup):
+    waiting_for_file = State()
+
+
 class AddingReportState(StatesGroup):
     waiting_for_report_file = State()
 
@@ -78,7 +82,10 @@ class StatisticsStates(StatesGroup):
     report_excel_period = State()
     delete_report = State()
     history_excel_period = State()
+    balance_as_of_date = State()
+    pivot_query = State()
     commissions_excel_period = State()
+    commissions_query = State()
 
 
 class UserStates(StatesGroup):
@@ -1,12 +1,64 @@
 from hisory_excel_logic.make_excel import *
 from aiogram.dispatcher import FSMContext
 from data.statistic import *
+from data.snapshots import get_balances_as_of
+from data.cache import format_cache_metrics
+from bot.profiler import profiler, DEFAULT_TOP
 from bot.utils import *
 from data.utils import *
 from bot.states import StatisticsStates
 from bot.keyboards import *
+from bot.pagination import Paginator
+from data.search import search, KIND_LABELS
 from datetime import datetime
-from report_logic.excel_reports import export_reports_to_excel
+from report_logic.excel_reports import export_reports_to_excel, \
+    export_pivot_to_excel, export_commission_stats_to_excel
+from data.pivot import run_pivot, iter_pivot_lines, parse_dimension, \
+    encode_dimensions, decode_dimensions
+from data import commissions as commission_stats
+
+
+async def fetch_source_reports(arg, user_id, offset, limit):
+    source_id, period = arg.split(":", 1)
+    start_date, end_date = parse_period_arg(period)
+    return await get_reports_by_period(start_date, end_date, int(source_id),
+                                       offset=offset, limit=limit)
+
+
+async def fetch_employees(arg, user_id, offset, limit):
+    return await get_employee_rows(offset=offset, limit=limit)
+
+
+source_reports_paginator = Paginator("source_reports", fetch_source_reports,
+                                     make_button=report_button)
+employee_stats_paginator = Paginator(
+    "employee_stats", fetch_employees,
+    make_button=lambda employee: types.InlineKeyboardButton(
+        employee.name, callback_data=f"employee_stats_|_{employee.id}"))
+
+
+# длина текста кнопки и заголовка inline-результата
+SEARCH_TITLE_LIMIT = 60
+# длина callback_data в telegram ограничена 64 байтами, запрос /find
+# попадает в нее целиком (см. search_paginator)
+CALLBACK_DATA_LIMIT = 64
+INLINE_PAGE_SIZE = 20
+
+
+async def fetch_search(arg, user_id, offset, limit):
+    return await search(arg, offset=offset, limit=limit)
+
+
+def search_button(hit):
+    """Кнопка результата поиска, открывает карточку объекта"""
+    return types.InlineKeyboardButton(
+        hit.title[:SEARCH_TITLE_LIMIT],
+        callback_data=f"search_item_|_{hit.kind}_|_{hit.ref_id}")
+
+
+search_paginator = Paginator(
+    "search", fetch_search, make_button=search_button,
+    make_text=lambda hits, page: f"Результаты поиска, стр. {page + 1}:")
 
 
 @admin_required
@@ -164,12 +216,232 @@ async def process_period_input(message: types.Message, state: FSMContext):
 async def get_balance_stats(message: types.Message):
     stats = await get_total_balances()
     if stats:
-        output = await format_balance_stats(stats)
-        await message.answer(output)
+        await answer_long(message, iter_balance_stats_lines(stats))
     else:
         await message.answer("Нет данных для отображения.")
 
 
+@admin_required
+async def get_balance_stats_as_of(message: types.Message):
+    await message.answer("Введите дату (ДД.ММ.ГГГГ):")
+    await StatisticsStates.balance_as_of_date.set()
+
+
+async def answer_balances_as_of(message: types.Message, text: str) -> bool:
+    try:
+        day = datetime.strptime(text, '%d.%m.%Y').date()
+    except ValueError:
+        await message.answer(
+            "Неверный формат даты. Введите дату в формате ДД.ММ.ГГГГ.")
+        return False
+    stats = await get_balances_as_of(day)
+    lines = [f"📅 Балансы на конец дня {day.strftime('%d.%m.%Y')}", ""]
+    lines.extend(iter_balance_stats_lines(stats))
+    await answer_long(message, lines)
+    return True
+
+
+@admin_required
+async def process_balance_as_of_date(message: types.Message,
+                                     state: FSMContext):
+    if await answer_balances_as_of(message, message.text):
+        await state.finish()
+
+
+@admin_required
+async def balances_command(message: types.Message):
+    """Команда /balances ДД.ММ.ГГГГ"""
+    if message.get_args():
+        await answer_balances_as_of(message, message.get_args().strip())
+    else:
+        await get_balance_stats_as_of(message)
+
+
+PIVOT_HELP = ("Введите измерения и период, например:\n"
+              "источник страна 01.03.2024-31.03.2024\n\n"
+              "Измерения: страна, источник, бк, сотрудник, день, неделя, "
+              "месяц")
+
+
+def parse_pivot_query(text: str):
+    """'источник страна ДД.ММ.ГГГГ-ДД.ММ.ГГГГ' -> (измерения, начало, конец)"""
+    *dimensions, period = text.split()
+    start, end = period.split("-")
+    return ([parse_dimension(d) for d in dimensions],
+            datetime.strptime(start, '%d.%m.%Y').date(),
+            datetime.strptime(end, '%d.%m.%Y').date())
+
+
+async def answer_pivot(message: types.Message, text: str) -> bool:
+    try:
+        dimensions, start_date, end_date = parse_pivot_query(text)
+        table = await run_pivot(dimensions, start_date, end_date)
+    except ValueError:
+        await message.answer("Неверный запрос.\n\n" + PIVOT_HELP)
+        return False
+    if not table.rows:
+        await message.answer("Нет отчетов за выбранный период.")
+        return True
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(
+        "Выгрузить в Excel",
+        callback_data=f"pivot_xlsx_|_{encode_dimensions(table.dimensions)}"
+                      f"_|_{period_arg(start_date, end_date)}"))
+    await answer_long(message, iter_pivot_lines(table), reply_markup=keyboard)
+    return True
+
+
+@admin_required
+async def get_pivot_stats(message: types.Message):
+    await message.answer(PIVOT_HELP)
+    await StatisticsStates.pivot_query.set()
+
+
+@admin_required
+async def process_pivot_query(message: types.Message, state: FSMContext):
+    if await answer_pivot(message, message.text):
+        await state.finish()
+
+
+@admin_required
+async def pivot_command(message: types.Message):
+    """Команда /pivot источник страна ДД.ММ.ГГГГ-ДД.ММ.ГГГГ"""
+    if message.get_args():
+        await answer_pivot(message, message.get_args())
+    else:
+        await get_pivot_stats(message)
+
+
+@admin_required
+async def export_pivot(call: types.CallbackQuery):
+    await call.answer()
+    _, dimensions, period = call.data.split("_|_")
+    start_date, end_date = parse_period_arg(period)
+    table = await run_pivot(decode_dimensions(dimensions), start_date,
+                            end_date)
+    excel_file = await export_pivot_to_excel(table)
+    filename = f"pivot_{start_date:%d.%m.%Y}-{end_date:%d.%m.%Y}.xlsx"
+    await call.message.answer_document(
+        types.InputFile(excel_file, filename=filename))
+
+
+COMMISSIONS_HELP = ("Введите измерения и период, например:\n"
+                    "кошелек тип 01.03.2024-31.03.2024\n\n"
+                    "Измерения: кошелек, бк, страна, тип, день, месяц")
+
+
+def parse_commissions_query(text: str):
+    """'кошелек тип ДД.ММ.ГГГГ-ДД.ММ.ГГГГ' -> (измерения, начало, конец)"""
+    *dimensions, period = text.split()
+    start, end = period.split("-")
+    return ([commission_stats.parse_dimension(d) for d in dimensions],
+            datetime.strptime(start, '%d.%m.%Y').date(),
+            datetime.strptime(end, '%d.%m.%Y').date())
+
+
+async def answer_commissions(message: types.Message, text: str) -> bool:
+    try:
+        dimensions, start_date, end_date = parse_commissions_query(text)
+        table = await commission_stats.run_commission_stats(
+            dimensions, start_date, end_date)
+    except ValueError:
+        await message.answer("Неверный запрос.\n\n" + COMMISSIONS_HELP)
+        return False
+    if not table.rows:
+        await message.answer("Нет переводов за выбранный период.")
+        return True
+    code = commission_stats.encode_dimensions(table.dimensions)
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(
+        "Выгрузить в Excel",
+        callback_data=f"commissions_xlsx_|_{code}"
+                      f"_|_{period_arg(start_date, end_date)}"))
+    await answer_long(message, commission_stats.iter_commission_lines(table),
+                      reply_markup=keyboard)
+    return True
+
+
+@admin_required
+async def get_commission_stats(message: types.Message):
+    await message.answer(COMMISSIONS_HELP)
+    await StatisticsStates.commissions_query.set()
+
+
+@admin_required
+async def process_commissions_query(message: types.Message,
+                                    state: FSMContext):
+    if await answer_commissions(message, message.text):
+        await state.finish()
+
+
+@admin_required
+async def commissions_command(message: types.Message):
+    """Команда /commissions кошелек тип ДД.ММ.ГГГГ-ДД.ММ.ГГГГ"""
+    if message.get_args():
+        await answer_commissions(message, message.get_args())
+    else:
+        await get_commission_stats(message)
+
+
+@admin_required
+async def export_commission_stats(call: types.CallbackQuery):
+    await call.answer()
+    _, dimensions, period = call.data.split("_|_")
+    start_date, end_date = parse_period_arg(period)
+    table = await commission_stats.run_commission_stats(
+        commission_stats.decode_dimensions(dimensions), start_date, end_date)
+    excel_file = await export_commission_stats_to_excel(table)
+    filename = f"commissions_{start_date:%d.%m.%Y}-{end_date:%d.%m.%Y}.xlsx"
+    await call.message.answer_document(
+        types.InputFile(excel_file, filename=filename))
+
+
+@admin_required
+async def show_jobs(message: types.Message):
+    """Команда /jobs - статистика фоновых задач"""
+    await message.answer(scheduler.format_metrics())
+
+
+@admin_required
+async def show_cache(message: types.Message):
+    """Команда /cache - статистика кэша статистики"""
+    await message.answer(format_cache_metrics())
+
+
+@admin_required
+async def profile_command(message: types.Message):
+    """
+    Команда /profile [N|имя_обработчика [N]] [top=K] | /profile off
+
+    Профилирует следующие N обновлений (по умолчанию 1) или N вызовов
+    обработчика с указанным именем и присылает файл с горячими функциями и
+    SQL-запросами.
+    """
+    # в отчет попадают SQL-запросы и тайминги обработчиков всех пользователей
+    if not await is_admin(message.from_user.id):
+        await message.answer("Доступно только администраторам")
+        return
+    args = message.get_args().split()
+    if args == ["off"]:
+        profiler.disarm()
+        await message.answer("Профилирование выключено")
+        return
+
+    handler, count, top = None, 1, DEFAULT_TOP
+    for arg in args:
+        if arg.startswith("top="):
+            top = int(arg[4:]) if arg[4:].isdigit() else top
+        elif arg.isdigit():
+            count = max(int(arg), 1)
+        else:
+            handler = arg
+    profiler.arm(message.bot, message.chat.id, count=count,
+                 handler=handler, top=top)
+    target = f"вызовов {handler}" if handler else "обновлений"
+    await message.answer(f"Профилирование включено: следующие {count} "
+                         f"{target}. Отчет придет файлом.")
+
+
 @admin_required
 async def get_country_stats(message: types.Message):
     countries = await get_countries()
@@ -381,13 +653,10 @@ async def pay_salaries(message: types.Message):
 
 @admin_required
 async def get_employee_stats(message: types.Message):
-    employees = await get_employees()
-    if employees:
-        keyboard = types.InlineKeyboardMarkup()
-        for employee in employees:
-            keyboard.add(types.InlineKeyboardButton(employee.name,
-                                                    callback_data=f"employee_stats_|_{employee.id}"))
-        await message.answer("Выберите сотрудника:", reply_markup=keyboard)
+    page = await employee_stats_paginator.render()
+    if page.rows:
+        await message.answer("Выберите сотрудника:",
+                             reply_markup=page.keyboard)
         await StatisticsStates.employee_stats_variant.set()
     else:
         await message.answer("Нет доступных сотрудников.")
@@ -434,14 +703,14 @@ async def process_pay_salary(call: types.CallbackQuery,
     employee_id = int(call.data.split('_|_')[1])
     employee = await get_employee(employee_id)
     if employee:
-        if employee.get_balance() <= 0:
+        if await get_ledger_balance("employee", employee.id) <= 0:
             await call.message.answer("У сотрудника нет денег на балансе.")
             return
-        await pay_employee_salary(employee_id)
+        paid = await pay_employee_salary(employee_id)
         await call.message.answer(
             f"Зарплата выплачена сотруднику {employee.name}.")
         await call.bot.send_message(employee.id,
-                                    f"Вам была выплачена зарплата в размере {employee.get_balance():.2f} EUR.")
+                                    f"Вам была выплачена зарплата в размере {paid:.2f} EUR.")
         await add_to_history(call.from_user.username, "salary",
                              f"Выплата зарплаты сотруднику {employee.name} пользователем {call.from_user.username}")
     else:
@@ -462,11 +731,11 @@ async def process_employee_salary(message: types.Message, state: FSMContext):
         try:
             adjustment_now = float(message.text)
             await update_employee_salary(employee_id, adjustment_now)
-            employee = await get_employee(employee_id)
+            balance = await get_ledger_balance("employee", employee.id)
             await message.answer(
-                f"Зарплата сотрудника обновлена на {employee.get_balance():.2f} EUR.")
+                f"Зарплата сотрудника обновлена на {balance:.2f} EUR.")
             await message.bot.send_message(employee.id,
-                                           f"Ваш баланс изменен\nВаш баланс: {employee.get_balance():.2f} EUR.")
+                                           f"Ваш баланс изменен\nВаш баланс: {balance:.2f} EUR.")
 
             operation_description = f"Изменение зарплаты сотрудника {employee.name} пользователем {message.from_user.username}"
             await add_to_history(message.from_user.username, "salary",
@@ -516,15 +785,14 @@ async def process_report_source(message: types.Message, state: FSMContext):
         data = await state.get_data()
         start_date = data['start_date']
         end_date = data['end_date']
-        reports = await get_reports_by_period(start_date, end_date, source.id)
-        if reports:
-            keyboard = await format_report_stats(reports)
-
+        page = await source_reports_paginator.render(
+            0, f"{source.id}:{period_arg(start_date, end_date)}")
+        if page.rows:
             await message.answer(".",
                                  reply_markup=general_stats_keyboard)
             await message.answer(
                 "Выберите отчет для просмотра деталей:",
-                reply_markup=keyboard)
+                reply_markup=page.keyboard)
         else:
             await message.answer(
                 "Нет отчетов для выбранного источника и периода.",
@@ -635,6 +903,101 @@ async def confirm_delete_report(call: types.CallbackQuery):
         await call.message.answer("Отчет не найден.")
 
 
+def search_arg(query: str) -> str:
+    """Запрос, обрезанный так, чтобы поместиться в callback_data страниц"""
+    free = CALLBACK_DATA_LIMIT - len(
+        search_paginator.callback_data(999).encode())
+    query = " ".join(query.split()).encode()[:free]
+    return query.decode(errors="ignore")
+
+
+async def format_search_item(kind: str, ref_id: int):
+    """Карточка найденного объекта, None если объект уже удален"""
+    if kind == "report":
+        report = await get_report_by_id(ref_id)
+        return await format_report_details(report) if report else None
+    if kind == "bookmaker":
+        stats = await get_bookmaker_stats_by_id(ref_id)
+        return await format_bookmaker_stats(stats) if stats else None
+    if kind == "wallet":
+        wallet = await get_wallet_by_id(ref_id)
+        if wallet is None:
+            return None
+        country = f"\nСтрана: {wallet.country.flag} {wallet.country.name}" \
+            if wallet.country else ""
+        balance = await get_ledger_balance("wallet", wallet.id)
+        return (f"Кошелек № {wallet.id}: {wallet.name}\n"
+                f"Тип: {wallet.wallet_type}, {wallet.general_wallet_type}"
+                f"{country}\nБаланс: {balance:.2f} €")
+    if kind == "employee":
+        employee = await get_employee(ref_id)
+        if employee is None:
+            return None
+        balance = await get_ledger_balance("employee", employee.id)
+        return (f"Сотрудник {employee.name} (@{employee.username})\n"
+                f"id: {employee.id}\n"
+                f"Баланс: {balance:.2f} €")
+    return None
+
+
+@admin_required
+async def find_command(message: types.Message):
+    """
+    Команда /find <текст> - поиск по отчетам (матч, никнейм), букмекерам,
+    кошелькам и сотрудникам. Слова ищутся по началу, результаты
+    упорядочены по релевантности.
+    """
+    if not await is_admin(message.from_user.id):
+        await message.answer("Доступно только администраторам")
+        return
+    query = search_arg(message.get_args() or "")
+    if not query:
+        await message.answer("Использование: /find <текст>")
+        return
+    page = await search_paginator.render(0, query, message.from_user.id)
+    if not page.rows:
+        await message.answer(f"По запросу «{query}» ничего не найдено")
+        return
+    await message.answer(page.text, reply_markup=page.keyboard)
+
+
+@admin_required
+async def show_search_item(call: types.CallbackQuery):
+    # кнопка из inline-результата может попасть в чат к кому угодно
+    if not await is_admin(call.from_user.id):
+        await call.answer("Доступно только администраторам",
+                          show_alert=True)
+        return
+    await call.answer()
+    _, kind, ref_id = call.data.split("_|_")
+    output = await format_search_item(kind, int(ref_id))
+    await call.message.answer(output or f"{KIND_LABELS.get(kind, kind)} "
+                                        f"№ {ref_id} не найден.")
+
+
+@admin_required
+async def inline_search(query: types.InlineQuery):
+    """Inline-поиск: @бот <текст>, следующие страницы по прокрутке"""
+    # inline-запрос может отправить любой пользователь из любого чата
+    if not await is_admin(query.from_user.id):
+        await query.answer([], cache_time=5, is_personal=True)
+        return
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    hits = await search(query.query, offset=offset,
+                        limit=INLINE_PAGE_SIZE + 1)
+    next_offset = str(offset + INLINE_PAGE_SIZE) \
+        if len(hits) > INLINE_PAGE_SIZE else ""
+    results = [types.InlineQueryResultArticle(
+        id=f"{hit.kind}:{hit.ref_id}",
+        title=hit.title[:SEARCH_TITLE_LIMIT],
+        description=KIND_LABELS[hit.kind],
+        input_message_content=types.InputTextMessageContent(hit.title),
+        reply_markup=types.InlineKeyboardMarkup().add(search_button(hit)))
+        for hit in hits[:INLINE_PAGE_SIZE]]
+    await query.answer(results, cache_time=5, is_personal=True,
+                       next_offset=next_offset)
+
+
 def register_stats_handlers(dp):
     dp.register_callback_query_handler(cancel_report, lambda
         call: call.data == "cancel", state="*")
@@ -646,6 +1009,35 @@ def register_stats_handlers(dp):
                                 state=StatisticsStates.period_input)
     dp.register_message_handler(get_balance_stats, lambda
         message: message.text == "Общая статистика балансов")
+    dp.register_message_handler(get_balance_stats_as_of, lambda
+        message: message.text == "Балансы на дату")
+    dp.register_message_handler(balances_command, commands=["balances"],
+                                state="*")
+    dp.register_message_handler(show_jobs, commands=["jobs"], state="*")
+    dp.register_message_handler(show_cache, commands=["cache"], state="*")
+    dp.register_message_handler(profile_command, commands=["profile"],
+                                state="*")
+    dp.register_message_handler(find_command, commands=["find"], state="*")
+    dp.register_callback_query_handler(show_search_item, lambda
+        c: c.data.startswith("search_item_|_"), state="*")
+    dp.register_inline_handler(inline_search, state="*")
+    dp.register_message_handler(get_pivot_stats, lambda
+        message: message.text == "Сводная статистика")
+    dp.register_message_handler(pivot_command, commands=["pivot"], state="*")
+    dp.register_message_handler(process_pivot_query,
+                                state=StatisticsStates.pivot_query)
+    dp.register_callback_query_handler(export_pivot, lambda
+        c: c.data.startswith("pivot_xlsx_|_"), state="*")
+    dp.register_message_handler(get_commission_stats, lambda
+        message: message.text == "Статистика комиссий")
+    dp.register_message_handler(commissions_command, commands=["commissions"],
+                                state="*")
+    dp.register_message_handler(process_commissions_query,
+                                state=StatisticsStates.commissions_query)
+    dp.register_callback_query_handler(export_commission_stats, lambda
+        c: c.data.startswith("commissions_xlsx_|_"), state="*")
+    dp.register_message_handler(process_balance_as_of_date,
+                                state=StatisticsStates.balance_as_of_date)
     dp.register_message_handler(get_country_stats, lambda
         message: message.text == "Статистика по стране")
     dp.register_callback_query_handler(process_country_stats,
@@ -0,0 +1,45 @@
+import pytest
+from unittest.mock import AsyncMock
+from aiogram import Bot, Dispatcher, types
+from bot.profiler import Profiler, ProfilerMiddleware
+
+
+def make_update(update_id):
+    return types.Update(**{
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "hi",
+                    "from": {"id": 5, "is_bot": False, "first_name": "A"},
+                    "chat": {"id": 1, "type": "private"}}})
+
+
+@pytest.mark.asyncio
+async def test_profiler_window():
+    bot = Bot(token="123:abc")
+    bot.send_document = AsyncMock()
+    dp = Dispatcher(bot)
+    Bot.set_current(bot)
+
+    async def slow_handler(message):
+        sum(range(1000))
+
+    dp.register_message_handler(slow_handler)
+    profiler = Profiler()
+    dp.middleware.setup(ProfilerMiddleware(profiler))
+    # выключенный профилировщик пропускает обновления
+    await dp.process_update(make_update(0))
+    profiler.arm(bot, chat_id=42, count=2, handler="slow_handler", top=5)
+
+    await dp.process_update(make_update(1))
+    assert profiler.armed
+    await dp.process_update(make_update(2))
+    # окно закрыто, отчет отправлен один раз
+    assert not profiler.armed
+    await dp.process_update(make_update(3))
+
+    bot.send_document.assert_called_once()
+    chat_id, file = bot.send_document.call_args.args
+    assert chat_id == 42
+    report = file.file.read().decode()
+    assert "вызовов 2" in report
+    assert "slow_handler" in report
+    await (await bot.get_session()).close()
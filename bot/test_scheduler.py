@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import pytest
+from bot.scheduler import CronSchedule, Scheduler
+
+
+def test_cron_next_after():
+    schedule = CronSchedule("5 0 * * *")
+    moment = datetime.datetime(2024, 1, 31, 12, 0)
+    assert schedule.next_after(moment) == datetime.datetime(2024, 2, 1, 0, 5)
+
+    schedule = CronSchedule("*/15 9-18 * * 1-5")
+    # суббота -> понедельник 9:00
+    moment = datetime.datetime(2024, 6, 1, 10, 7)
+    assert schedule.next_after(moment) == datetime.datetime(2024, 6, 3, 9, 0)
+    moment = datetime.datetime(2024, 6, 3, 10, 7)
+    assert schedule.next_after(moment) == datetime.datetime(2024, 6, 3, 10,
+                                                            15)
+
+    assert CronSchedule("0 0 * * 7").weekday == {0}
+
+    # день месяца или день недели: 1-е число (суббота) и понедельники
+    schedule = CronSchedule("0 0 1 * 1")
+    moment = datetime.datetime(2024, 5, 31, 12, 0)
+    assert schedule.next_after(moment) == datetime.datetime(2024, 6, 1, 0, 0)
+    moment = datetime.datetime(2024, 6, 1, 12, 0)
+    assert schedule.next_after(moment) == datetime.datetime(2024, 6, 3, 0, 0)
+    # день месяца начинается с * - должны совпасть оба поля
+    schedule = CronSchedule("0 0 */2 * 1")
+    assert not schedule.day_or_weekday
+    assert schedule.matches(datetime.datetime(2024, 6, 3, 0, 0))
+    assert not schedule.matches(datetime.datetime(2024, 6, 10, 0, 0))
+    with pytest.raises(ValueError):
+        CronSchedule("61 * * * *")
+
+
+@pytest.mark.asyncio
+async def test_job_single_flight():
+    scheduler = Scheduler()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await release.wait()
+
+    job = scheduler.add_job("slow", slow, "* * * * *")
+    first = job.spawn()
+    await started.wait()
+    assert job.spawn() is None
+    assert job.metrics.skipped == 1
+
+    release.set()
+    await first
+    assert job.metrics.runs == 1
+
+    async def broken():
+        raise RuntimeError("boom")
+
+    scheduler.add_job("broken", broken, "* * * * *")
+    assert await scheduler.run_now("broken")
+    assert scheduler.metrics()["broken"].failures == 1
+
+    # запуск в фоне: run_now не ждет, shutdown отменяет задачу
+    started.clear()
+    release.clear()
+    assert await scheduler.run_now("slow", wait=False)
+    await started.wait()
+    assert job.is_running
+    assert not await scheduler.run_now("slow", wait=False)
+
+    scheduler.start()
+    await scheduler.shutdown()
+    assert not job.is_running
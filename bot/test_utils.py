@@ -0,0 +1,22 @@
+from bot.utils import pack_messages
+
+
+def test_pack_messages():
+    # пустой ввод - ни одного сообщения
+    assert list(pack_messages([], limit=10)) == []
+    assert list(pack_messages([""], limit=10)) == []
+
+    # ровно limit символов вместе с переводом строки - одно сообщение
+    assert list(pack_messages(["abcd", "efghi"], limit=10)) == \
+        ["abcd\nefghi"]
+    # на символ больше - два сообщения
+    assert list(pack_messages(["abcd", "efghij"], limit=10)) == \
+        ["abcd", "efghij"]
+    # строка ровно в limit не режется
+    assert list(pack_messages(["a" * 10, "b"], limit=10)) == \
+        ["a" * 10, "b"]
+
+    # строка длиннее limit режется на части, соседние строки сохраняются
+    messages = list(pack_messages(["head", "x" * 25, "tail"], limit=10))
+    assert messages == ["head", "x" * 10, "x" * 10, "x" * 5 + "\ntail"]
+    assert all(len(message) <= 10 for message in messages)
@@ -3,9 +3,21 @@ from aiogram.dispatcher.filters import Command
 from bot.keyboards import *
 from bot.utils import *
 from bot.states import *
+from bot.pagination import Paginator
 from data.statistic import *
 
 
+async def fetch_my_reports(arg, user_id, offset, limit):
+    start_date, end_date = parse_period_arg(arg)
+    return await get_reports_by_period_and_employee(start_date, end_date,
+                                                    user_id, offset=offset,
+                                                    limit=limit)
+
+
+my_reports_paginator = Paginator("my_reports", fetch_my_reports,
+                                 make_button=report_button)
+
+
 async def start(message: types.Message):
     if await is_admin(message.from_user.id):
         await message.answer("Привет, админ!",
@@ -36,7 +48,8 @@ async def get_balance_info(message: types.Message):
     if not employee:
         await message.answer("Вы не сотрудник")
         return
-    await message.answer(f"Ваш баланс: {employee.get_balance()}")
+    balance = await get_ledger_balance("employee", employee.id)
+    await message.answer(f"Ваш баланс: {balance}")
 
 
 @employee_required
@@ -57,11 +70,10 @@ async def watch_reports(message: types.Message, state: FSMContext):
         await message.answer("Неверный формат даты")
         return
     employee_id = message.from_user.id
-    reports = await get_reports_by_period_and_employee(start_date, end_date,
-                                                       employee_id)
-    if reports:
-        keyboard = await format_report_stats(reports)
-        await message.answer("Выберите отчет", reply_markup=keyboard)
+    page = await my_reports_paginator.render(
+        0, period_arg(start_date, end_date), employee_id)
+    if page.rows:
+        await message.answer("Выберите отчет", reply_markup=page.keyboard)
         await message.answer("Введите номер отчета для просмотра деталей:")
         await UserStates.waiting_for_report_number.set()
     else:
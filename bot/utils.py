@@ -4,17 +4,48 @@ from data.tools import session_scope
 from data.models import *
 from sqlalchemy import select
 from functools import wraps
+import datetime
 from aiogram import types
 from data.utils import *
+from data.snapshots import take_balance_snapshot, get_last_snapshot_date
+from data.archive import archive_bookmakers
+from data.migrations import apply_migrations
+from bot.scheduler import scheduler
+from bot.ingest_queue import ingest_queue
+from bot.metrics import metrics_server
 
 
 async def on_startup(dp):
     # Create tables in db
     async with async_engine.begin() as conn:
         await conn.run_sync(Model.metadata.create_all)
+        await conn.run_sync(apply_migrations)
+    # проводки для транзакций, записанных до появления журнала
+    await backfill_ledger()
+    # снимок за вчера, если бот был выключен в момент плановой съемки;
+    # снимается в фоне, чтобы не задерживать запуск бота
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    last_snapshot = await get_last_snapshot_date()
+    if last_snapshot is None or last_snapshot < yesterday:
+        await scheduler.run_now("balance_snapshot", wait=False)
+    scheduler.start()
+    # фоновая загрузка отчетов, включая прерванные перезапуском задачи
+    await ingest_queue.start(dp.bot)
+    await metrics_server.start()
+
+
+# снимок балансов на конец прошедшего дня, ночью вне часов работы
+scheduler.add_job("balance_snapshot", take_balance_snapshot, "5 0 * * *",
+                  jitter=120)
+# перенос данных давно деактивированных букмекеров в архив
+scheduler.add_job("archive_bookmakers", archive_bookmakers, "30 3 * * *",
+                  jitter=300)
 
 
 async def on_shutdown(dp):
+    await scheduler.shutdown()
+    await ingest_queue.shutdown()
+    await metrics_server.shutdown()
     # Close db connection (if used)
     await dp.storage.close()
     await dp.storage.wait_closed()
@@ -46,6 +77,49 @@ def employee_required(handler):
     return wrapper
 
 
+"""Разбиение длинного текста на сообщения telegram"""
+
+MESSAGE_LIMIT = 4096
+
+
+def pack_messages(lines, limit=MESSAGE_LIMIT):
+    """
+    Упаковка строк в сообщения длиной не более limit символов
+
+    Строки не разрываются, если помещаются в одно сообщение; слишком длинная
+    строка режется на части. Сообщения выдаются по порядку.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        while len(line) > limit:
+            if chunk:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+            yield line[:limit]
+            line = line[limit:]
+        # +1 за перевод строки перед новой строкой
+        extra = len(line) + (1 if chunk else 0)
+        if size + extra > limit:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+            extra = len(line)
+        chunk.append(line)
+        size += extra
+    if chunk and any(chunk):
+        yield "\n".join(chunk)
+
+
+async def answer_long(message: types.Message, lines, **kwargs):
+    """Отправка длинного текста несколькими сообщениями по порядку"""
+    messages = list(pack_messages(lines))
+    for i, text in enumerate(messages):
+        if i == len(messages) - 1:
+            await message.answer(text, **kwargs)
+        else:
+            await message.answer(text)
+
+
 """функция для проверки строки на то что она является числом"""
 
 
@@ -57,22 +131,29 @@ def is_number(s):
         return False
 
 
-async def format_report_stats(reports):
-    keyboard = types.InlineKeyboardMarkup()
+def report_button(report):
+    """Кнопка отчета для постраничного списка отчетов"""
+    button_text = f"Отчет № {report.id} {'🔴' if report.is_error else '🟢'} ({report.real_profit:.2f} €)"
+    button_data = f"report_details_|_{report.id}"
+    return types.InlineKeyboardButton(text=button_text,
+                                      callback_data=button_data)
+
+
+"""Период в callback_data постраничных списков: ДДММГГГГ:ДДММГГГГ"""
+
+
+def period_arg(start_date, end_date):
+    return f"{start_date:%d%m%Y}:{end_date:%d%m%Y}"
 
-    for i, report in enumerate(reports, start=1):
-        button_text = f"Отчет № {report.id} {'🔴' if report.is_error else '🟢'} ({report.real_profit:.2f} €)"
-        button_data = f"report_details_|_{report.id}"
-        keyboard.add(types.InlineKeyboardButton(text=button_text,
-                                                callback_data=button_data))
 
-    return keyboard
+def parse_period_arg(arg):
+    start_date, end_date = arg.split(":")
+    return (datetime.datetime.strptime(start_date, "%d%m%Y").date(),
+            datetime.datetime.strptime(end_date, "%d%m%Y").date())
 
 
 async def pay_all_salaries(message: types.Message):
-    employees = await get_employees()
-    for employee in employees:
-        if employee.get_balance() > 0:
-            await pay_employee_salary(employee.id)
-            await message.bot.send_message(employee.id,
-                                           f"Вам была выплачена зарплата в размере {employee.get_balance():.2f} EUR.")
+    payments = await pay_all_employee_salaries()
+    for employee_id, amount in payments.items():
+        await message.bot.send_message(employee_id,
+                                       f"Вам была выплачена зарплата в размере {amount:.2f} EUR.")
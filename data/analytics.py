@@ -0,0 +1,261 @@
+"""Векторная статистика по отчетам
+
+Отчеты за выбранный фильтр выгружаются одним запросом в колонки NumPy
+(ReportExtract), после чего все показатели считаются векторно, а
+группировка по любым измерениям (страна, источник, букмекер, сотрудник,
+день/неделя/месяц) делается через np.unique + np.bincount. Зарплата и
+штраф считаются по правилам data/salary.py над колонками NumPy, с тем же
+округлением по отчету, что и в журнале проводок.
+"""
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, Integer, type_coerce
+from data.tools import session_scope
+from data.models import *
+from data.money import to_cents, from_cents
+from data.salary import Ops, salary_cents, penalty_cents
+
+# измерение -> колонка выгрузки; периоды вычисляются из даты отчета
+DIMENSIONS = ("country", "source", "bookmaker", "employee", "day", "week",
+              "month")
+_ID_DIMENSIONS = {
+    "country": "country_id",
+    "source": "source_id",
+    "bookmaker": "bookmaker_id",
+    "employee": "employee_id",
+}
+# понедельник, от которого отсчитываются недели
+_EPOCH_MONDAY = np.datetime64("1970-01-05", "D")
+# значение вместо NULL в колонках идентификаторов
+NO_ID = -1
+
+NUMPY_OPS = Ops(
+    is_true=lambda column: column,
+    and_=np.logical_and,
+    where=np.where,
+    round=lambda values: np.trunc(values + np.copysign(0.5, values)))
+
+
+@dataclass
+class ReportMetrics:
+    """
+    Показатели группы отчетов (суммы в евро)
+
+    Поля:
+    reports -- количество отчетов
+    errors -- количество ошибочных отчетов
+    bet -- сумма ставок
+    returned -- сумма возвратов
+    profit -- прибыль
+    salary -- зарплата по неошибочным отчетам
+    penalty -- штрафы по ошибочным отчетам
+    """
+    reports: int = 0
+    errors: int = 0
+    bet: float = 0
+    returned: float = 0
+    profit: float = 0
+    salary: float = 0
+    penalty: float = 0
+
+    @property
+    def real_salary(self):
+        return from_cents(to_cents(self.salary) - to_cents(self.penalty))
+
+
+def _int_column(values, null=NO_ID) -> np.ndarray:
+    column = np.array(values, dtype=np.float64)
+    return np.where(np.isnan(column), null, column).astype(np.int64)
+
+
+def _date_column(values) -> np.ndarray:
+    # pandas переводит datetime в datetime64 в разы быстрее np.array
+    return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy(
+        dtype="datetime64[us]")
+
+
+class ReportExtract:
+    """
+    Колоночная выгрузка отчетов
+
+    Поля:
+    id, country_id, source_id, bookmaker_id, employee_id -- int64 (NULL = -1)
+    date -- datetime64[us] (NULL = NaT)
+    bet, ret -- суммы ставки и возврата в копейках (int64)
+    is_error -- bool
+    salary_percentage -- процент зарплаты (float64)
+    """
+    COLUMNS = ("id", "date", "bet", "ret", "is_error", "salary_percentage",
+               "country_id", "source_id", "bookmaker_id", "employee_id")
+
+    def __init__(self, **columns):
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+        self._metrics = None
+
+    @classmethod
+    def from_rows(cls, rows) -> 'ReportExtract':
+        """Выгрузка из строк в порядке COLUMNS"""
+        columns = list(zip(*rows)) or [()] * len(cls.COLUMNS)
+        values = dict(zip(cls.COLUMNS, columns))
+        return cls(
+            id=_int_column(values["id"]),
+            date=_date_column(values["date"]),
+            bet=_int_column(values["bet"], null=0),
+            ret=_int_column(values["ret"], null=0),
+            is_error=np.array(values["is_error"], dtype=bool),
+            salary_percentage=np.array(values["salary_percentage"],
+                                       dtype=np.float64),
+            country_id=_int_column(values["country_id"]),
+            source_id=_int_column(values["source_id"]),
+            bookmaker_id=_int_column(values["bookmaker_id"]),
+            employee_id=_int_column(values["employee_id"]),
+        )
+
+    def __len__(self):
+        return len(self.id)
+
+    def metrics(self) -> dict:
+        """Показатели каждого отчета в копейках"""
+        if self._metrics is None:
+            profit = self.ret - self.bet
+            salary = salary_cents(NUMPY_OPS, self.bet,
+                                  self.salary_percentage, self.is_error)
+            penalty = penalty_cents(NUMPY_OPS, self.bet, self.ret,
+                                    self.salary_percentage, self.is_error)
+            self._metrics = {"profit": profit, "salary": salary,
+                             "penalty": penalty}
+        return self._metrics
+
+    def dimension(self, name) -> np.ndarray:
+        """Ключи группировки по измерению"""
+        if name in _ID_DIMENSIONS:
+            return getattr(self, _ID_DIMENSIONS[name])
+        day = self.date.astype("datetime64[D]")
+        if name == "day":
+            return day
+        if name == "week":
+            return day - (day - _EPOCH_MONDAY).astype(np.int64) % 7
+        if name == "month":
+            return self.date.astype("datetime64[M]")
+        raise ValueError(f"unknown dimension: {name}")
+
+    def since(self, moment) -> np.ndarray:
+        """Маска отчетов с датой не раньше moment"""
+        return self.date >= np.datetime64(moment, "us")
+
+    def totals(self, mask=None) -> ReportMetrics:
+        """Показатели по всем отчетам (или по маске)"""
+        metrics = self.metrics()
+        if mask is None:
+            mask = slice(None)
+        return ReportMetrics(
+            reports=int(self.id[mask].size),
+            errors=int(np.count_nonzero(self.is_error[mask])),
+            bet=from_cents(int(self.bet[mask].sum())),
+            returned=from_cents(int(self.ret[mask].sum())),
+            profit=from_cents(int(metrics["profit"][mask].sum())),
+            salary=from_cents(int(metrics["salary"][mask].sum())),
+            penalty=from_cents(int(metrics["penalty"][mask].sum())),
+        )
+
+    def group_by(self, *dimensions, mask=None) -> dict:
+        """
+        Показатели по группам
+
+        Ключ результата - значение измерения, для нескольких измерений -
+        кортеж значений в порядке dimensions.
+        """
+        if not dimensions:
+            raise ValueError("at least one dimension is required")
+        extract = self if mask is None else self.select(mask)
+        if not len(extract):
+            return {}
+        keys = [extract.dimension(name) for name in dimensions]
+        codes = []
+        uniques = []
+        for key in keys:
+            unique, code = np.unique(key, return_inverse=True)
+            uniques.append(unique)
+            codes.append(code)
+        # номер группы - число в смешанной системе счисления по кодам
+        combined = np.zeros(len(extract), dtype=np.int64)
+        for unique, code in zip(uniques, codes):
+            combined = combined * len(unique) + code.reshape(-1)
+        groups, inverse = np.unique(combined, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        size = len(groups)
+        metrics = extract.metrics()
+
+        def total(weights=None):
+            return np.bincount(inverse, weights=weights, minlength=size)
+
+        reports = total()
+        errors = total(extract.is_error)
+        # суммы копеек целые, в float64 они точны до 2**53
+        bet = total(extract.bet)
+        returned = total(extract.ret)
+        profit = total(metrics["profit"])
+        salary = total(metrics["salary"])
+        penalty = total(metrics["penalty"])
+
+        result = {}
+        for index, group in enumerate(groups.tolist()):
+            key = []
+            for unique in reversed(uniques):
+                group, code = divmod(group, len(unique))
+                key.append(_plain(unique[code]))
+            key = tuple(reversed(key))
+            result[key if len(key) > 1 else key[0]] = ReportMetrics(
+                reports=int(reports[index]),
+                errors=int(errors[index]),
+                bet=from_cents(int(bet[index])),
+                returned=from_cents(int(returned[index])),
+                profit=from_cents(int(profit[index])),
+                salary=from_cents(int(salary[index])),
+                penalty=from_cents(int(penalty[index])))
+        return result
+
+    def select(self, mask) -> 'ReportExtract':
+        return ReportExtract(**{name: getattr(self, name)[mask]
+                                for name in self.COLUMNS})
+
+
+def _plain(value):
+    """numpy-скаляр -> int / datetime.date, NULL -> None"""
+    if isinstance(value, np.datetime64):
+        return value.astype(datetime.date)
+    value = int(value)
+    return None if value == NO_ID else value
+
+
+async def load_report_extract(*criteria) -> ReportExtract:
+    """Выгрузка неудаленных отчетов по фильтру одним запросом"""
+    query = (
+        select(Report.id, Report.date,
+               # суммы берем сырыми копейками, без перевода в евро
+               type_coerce(Report.bet_amount, Integer),
+               type_coerce(Report.return_amount, Integer),
+               Report.is_error, Report.salary_percentage, Report.country_id,
+               Report.source_id, Report.bookmaker_id, Report.employee_id)
+        .select_from(Report.__table__.outerjoin(
+            Bookmaker.__table__, Report.bookmaker_id == Bookmaker.id))
+        .where(Report.is_deleted == False, *criteria))
+    async with session_scope() as session:
+        result = await session.execute(query)
+        return ReportExtract.from_rows(result.all())
+
+
+async def get_report_metrics(*criteria, by=()):
+    """
+    Показатели отчетов по фильтру
+
+    Без by возвращает ReportMetrics по всем отчетам, с by - словарь
+    групп (см. ReportExtract.group_by).
+    """
+    extract = await load_report_extract(*criteria)
+    if by:
+        return extract.group_by(*by)
+    return extract.totals()
@@ -0,0 +1,190 @@
+"""Архивация отчетов и транзакций старых букмекеров
+
+Через 3 месяца после деактивации (или сразу после удаления) букмекер
+перестает участвовать в статистике: его отчеты и транзакции переносятся в
+таблицы report_archive и transaction_archive, а итоговые депозит и баланс
+замораживаются в одной строке BookmakerSummary. Bookmaker.get_balance()
+учитывает эту строку, поэтому балансы не меняются, а горячие таблицы и
+жадно загружаемые связи остаются маленькими.
+
+Транзакция переносится, только если у нее нет живого контрагента (кошелька
+или неархивируемого букмекера), иначе изменился бы баланс контрагента.
+Зарплата сотрудников по архивным отчетам переносится в их корректировку
+с проводкой в журнал в той же транзакции. Проводки архивных строк остаются
+в журнале, но их report_id и transaction_id обнуляются: SQLite отдает
+освободившийся наибольший id следующей новой строке, и старая проводка
+выглядела бы как проводка нового отчета или транзакции.
+"""
+import datetime
+from sqlalchemy import select, insert, delete, update, or_, and_, func, \
+    case, literal
+from data.tools import session_scope
+from data.models import *
+
+# через сколько после деактивации букмекер уходит в архив
+ARCHIVE_AFTER = datetime.timedelta(days=90)
+
+
+async def get_bookmakers_to_archive(now: datetime.datetime = None) -> list:
+    """Идентификаторы удаленных и давно деактивированных букмекеров"""
+    now = now or datetime.datetime.now()
+    async with session_scope() as session:
+        result = await session.execute(
+            select(Bookmaker.id).where(or_(
+                Bookmaker.is_deleted == True,
+                and_(Bookmaker.is_active == False,
+                     Bookmaker.deactivated_at <= now - ARCHIVE_AFTER))))
+        return list(result.scalars())
+
+
+def _archivable_transactions(bookmaker_ids):
+    """Транзакции букмекеров без живого контрагента"""
+    t = Transaction.__table__.c
+    return and_(
+        or_(t.sender_bookmaker_id.in_(bookmaker_ids),
+            t.receiver_bookmaker_id.in_(bookmaker_ids)),
+        t.sender_wallet_id.is_(None),
+        t.receiver_wallet_id.is_(None),
+        or_(t.sender_bookmaker_id.is_(None),
+            t.sender_bookmaker_id.in_(bookmaker_ids)),
+        or_(t.receiver_bookmaker_id.is_(None),
+            t.receiver_bookmaker_id.in_(bookmaker_ids)))
+
+
+async def archive_bookmakers(now: datetime.datetime = None) -> dict:
+    """
+    Перенос отчетов и транзакций старых букмекеров в архив
+
+    Все изменения выполняются в одной транзакции базы. Повторный запуск
+    переносит только то, что появилось после прошлой архивации, и
+    добавляет это к итогам. Возвращает количество перенесенных строк.
+    """
+    now = now or datetime.datetime.now()
+    bookmaker_ids = await get_bookmakers_to_archive(now)
+    counts = {"bookmakers": 0, "reports": 0, "transactions": 0}
+    if not bookmaker_ids:
+        return counts
+
+    archived_at = literal(now, DateTime)
+    report_filter = Report.bookmaker_id.in_(bookmaker_ids)
+    transaction_filter = _archivable_transactions(bookmaker_ids)
+    # суммы по букмекеру: id -> [депозит, баланс, отчеты, транзакции]
+    totals = {id_: [0, 0, 0, 0] for id_ in bookmaker_ids}
+
+    async with session_scope() as session:
+        profits = await session.execute(
+            select(Report.bookmaker_id,
+                   func.sum(case((Report.is_deleted == False,
+                                  Report.return_amount - Report.bet_amount),
+                                 else_=0)),
+                   func.count())
+            .where(report_filter)
+            .group_by(Report.bookmaker_id))
+        for bookmaker_id, profit, count in profits:
+            totals[bookmaker_id][1] += profit or 0
+            totals[bookmaker_id][2] += count
+
+        salaries = await session.execute(
+            select(Report.employee_id, func.sum(Report.real_salary))
+            .select_from(Report.__table__.outerjoin(
+                Bookmaker.__table__, Report.bookmaker_id == Bookmaker.id))
+            .where(report_filter, Report.is_deleted == False,
+                   Report.employee_id.is_not(None))
+            .group_by(Report.employee_id))
+        # зарплата по отчетам уже проведена в журнал, при переносе в
+        # корректировку она списывается с корзины salary
+        posted_salaries = dict((await session.execute(
+            select(LedgerEntry.entity_id, func.sum(LedgerEntry.amount))
+            .where(LedgerEntry.entity_type == "employee",
+                   LedgerEntry.bucket == "salary",
+                   LedgerEntry.report_id.in_(
+                       select(Report.id).where(report_filter)))
+            .group_by(LedgerEntry.entity_id))).all())
+        for employee_id, salary in salaries:
+            if posted_salaries.get(employee_id):
+                session.add(LedgerEntry(
+                    entity_type="employee", entity_id=employee_id,
+                    bucket="salary", amount=-posted_salaries[employee_id],
+                    timestamp=now))
+            if salary:
+                # версия увеличивается, как в Model.update, чтобы
+                # прочитанный до архивации сотрудник получил UpdateConflict
+                await session.execute(
+                    update(Employee).where(Employee.id == employee_id)
+                    .values(adjustment=func.coalesce(Employee.adjustment, 0)
+                            + salary,
+                            version=Employee.version + 1))
+                session.add(LedgerEntry(
+                    entity_type="employee", entity_id=employee_id,
+                    bucket="adjustment", amount=salary, timestamp=now))
+
+        t = Transaction.__table__.c
+        transactions = await session.execute(
+            select(t.sender_bookmaker_id, t.receiver_bookmaker_id, t.from_,
+                   t.where, t.amount, t.commission).where(transaction_filter))
+        for sender_id, receiver_id, from_, where, amount, commission in \
+                transactions:
+            if sender_id in totals:
+                if from_ == "deposit":
+                    totals[sender_id][0] -= amount
+                totals[sender_id][1] -= amount
+                totals[sender_id][3] += 1
+            if receiver_id in totals:
+                real_amount = amount - (commission or 0)
+                if where == "deposit":
+                    totals[receiver_id][0] += real_amount
+                totals[receiver_id][1] += real_amount
+                totals[receiver_id][3] += 1
+
+        await session.execute(
+            update(LedgerEntry)
+            .where(LedgerEntry.report_id.in_(
+                select(Report.id).where(report_filter)))
+            .values(report_id=None))
+        await session.execute(
+            update(LedgerEntry)
+            .where(LedgerEntry.transaction_id.in_(
+                select(Transaction.id).where(transaction_filter)))
+            .values(transaction_id=None))
+
+        report_columns = [c for c in Report.__table__.columns]
+        await session.execute(
+            insert(report_archive).from_select(
+                [c.name for c in report_columns] + ["archived_at"],
+                select(*report_columns, archived_at)
+                .where(report_filter)))
+        reports = await session.execute(
+            delete(Report.__table__).where(report_filter))
+
+        transaction_columns = [c for c in Transaction.__table__.columns]
+        await session.execute(
+            insert(transaction_archive).from_select(
+                [c.name for c in transaction_columns] + ["archived_at"],
+                select(*transaction_columns, archived_at)
+                .where(transaction_filter)))
+        transactions = await session.execute(
+            delete(Transaction.__table__).where(transaction_filter))
+
+        for bookmaker_id, (deposit, balance, reports_count,
+                           transactions_count) in totals.items():
+            if not reports_count and not transactions_count:
+                continue
+            summary = (await session.execute(
+                select(BookmakerSummary).where(
+                    BookmakerSummary.bookmaker_id == bookmaker_id))).scalar()
+            if summary is None:
+                summary = BookmakerSummary(bookmaker_id=bookmaker_id,
+                                           deposit=0, balance=0,
+                                           reports_count=0,
+                                           transactions_count=0)
+                session.add(summary)
+            summary.deposit += deposit
+            summary.balance += balance
+            summary.reports_count += reports_count
+            summary.transactions_count += transactions_count
+            summary.archived_at = now
+            counts["bookmakers"] += 1
+
+    counts["reports"] = reports.rowcount
+    counts["transactions"] = transactions.rowcount
+    return counts
@@ -1,13 +1,107 @@
+"""Базовая модель и оптимистичная блокировка
+
+У изменяемых моделей есть колонка version_column(). Model.update меняет
+строку запросом UPDATE ... WHERE <первичный ключ> AND version = :version
+и увеличивает версию, то есть ищет строку по первичному ключу, а не по
+всем колонкам. Если строку успели изменить или удалить после чтения,
+запрос не меняет ни одной строки и update поднимает UpdateConflict.
+Чтение и изменение, которое зависит от прочитанного (например,
+корректировка баланса), повторяется retry_on_conflict.
+
+Пакетные bulk_create, bulk_update и bulk_soft_delete выполняют один
+запрос на пачку строк (executemany) в одной транзакции вместо сессии на
+строку. Передав session, их и Model.update можно объединить в одну
+транзакцию с другими записями.
+"""
 import logging
 from typing import Generator
 from typing import Sequence
+from typing import Optional
+from contextlib import asynccontextmanager
+from sqlalchemy import Column, Integer
+from sqlalchemy import bindparam
+from sqlalchemy import insert
 from sqlalchemy import select
+from sqlalchemy import text
 from sqlalchemy import update
 from sqlalchemy.orm import DeclarativeBase
 from data.tools import session_scope
+from data.names import with_name_keys
 
 _logger = logging.getLogger(__name__)
 
+# Column.info: признак колонки версии
+VERSION_INFO = "row_version"
+CONFLICT_RETRIES = 3
+BULK_CHUNK_SIZE = 1000
+
+
+def version_column() -> Column:
+    """Колонка версии строки для Model.update"""
+    return Column(Integer, nullable=False, default=1,
+                  server_default=text("1"), info={VERSION_INFO: True})
+
+
+def get_version_column(table) -> Optional[Column]:
+    for column in table.columns:
+        if column.info.get(VERSION_INFO):
+            return column
+    return None
+
+
+class UpdateConflict(Exception):
+    """
+    Строки изменены или удалены после чтения
+
+    Поля:
+    table -- имя таблицы
+    keys -- первичные ключи строк, которые пытались изменить
+    """
+
+    def __init__(self, table: str, keys: list):
+        self.table = table
+        self.keys = keys
+        super().__init__(f"{table} {keys} changed or deleted concurrently")
+
+
+async def retry_on_conflict(operation, attempts: int = CONFLICT_RETRIES):
+    """
+    Выполнение operation() с повтором при UpdateConflict
+
+    operation должна заново читать изменяемые строки, иначе повтор
+    приведет к тому же конфликту.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return await operation()
+        except UpdateConflict as e:
+            if attempt == attempts:
+                raise
+            _logger.info("%s, retry %s of %s", e, attempt, attempts - 1)
+
+
+@asynccontextmanager
+async def _scope(session=None):
+    """Переданная сессия или новая транзакция session_scope"""
+    if session is not None:
+        yield session
+        return
+    async with session_scope() as session:
+        yield session
+
+
+def _groups(rows: list, chunk_size: int):
+    """
+    Номера строк пачками до chunk_size с одинаковым набором колонок
+    (executemany требует одинаковых параметров у всех строк)
+    """
+    groups = {}
+    for number, row in enumerate(rows):
+        groups.setdefault(frozenset(row), []).append(number)
+    for numbers in groups.values():
+        for start in range(0, len(numbers), chunk_size):
+            yield numbers[start:start + chunk_size]
+
 
 class Model(DeclarativeBase):
     @classmethod
@@ -28,9 +122,16 @@ class Model(DeclarativeBase):
         return instances.unique().all()
 
     @classmethod
-    async def filter(cls, *criteria) -> Sequence['Model']:
+    async def filter(cls, *criteria, order_by=None, offset: int = None,
+                     limit: int = None) -> Sequence['Model']:
         async with session_scope() as session:
             q = select(cls).filter(*criteria)
+            if order_by is not None:
+                q = q.order_by(order_by)
+            if offset:
+                q = q.offset(offset)
+            if limit is not None:
+                q = q.limit(limit)
             instances = await session.execute(q)
             instances = instances.scalars()
 
@@ -61,16 +162,22 @@ class Model(DeclarativeBase):
             instance = await cls.create(**kwargs)
             return instance, True
 
-    async def update(self, **new_values) -> 'Model':
+    async def update(self, session=None, **new_values) -> 'Model':
         new_values = self._filter_new_values(new_values)
-        async with session_scope() as session:
-            unset_values = {
-                k: getattr(self, k) for k in self.columns if
-                k not in new_values
-            }
-            q = update(self.__class__).values(**new_values).filter_by(
-                **unset_values)
-            await session.execute(q)
+        table = self.__table__
+        criteria = [column == getattr(self, column.key)
+                    for column in table.primary_key.columns]
+        version_column = get_version_column(table)
+        if version_column is not None:
+            version = getattr(self, version_column.key)
+            criteria.append(version_column == version)
+            new_values[version_column.key] = version + 1
+        async with _scope(session) as session:
+            q = update(table).values(**new_values).where(*criteria)
+            result = await session.execute(q)
+            if result.rowcount == 0:
+                raise UpdateConflict(self.__tablename__,
+                                     [self.primary_key_values()])
 
         for key, value in new_values.items():
             setattr(self, key, value)
@@ -81,9 +188,114 @@ class Model(DeclarativeBase):
         async with session_scope() as session:
             await session.delete(self)
 
+    @classmethod
+    async def bulk_create(cls, rows, return_ids: bool = False,
+                          chunk_size: int = BULK_CHUNK_SIZE, session=None):
+        """
+        Вставка строк (словарей значений колонок) по chunk_size строк за
+        запрос в одной транзакции
+
+        Значения по умолчанию и ключи названий заполняются как в create.
+        Возвращает id строк в порядке rows при return_ids, иначе
+        количество строк.
+        """
+        table = cls.__table__
+        (pk,) = table.primary_key.columns
+        rows = [cls._check_columns(row) for row in rows]
+        ids = [None] * len(rows)
+        async with _scope(session) as session:
+            for numbers in _groups(rows, chunk_size):
+                chunk = [rows[n] for n in numbers]
+                if not return_ids:
+                    await session.execute(insert(table), chunk)
+                    continue
+                result = await session.execute(
+                    insert(table).returning(
+                        pk, sort_by_parameter_order=True), chunk)
+                for number, row_id in zip(numbers, result.scalars()):
+                    ids[number] = row_id
+        return ids if return_ids else len(rows)
+
+    @classmethod
+    async def bulk_update(cls, values_by_pk: dict,
+                          chunk_size: int = BULK_CHUNK_SIZE,
+                          session=None) -> int:
+        """
+        Изменение строк {первичный ключ: {колонка: значение}} по
+        chunk_size строк за запрос (executemany) в одной транзакции
+
+        Версия строк увеличивается. Если в значениях строки передана ее
+        версия, строка меняется только при совпадении версии, иначе
+        вся транзакция откатывается с UpdateConflict. Возвращает
+        количество измененных строк.
+        """
+        table = cls.__table__
+        (pk,) = table.primary_key.columns
+        version = get_version_column(table)
+        params = []
+        for key, values in values_by_pk.items():
+            values = with_name_keys(table, cls._check_columns(dict(values)))
+            param = {f"_v_{name}": value for name, value in values.items()}
+            param["_pk"] = key
+            if version is not None and version.key in values:
+                param["_version"] = param.pop(f"_v_{version.key}")
+            params.append(param)
+
+        updated = 0
+        async with _scope(session) as session:
+            for numbers in _groups(params, chunk_size):
+                chunk = [params[n] for n in numbers]
+                names = [name[3:] for name in chunk[0]
+                         if name.startswith("_v_")]
+                q = update(table).where(pk == bindparam("_pk")).values(
+                    {name: bindparam(f"_v_{name}") for name in names})
+                checked = "_version" in chunk[0]
+                if version is not None:
+                    q = q.values({version.key: version + 1})
+                    if checked:
+                        q = q.where(version == bindparam("_version"))
+                result = await session.execute(q, chunk)
+                if checked and result.rowcount < len(chunk):
+                    raise UpdateConflict(table.name,
+                                         [param["_pk"] for param in chunk])
+                updated += result.rowcount
+        return updated
+
+    @classmethod
+    async def bulk_soft_delete(cls, *criteria, session=None) -> int:
+        """
+        Пометка удаленными (is_deleted) всех неудаленных строк по условиям
+        одним запросом, возвращает количество помеченных строк
+        """
+        table = cls.__table__
+        if "is_deleted" not in table.c:
+            raise TypeError(f"{cls.__name__} has no is_deleted column")
+        values = {"is_deleted": True}
+        version = get_version_column(table)
+        if version is not None:
+            values[version.key] = version + 1
+        async with _scope(session) as session:
+            result = await session.execute(
+                update(table).where(table.c.is_deleted == False, *criteria)
+                .values(values))
+        return result.rowcount
+
+    def primary_key_values(self) -> tuple:
+        return tuple(getattr(self, column.key)
+                     for column in self.__table__.primary_key.columns)
+
     @property
     def columns(self) -> Generator[str, str, None]:
         return (c.key for c in self.__table__.columns)
 
+    @classmethod
+    def _check_columns(cls, values: dict) -> dict:
+        unknown = set(values) - set(cls.__table__.c.keys())
+        if unknown:
+            raise TypeError(f"{cls.__name__} has no columns "
+                            f"{', '.join(sorted(unknown))}")
+        return values
+
     def _filter_new_values(self, new_value: dict):
-        return {k: v for k, v in new_value.items() if k in self.columns}
+        return with_name_keys(self.__table__, {
+            k: v for k, v in new_value.items() if k in self.columns})
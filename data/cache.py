@@ -0,0 +1,177 @@
+"""Кэш результатов статистики
+
+Функции статистики помечаются декоратором @cached: результат хранится в
+LRU по ключу из аргументов и выдается повторно, пока не изменились данные.
+Запись в таблицы, из которых считается статистика (STATS_TABLES: журнал
+проводок, отчеты, транзакции и сами страны, букмекеры, кошельки и
+сотрудники), и любой DDL через движок увеличивают глобальный счетчик
+поколения данных, и все записи кэша со старым поколением перестают
+действовать. Служебные записи (прогресс IngestJob, ошибки загрузки,
+история операций) кэш не сбрасывают. Счетчик увеличивается и при выполнении
+записи, и при ее фиксации, поэтому результат, посчитанный между ними,
+тоже не попадет в выдачу. TTL ограничивает жизнь записи на случай
+изменений в обход движка, а в ключ входит текущая дата, так как
+статистика считает периоды от сегодняшнего дня.
+
+Закэшированные объекты общие для всех вызовов - их нельзя изменять.
+"""
+import datetime
+import functools
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import event
+from data.config import async_engine
+
+_DDL_STATEMENTS = ("CREATE", "DROP", "ALTER")
+
+# таблицы, из которых читают функции с @cached
+STATS_TABLES = frozenset({"ledger_entry", "report", "transaction", "country",
+                          "bookmaker", "wallet", "employee"})
+
+_DML_TABLE = re.compile(
+    r'\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|'
+    r'UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE)
+
+_generation = 0
+# имя функции -> CachedFunction
+caches = {}
+
+
+def current_generation() -> int:
+    return _generation
+
+
+def bump_generation():
+    """Сбросить все кэши: данные в базе изменились"""
+    global _generation
+    _generation += 1
+
+
+def _changes_stats(statement: str) -> bool:
+    """Запрос меняет данные статистики: DML по STATS_TABLES или DDL"""
+    match = _DML_TABLE.match(statement)
+    if match:
+        return match.group(1).lower() in STATS_TABLES
+    return statement.lstrip().upper().startswith(_DDL_STATEMENTS)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if _changes_stats(statement):
+        conn.info["cache_dirty"] = True
+        bump_generation()
+
+
+def _after_commit(conn):
+    if conn.info.pop("cache_dirty", False):
+        bump_generation()
+
+
+def watch_engine(engine):
+    """Сбрасывать кэши при записи через движок (sync или async)"""
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "after_cursor_execute",
+                          _after_cursor_execute):
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "commit", _after_commit)
+        event.listen(engine, "rollback", _after_commit)
+
+
+@dataclass
+class CacheMetrics:
+    """
+    Счетчики кэша функции
+
+    Поля:
+    hits -- выдачи из кэша
+    misses -- вызовы функции
+    evictions -- вытеснения по размеру LRU
+    size -- текущее количество записей
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+
+class CachedFunction:
+    """Асинхронная функция с LRU-кэшем результатов"""
+
+    def __init__(self, func, maxsize: int, ttl: float):
+        self.func = func
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.metrics = CacheMetrics()
+        # ключ -> (поколение, время истечения, результат)
+        self._entries = OrderedDict()
+        functools.update_wrapper(self, func)
+
+    def _key(self, args, kwargs):
+        return (datetime.date.today(), args, tuple(sorted(kwargs.items())))
+
+    async def __call__(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        entry = self._entries.get(key)
+        if entry is not None:
+            generation, expires_at, result = entry
+            if generation == _generation and expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.metrics.hits += 1
+                return result
+            del self._entries[key]
+
+        self.metrics.misses += 1
+        # поколение берем до вызова: запись во время расчета сбросит его
+        generation = _generation
+        result = await self.func(*args, **kwargs)
+        self._entries[key] = (generation, time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.metrics.evictions += 1
+        self.metrics.size = len(self._entries)
+        return result
+
+    def clear(self):
+        self._entries.clear()
+        self.metrics.size = 0
+
+
+def cached(maxsize: int = 128, ttl: float = 300):
+    """Декоратор кэша для асинхронных функций статистики"""
+    def decorator(func):
+        cached_function = CachedFunction(func, maxsize, ttl)
+        caches[func.__name__] = cached_function
+        return cached_function
+    return decorator
+
+
+def clear_caches():
+    for cached_function in caches.values():
+        cached_function.clear()
+
+
+def cache_metrics() -> dict:
+    return {name: c.metrics for name, c in caches.items()}
+
+
+def format_cache_metrics() -> str:
+    lines = ["🗄 Кэш статистики", ""]
+    for name, metrics in cache_metrics().items():
+        lines.append(
+            f"{name}: попаданий {metrics.hits}, промахов {metrics.misses} "
+            f"({metrics.hit_rate:.0%}), записей {metrics.size}, "
+            f"вытеснено {metrics.evictions}")
+    lines.append(f"Поколение данных: {_generation}")
+    return "\n".join(lines)
+
+
+watch_engine(async_engine)
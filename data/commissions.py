@@ -0,0 +1,190 @@
+"""Аналитика комиссий по транзакциям
+
+Комиссия берется из Transaction.commission, тип - из последней связанной
+записи CommissionHistory (по transaction_id), поэтому описания комиссий не
+разбираются, а транзакция с несколькими записями истории считается один
+раз. Сумма, количество переводов и средняя комиссия по любой
+комбинации измерений (кошелек, БК, страна, тип, день, месяц) за период
+считаются одним GROUP BY по индексу transaction.timestamp.
+
+Кошелек и БК транзакции - участник перевода с этой стороны (отправитель,
+а если его нет - получатель), страна - страна транзакции, БК или
+кошелька. У записей истории, созданных до появления transaction_id, типа
+нет - такие транзакции попадают в группу "—".
+"""
+import datetime
+from dataclasses import dataclass
+from sqlalchemy import select, func, and_
+from data.tools import session_scope
+from data.models import *
+from data.money import to_cents, from_cents, money_sum
+
+_wallet_id = func.coalesce(Transaction.sender_wallet_id,
+                           Transaction.receiver_wallet_id)
+_bookmaker_id = func.coalesce(Transaction.sender_bookmaker_id,
+                              Transaction.receiver_bookmaker_id)
+_country_id = func.coalesce(Transaction.country_id, Bookmaker.country_id,
+                            Wallet.country_id)
+# последняя запись истории комиссий по каждой транзакции
+_latest_history = (
+    select(CommissionHistory.transaction_id,
+           func.max(CommissionHistory.id).label("id"))
+    .where(CommissionHistory.transaction_id.isnot(None))
+    .group_by(CommissionHistory.transaction_id)
+    .subquery())
+
+COMMISSION_DIMENSIONS = {
+    "wallet": ("Кошелек", _wallet_id, Wallet.name),
+    "bookmaker": ("БК", _bookmaker_id,
+                  func.coalesce(Bookmaker.bk_name + " " + Bookmaker.name,
+                                Bookmaker.name)),
+    "country": ("Страна", _country_id,
+                func.coalesce(Country.flag + " " + Country.name,
+                              Country.name)),
+    "type": ("Тип", None, CommissionHistory.commission_type),
+    "day": ("День", None, func.date(Transaction.timestamp)),
+    "month": ("Месяц", None, func.strftime("%Y-%m", Transaction.timestamp)),
+}
+
+# русские названия измерений для команды бота
+DIMENSION_ALIASES = {
+    "кошелек": "wallet",
+    "кошелёк": "wallet",
+    "бк": "bookmaker",
+    "букмекер": "bookmaker",
+    "страна": "country",
+    "тип": "type",
+    "день": "day",
+    "месяц": "month",
+}
+
+
+def parse_dimension(name: str) -> str:
+    name = name.strip().lower()
+    name = DIMENSION_ALIASES.get(name, name)
+    if name not in COMMISSION_DIMENSIONS:
+        raise ValueError(f"unknown dimension: {name}")
+    return name
+
+
+def encode_dimensions(dimensions) -> str:
+    """Короткая запись измерений для callback_data: первые буквы имен"""
+    return "".join(name[0] for name in dimensions)
+
+
+def decode_dimensions(code: str) -> list:
+    by_letter = {name[0]: name for name in COMMISSION_DIMENSIONS}
+    return [by_letter[letter] for letter in code]
+
+
+@dataclass(slots=True)
+class CommissionRow:
+    """
+    Строка аналитики комиссий
+
+    Поля:
+    keys -- значения измерений
+    transfers -- количество переводов
+    amount -- сумма отправленного
+    commission -- сумма комиссий
+    """
+    keys: tuple
+    transfers: int
+    amount: float
+    commission: float
+
+    @property
+    def average(self) -> float:
+        """Средняя комиссия на перевод"""
+        if not self.transfers:
+            return 0
+        return from_cents(round(to_cents(self.commission) / self.transfers))
+
+
+@dataclass
+class CommissionTable:
+    """
+    Результат запроса по комиссиям
+
+    Поля:
+    dimensions -- измерения в порядке группировки
+    start_date, end_date -- период (включительно)
+    rows -- строки CommissionRow, отсортированные по ключам
+    """
+    dimensions: tuple
+    start_date: datetime.date
+    end_date: datetime.date
+    rows: list
+
+    @property
+    def headers(self) -> list:
+        return [COMMISSION_DIMENSIONS[d][0] for d in self.dimensions]
+
+    def total(self) -> CommissionRow:
+        return CommissionRow(
+            keys=(), transfers=sum(row.transfers for row in self.rows),
+            amount=money_sum(row.amount for row in self.rows),
+            commission=money_sum(row.commission for row in self.rows))
+
+
+async def run_commission_stats(dimensions, start_date: datetime.date,
+                               end_date: datetime.date) -> CommissionTable:
+    """Комиссии по измерениям за период одним GROUP BY"""
+    dimensions = tuple(parse_dimension(d) for d in dimensions)
+    if not dimensions:
+        raise ValueError("at least one dimension is required")
+
+    labels = []
+    group_by = []
+    for index, name in enumerate(dimensions):
+        _, key, label = COMMISSION_DIMENSIONS[name]
+        labels.append(label.label(f"d{index}"))
+        group_by.append(key if key is not None else label)
+
+    query = (
+        select(*labels,
+               func.count(Transaction.id),
+               func.sum(Transaction.amount),
+               func.sum(Transaction.commission))
+        .select_from(Transaction)
+        .outerjoin(Wallet, Wallet.id == _wallet_id)
+        .outerjoin(Bookmaker, Bookmaker.id == _bookmaker_id)
+        .outerjoin(Country, Country.id == _country_id)
+        .outerjoin(_latest_history,
+                   _latest_history.c.transaction_id == Transaction.id)
+        .outerjoin(CommissionHistory,
+                   CommissionHistory.id == _latest_history.c.id)
+        .where(and_(Transaction.timestamp >= start_date,
+                    Transaction.timestamp <
+                    end_date + datetime.timedelta(days=1),
+                    Transaction.is_deleted == False))
+        .group_by(*group_by)
+        .order_by(*(label.name for label in labels)))
+
+    async with session_scope() as session:
+        result = await session.execute(query)
+        rows = [CommissionRow(keys=tuple(row[:len(dimensions)]),
+                              transfers=row[-3], amount=row[-2] or 0,
+                              commission=row[-1] or 0)
+                for row in result]
+
+    return CommissionTable(dimensions=dimensions, start_date=start_date,
+                           end_date=end_date, rows=rows)
+
+
+def iter_commission_lines(table: CommissionTable):
+    """Компактное текстовое представление аналитики комиссий"""
+    yield "💸 Комиссии: {} за {} - {}".format(
+        " × ".join(table.headers), table.start_date.strftime('%d.%m.%Y'),
+        table.end_date.strftime('%d.%m.%Y'))
+    yield (" / ".join(table.headers) +
+           " | переводы | отправлено | комиссия | средняя")
+    yield ""
+    for row in table.rows:
+        yield "{} | {} | {:.2f} | {:.2f} | {:.2f}".format(
+            " / ".join(str(k) if k is not None else "—" for k in row.keys),
+            row.transfers, row.amount, row.commission, row.average)
+    total = table.total()
+    yield ""
+    yield "Итого: {} | {:.2f} | {:.2f} | {:.2f}".format(
+        total.transfers, total.amount, total.commission, total.average)
@@ -1,9 +1,31 @@
+import os
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, event
 
 
-async_engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+# база в памяти живет в одном соединении, параллельное чтение в ней
+# невозможно - там запросы выполняются по очереди
+IN_MEMORY = ":memory:" in DATABASE_URL or DATABASE_URL.endswith("://")
+# сколько независимых запросов на чтение выполнять одновременно
+READ_CONCURRENCY = 1 if IN_MEMORY else int(
+    os.getenv("DB_READ_CONCURRENCY", "4"))
+
+if IN_MEMORY:
+    async_engine = create_async_engine(DATABASE_URL)
+else:
+    async_engine = create_async_engine(
+        DATABASE_URL, pool_size=READ_CONCURRENCY + 1, max_overflow=4)
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL: читатели не блокируют писателя и друг друга
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
 
 async_session = sessionmaker(async_engine, expire_on_commit=False, class_=AsyncSession)
 
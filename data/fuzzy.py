@@ -0,0 +1,135 @@
+"""Подсказки исправлений для названий, не найденных при загрузке
+
+Если источник, страна или букмекер из строки файла не найдены по ключу
+названия (data/names.py), в файл ошибок добавляется ближайшее похожее
+название. Похожесть - коэффициент Дайса по триграммам ключей:
+2 * общие / (триграммы запроса + триграммы названия), подсказка дается
+от MIN_SCORE.
+
+NameSuggester загружает действующие названия один раз за загрузку файла
+(при первой пачке с ненайденными названиями), поэтому подсказки
+соответствуют справочникам на момент загрузки. Поиск идет по обратному
+индексу триграмма -> номера названий (массивы numpy): число общих
+триграмм со всеми названиями считается одним np.bincount по спискам
+триграмм запроса, без перебора названий в Python. Результат запоминается
+для каждого различного запроса: тысячи строк с одной опечаткой стоят
+одного поиска.
+"""
+from collections import defaultdict
+from typing import Optional
+import numpy as np
+from sqlalchemy import select
+from data.models import Source, Country, Bookmaker
+from data.names import name_key
+
+MIN_SCORE = 0.5
+
+
+def trigrams(key: str) -> set:
+    """Триграммы ключа, с пробелами по краям для коротких слов"""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Обратный индекс триграмм
+
+    Поля:
+    values -- подсказки по порядку добавления
+    """
+
+    def __init__(self, entries=()):
+        self.values = []
+        self._sizes = []
+        self._postings = defaultdict(list)
+        # массивы numpy, собираются при первом поиске после add
+        self._arrays = None
+        self._memo = {}
+        for key, value in entries:
+            self.add(key, value)
+
+    def add(self, key: str, value):
+        grams = trigrams(key)
+        number = len(self.values)
+        self.values.append(value)
+        self._sizes.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(number)
+        self._arrays = None
+        self._memo.clear()
+
+    def _freeze(self):
+        self._arrays = (
+            {gram: np.array(numbers, dtype=np.int32)
+             for gram, numbers in self._postings.items()},
+            np.array(self._sizes, dtype=np.float64))
+
+    def best(self, key: str, min_score=MIN_SCORE) -> Optional[tuple]:
+        """(подсказка, похожесть) для ключа или None"""
+        if key in self._memo:
+            return self._memo[key]
+        if self._arrays is None:
+            self._freeze()
+        postings, sizes = self._arrays
+        grams = trigrams(key)
+        lists = [postings[gram] for gram in grams if gram in postings]
+        best = None
+        if lists:
+            shared = np.bincount(np.concatenate(lists),
+                                 minlength=len(self.values))
+            scores = 2 * shared / (len(grams) + sizes)
+            number = int(scores.argmax())
+            if scores[number] >= min_score:
+                best = (self.values[number], float(scores[number]))
+        self._memo[key] = best
+        return best
+
+
+class NameSuggester:
+    """Подсказки для источников, стран и букмекеров одной загрузки"""
+
+    def __init__(self, min_score=MIN_SCORE):
+        self.min_score = min_score
+        self.loaded = False
+        self.sources = TrigramIndex()
+        self.countries = TrigramIndex()
+        # id страны -> индекс "название БК логин" -> (название БК, логин)
+        self.bookmakers = defaultdict(TrigramIndex)
+
+    async def load(self, session):
+        """Загрузка действующих названий (один раз)"""
+        if self.loaded:
+            return
+        for name, key in await session.execute(
+                select(Source.name, Source.name_key)
+                .where(Source.is_deleted == False)):
+            self.sources.add(key or name_key(name), name)
+        for name, key in await session.execute(
+                select(Country.name, Country.name_key)
+                .where(Country.is_deleted == False)):
+            self.countries.add(key or name_key(name), name)
+        for country_id, bk_name, name in await session.execute(
+                select(Bookmaker.country_id, Bookmaker.bk_name,
+                       Bookmaker.name)
+                .where(Bookmaker.is_active == True,
+                       Bookmaker.is_deleted == False)):
+            self.bookmakers[country_id].add(
+                name_key(f"{bk_name} {name}"), (bk_name, name))
+        self.loaded = True
+
+    def _best(self, index: TrigramIndex, name):
+        found = index.best(name_key(name) or "", self.min_score)
+        return found[0] if found else None
+
+    def source(self, name) -> Optional[str]:
+        return self._best(self.sources, name)
+
+    def country(self, name) -> Optional[str]:
+        return self._best(self.countries, name)
+
+    def bookmaker(self, country_id, bk_name, login) -> Optional[tuple]:
+        """(название БК, логин) среди букмекеров страны"""
+        if country_id not in self.bookmakers:
+            return None
+        return self._best(self.bookmakers[country_id], f"{bk_name} {login}")
@@ -0,0 +1,222 @@
+"""Метрики процесса в формате Prometheus
+
+Небольшой реестр счетчиков, показателей и гистограмм без внешних
+зависимостей. Здесь же собираются метрики слоя данных: количество и время
+SQL-запросов (по событиям движка), открытые и закрытые сессии
+session_scope и скорость загрузки файлов отчетов. HTTP-выдачу и метрики
+обработчиков бота добавляет bot/metrics.py.
+"""
+import bisect
+import time
+from sqlalchemy import event
+from data.config import async_engine
+
+# границы гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels "
+                             f"{self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name + _format_labels(self.labelnames, key), value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for name, value in self._samples():
+            yield f"{name} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (для времени выполнения)"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts, total = self._values.get(
+            key, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ((), 0))
+        return sum(counts)
+
+    def _samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (self.name + "_bucket" + _format_labels(
+                    self.labelnames, key, [("le", _format_value(bound))]),
+                       cumulative)
+            labels = _format_labels(self.labelnames, key)
+            yield self.name + "_sum" + labels, total
+            yield self.name + "_count" + labels, cumulative
+
+
+class Registry:
+    """
+    Реестр метрик
+
+    Коллекторы - функции без аргументов, которые вызываются перед выдачей
+    и обновляют показатели (Gauge) из текущего состояния процесса.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames,
+                                        buckets))
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+SQL_STATEMENTS = registry.counter(
+    "db_statements_total", "SQL statements executed", ("kind",))
+SQL_SECONDS = registry.histogram(
+    "db_statement_seconds", "SQL statement execution time", ("kind",))
+SQL_ERRORS = registry.counter(
+    "db_statement_errors_total", "SQL statements that failed", ("kind",))
+SESSIONS_OPENED = registry.counter(
+    "db_sessions_opened_total", "Sessions opened by session_scope")
+SESSIONS_CLOSED = registry.counter(
+    "db_sessions_closed_total", "Sessions closed by session_scope",
+    ("outcome",))
+INGEST_ROWS = registry.counter(
+    "ingest_rows_total", "Report file rows processed")
+INGEST_SECONDS = registry.counter(
+    "ingest_seconds_total", "Time spent processing report file rows")
+INGEST_ROWS_PER_SECOND = registry.gauge(
+    "ingest_rows_per_second", "Rows per second of the last ingest chunk")
+
+
+def observe_ingest(rows: int, seconds: float):
+    INGEST_ROWS.inc(rows)
+    INGEST_SECONDS.inc(seconds)
+    if seconds > 0:
+        INGEST_ROWS_PER_SECOND.set(rows / seconds)
+
+
+def _statement_kind(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info["metrics_started"].pop()
+    kind = _statement_kind(statement)
+    SQL_STATEMENTS.inc(kind=kind)
+    SQL_SECONDS.observe(time.perf_counter() - started, kind=kind)
+
+
+def _handle_error(context):
+    conn = context.connection
+    if conn is not None and conn.info.get("metrics_started"):
+        conn.info["metrics_started"].pop()
+    SQL_ERRORS.inc(kind=_statement_kind(context.statement or ""))
+
+
+def instrument_engine(engine):
+    """Учет SQL-запросов движка (sync или async)"""
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "after_cursor_execute",
+                          _after_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+instrument_engine(async_engine)
@@ -0,0 +1,210 @@
+"""Миграции схемы существующей базы
+
+create_all создает только недостающие таблицы, поэтому изменения в уже
+существующих таблицах описываются здесь. Примененные миграции
+записываются в таблицу schema_migrations, каждая выполняется один раз.
+Миграции - синхронные функции над Connection, запускаются через
+conn.run_sync(apply_migrations) сразу после create_all.
+"""
+import datetime
+import logging
+from sqlalchemy import Column, String, DateTime, Integer, inspect, select, \
+    text, bindparam
+from data.base import Model, get_version_column
+from data.models import Country, Source, Template, Bookmaker
+from data.names import NAME_KEY_INFO, name_key
+from data.search import create_search_index
+
+_logger = logging.getLogger(__name__)
+
+
+class SchemaMigration(Model):
+    """
+    Модель примененной миграции
+
+    Поля:
+    version -- имя миграции
+    applied_at -- время применения
+    """
+    __tablename__ = "schema_migrations"
+    version = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.datetime.now)
+
+
+# денежные колонки, хранившиеся как Float до перехода на копейки
+MONEY_COLUMNS = (
+    ("wallet", ("deposit", "adjustment")),
+    ("employee", ("adjustment",)),
+    ("transaction", ("amount", "commission")),
+    ("report", ("bet_amount", "return_amount")),
+    ("commission_history", ("commission",)),
+    ("ledger_entry", ("amount",)),
+    ("balance_snapshot", ("balance", "deposit")),
+    ("bookmaker_summary", ("deposit", "balance")),
+    ("report_archive", ("bet_amount", "return_amount")),
+    ("transaction_archive", ("amount", "commission")),
+)
+
+
+def money_to_cents(connection):
+    """
+    Перевод денежных колонок из евро (REAL) в целые копейки
+
+    Таблицы, созданные create_all уже с колонками Money (INTEGER), хранят
+    копейки - например, новая база, в которой миграции еще не отмечены.
+    Пересчитываются только колонки, объявленные как Float.
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    for table, columns in MONEY_COLUMNS:
+        if table not in tables:
+            continue
+        euros = {c["name"] for c in inspector.get_columns(table)
+                 if not isinstance(c["type"], Integer)}
+        for column in columns:
+            if column in euros:
+                connection.execute(text(
+                    f'UPDATE "{table}" SET "{column}" = '
+                    f'CAST(ROUND("{column}" * 100) AS INTEGER) '
+                    f'WHERE "{column}" IS NOT NULL'))
+
+
+def report_date_index(connection):
+    """Индекс по дате отчета для выборок за период"""
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_report_date ON report (date)'))
+
+
+def name_keys(connection):
+    """
+    Ключи названий (data/names.py): колонки, заполнение и индексы
+
+    Если среди неудаленных строк уже есть совпадающие ключи, уникальный
+    индекс создать нельзя - вместо него создается обычный с тем же именем,
+    а дубли записываются в лог для ручного исправления.
+    """
+    inspector = inspect(connection)
+    for table in (Country.__table__, Source.__table__, Template.__table__,
+                  Bookmaker.__table__):
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        key_columns = [c for c in table.columns if NAME_KEY_INFO in c.info]
+        for column in key_columns:
+            if column.name not in existing:
+                connection.execute(text(
+                    f'ALTER TABLE "{table.name}" '
+                    f'ADD COLUMN "{column.name}" VARCHAR'))
+        rows = connection.execute(select(table.c.id, *(
+            table.c[c.info[NAME_KEY_INFO]] for c in key_columns))).all()
+        if rows:
+            connection.execute(
+                table.update().where(table.c.id == bindparam("row_id")),
+                [{"row_id": row[0], **{
+                    column.name: name_key(value)
+                    for column, value in zip(key_columns, row[1:])}}
+                 for row in rows])
+
+        for index in table.indexes:
+            if not index.name.startswith("ux_"):
+                continue
+            columns = ", ".join(f'"{c.name}"' for c in index.columns)
+            duplicates = connection.execute(text(
+                f'SELECT {columns}, count(*) FROM "{table.name}" '
+                f'WHERE is_deleted = 0 GROUP BY {columns} '
+                f'HAVING count(*) > 1')).all()
+            unique = "UNIQUE "
+            if duplicates:
+                unique = ""
+                _logger.warning("%s: duplicate names, %s is not unique: %s",
+                                table.name, index.name, duplicates)
+            connection.execute(text(
+                f'CREATE {unique}INDEX IF NOT EXISTS "{index.name}" '
+                f'ON "{table.name}" ({columns}) WHERE is_deleted = 0'))
+
+
+def ingest_error_suggestion(connection):
+    """Колонка подсказок в ошибках загрузки (data/fuzzy.py)"""
+    inspector = inspect(connection)
+    if "ingest_error" not in inspector.get_table_names():
+        return
+    existing = {c["name"] for c in inspector.get_columns("ingest_error")}
+    if "suggestion" not in existing:
+        connection.execute(text(
+            'ALTER TABLE ingest_error ADD COLUMN suggestion VARCHAR'))
+
+
+def commission_transaction(connection):
+    """Связь истории комиссий с транзакцией и индекс транзакций по времени"""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    if "commission_history" in tables:
+        existing = {c["name"] for c in
+                    inspector.get_columns("commission_history")}
+        if "transaction_id" not in existing:
+            connection.execute(text(
+                'ALTER TABLE commission_history ADD COLUMN transaction_id '
+                'INTEGER REFERENCES "transaction" (id)'))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_commission_history_transaction_id '
+            'ON commission_history (transaction_id)'))
+    if "transaction" in tables:
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_transaction_timestamp '
+            'ON "transaction" (timestamp)'))
+
+
+def row_versions(connection):
+    """Колонка версии строки (data/base.py) в изменяемых таблицах"""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    for table in Model.metadata.sorted_tables:
+        column = get_version_column(table)
+        if column is None or table.name not in tables:
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        if column.name not in existing:
+            connection.execute(text(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+                f'INTEGER NOT NULL DEFAULT 1'))
+
+
+def ledger_report(connection):
+    """Связь проводок журнала с отчетом"""
+    inspector = inspect(connection)
+    if "ledger_entry" not in inspector.get_table_names():
+        return
+    existing = {c["name"] for c in inspector.get_columns("ledger_entry")}
+    if "report_id" not in existing:
+        connection.execute(text(
+            'ALTER TABLE ledger_entry ADD COLUMN report_id '
+            'INTEGER REFERENCES report (id)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_ledger_entry_report_id '
+        'ON ledger_entry (report_id)'))
+
+
+MIGRATIONS = (
+    ("0001_money_cents", money_to_cents),
+    ("0002_report_date_index", report_date_index),
+    ("0003_search_index", create_search_index),
+    ("0004_name_keys", name_keys),
+    ("0005_ingest_error_suggestion", ingest_error_suggestion),
+    ("0006_commission_transaction", commission_transaction),
+    ("0007_row_versions", row_versions),
+    ("0008_ledger_report", ledger_report),
+)
+
+
+def apply_migrations(connection) -> list:
+    """Применение всех еще не примененных миграций по порядку"""
+    SchemaMigration.__table__.create(connection, checkfirst=True)
+    applied = set(connection.execute(
+        select(SchemaMigration.version)).scalars())
+    done = []
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        migration(connection)
+        connection.execute(SchemaMigration.__table__.insert().values(
+            version=version, applied_at=datetime.datetime.now()))
+        done.append(version)
+    return done
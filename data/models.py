@@ -1,7 +1,10 @@
 from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, \
-    Boolean, func
+    Boolean, Index, Date, Table, func, case, and_, type_coerce, text
 from sqlalchemy.orm import relationship
-from data.base import Model
+from data.base import Model, version_column
+from data.names import name_key, name_key_column
+from data.money import Money, to_cents, from_cents
+from data.salary import ReportAmounts, SQL_OPS, salary_cents, penalty_cents
 from sqlalchemy.ext.hybrid import hybrid_property
 import datetime
 
@@ -17,6 +20,11 @@ import datetime
 - Template
 - WaitingUser
 - OperationHistory
+- CommissionHistory
+- LedgerEntry
+- BalanceSnapshot
+- BookmakerSummary
+- report_archive, transaction_archive (таблицы архива)
 """
 
 
@@ -35,10 +43,17 @@ class Country(Model):
     templates -- список шаблонов отчетов, связанных со страной
     flag -- флаг страны
     is_deleted -- статус удаления страны
+    name_key -- нормализованное название для поиска (см. data/names.py)
+    version -- версия строки для проверки конфликтов в Model.update
     """
     __tablename__ = "country"
+    __table_args__ = (
+        Index("ux_country_name_key", "name_key", unique=True,
+              sqlite_where=text("is_deleted = 0")),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
+    name_key = name_key_column("name")
     commission = Column(Float, default=0)
     transactions = relationship('Transaction', back_populates='country',
                                 lazy='joined')
@@ -49,6 +64,7 @@ class Country(Model):
     templates = relationship('Template', back_populates='country')
     flag = Column(String)
     is_deleted = Column(Boolean, default=False)
+    version = version_column()
 
     def get_active_balance(self):
         """
@@ -98,11 +114,22 @@ class Bookmaker(Model):
     template -- шаблон, к которому привязан букмекер
     bk_name -- название букмекера взятое из шаблона при создании букмекера
     is_deleted -- статус удаления букмекера
+    summary -- замороженные итоги по отчетам и транзакциям, перенесенным в
+               архив (см. data/archive.py)
+    name_key -- нормализованное название профиля
+    bk_name_key -- нормализованное название букмекера
+    version -- версия строки для проверки конфликтов в Model.update
 
     """
     __tablename__ = "bookmaker"
+    __table_args__ = (
+        Index("ux_bookmaker_name_key", "country_id", "bk_name_key",
+              "name_key", unique=True,
+              sqlite_where=text("is_deleted = 0")),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
+    name_key = name_key_column("name")
     country_id = Column(Integer, ForeignKey('country.id'))
     country = relationship('Country', back_populates='bookmakers',
                            lazy='joined')
@@ -123,17 +150,24 @@ class Bookmaker(Model):
     template = relationship('Template', back_populates='bookmakers',
                             lazy='joined')
     bk_name = Column(String)
+    bk_name_key = name_key_column("bk_name")
     is_deleted = Column(Boolean, default=False)
+    version = version_column()
+    summary = relationship('BookmakerSummary', uselist=False, lazy='joined')
 
     def get_deposit(self):
         """Депозит букмекера"""
-        transactions_balance = 0
+        return from_cents(self._deposit_cents())
+
+    def _deposit_cents(self):
+        transactions_balance = to_cents(self.summary.deposit) \
+            if self.summary else 0
         for transaction in [t for t in self.transactions_sender if
                             t.from_ == "deposit"]:
-            transactions_balance -= transaction.amount
+            transactions_balance -= to_cents(transaction.amount)
         for transaction in [t for t in self.transactions_receiver if
                             t.where == "deposit"]:
-            transactions_balance += transaction.real_amount
+            transactions_balance += to_cents(transaction.real_amount)
         return transactions_balance
 
     def get_balance(self):
@@ -145,15 +179,20 @@ class Bookmaker(Model):
         reports_balance = 0
         for report in self.reports:
             if not report.is_deleted:
-                reports_balance += report.real_profit
+                reports_balance += to_cents(report.real_profit)
         transactions_balance = 0
         for transaction in [t for t in self.transactions_sender if
                             t.from_ == "balance"]:
-            transactions_balance -= transaction.amount
+            transactions_balance -= to_cents(transaction.amount)
         for transaction in [t for t in self.transactions_receiver if
                             t.where == "balance"]:
-            transactions_balance += transaction.real_amount
-        return self.get_deposit() + reports_balance + transactions_balance
+            transactions_balance += to_cents(transaction.real_amount)
+        if self.summary:
+            # депозит из архива уже учтен в get_deposit
+            reports_balance += to_cents(self.summary.balance) - \
+                               to_cents(self.summary.deposit)
+        return from_cents(self._deposit_cents() + reports_balance +
+                          transactions_balance)
 
 
 class Wallet(Model):
@@ -172,6 +211,7 @@ class Wallet(Model):
     transactions_receiver -- список транзакций, где кошелек является получателем
     adjustment -- корректировка баланса кошелька
     is_deleted -- статус удаления кошелька
+    version -- версия строки для проверки конфликтов в Model.update
 
     """
     __tablename__ = "wallet"
@@ -181,7 +221,7 @@ class Wallet(Model):
     wallet_type = Column(String)
     country_id = Column(Integer, ForeignKey('country.id'))
     country = relationship('Country', back_populates='wallets', lazy='joined')
-    deposit = Column(Float)
+    deposit = Column(Money)
     transactions_sender = relationship('Transaction',
                                        back_populates='sender_wallet',
                                        foreign_keys='Transaction.sender_wallet_id',
@@ -190,8 +230,9 @@ class Wallet(Model):
                                          back_populates='receiver_wallet',
                                          foreign_keys='Transaction.receiver_wallet_id',
                                          lazy='joined')
-    adjustment = Column(Float, default=0)
+    adjustment = Column(Money, default=0)
     is_deleted = Column(Boolean, default=False)
+    version = version_column()
 
     def get_balance(self):
         """
@@ -199,11 +240,12 @@ class Wallet(Model):
 
         Баланс кошелька рассчитывается как сумма его депозита, суммы всех входящих транзакций и корректировки, минус сумма всех исходящих транзакций.
         """
-        sender_transactions = sum(transaction.amount for transaction in
-                                  self.transactions_sender)
-        receiver_transactions = sum(transaction.real_amount for transaction in
-                                    self.transactions_receiver)
-        return self.deposit + receiver_transactions - sender_transactions + self.adjustment
+        sender_transactions = sum(to_cents(transaction.amount) for
+                                  transaction in self.transactions_sender)
+        receiver_transactions = sum(to_cents(transaction.real_amount) for
+                                    transaction in self.transactions_receiver)
+        return from_cents(to_cents(self.deposit) + receiver_transactions -
+                          sender_transactions + to_cents(self.adjustment))
 
 
 class Employee(Model):
@@ -216,14 +258,16 @@ class Employee(Model):
     adjustment -- корректировка баланса сотрудника
     reports -- список отчетов, связанных с сотрудником
     username -- имя пользователя в телеграм
+    version -- версия строки для проверки конфликтов в Model.update
     """
     __tablename__ = "employee"
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    adjustment = Column(Float, default=0)
+    adjustment = Column(Money, default=0)
 
     reports = relationship('Report', back_populates='employee', lazy='joined')
     username = Column(String)
+    version = version_column()
 
     def salary(self):
         """
@@ -287,8 +331,8 @@ class Transaction(Model):
     id = Column(Integer, primary_key=True)
     from_ = Column(String)
     where = Column(String)
-    amount = Column(Float)
-    commission = Column(Float, default=0)
+    amount = Column(Money)
+    commission = Column(Money, default=0)
     sender_wallet_id = Column(Integer,
                               ForeignKey('wallet.id'))  # кошелек отправителя
     sender_wallet = relationship('Wallet',
@@ -311,7 +355,7 @@ class Transaction(Model):
     country_id = Column(Integer, ForeignKey('country.id'))
     country = relationship('Country', back_populates='transactions')
     transaction_type = Column(String)
-    timestamp = Column(DateTime)
+    timestamp = Column(DateTime, index=True)
     is_deleted = Column(Boolean, default=False)
 
     @property
@@ -319,10 +363,49 @@ class Transaction(Model):
         """Реальная сумма транзакции"""
         if not self.commission:
             return self.amount
-        return self.amount - self.commission
+        return from_cents(to_cents(self.amount) - to_cents(self.commission))
 
+    def postings(self):
+        """
+        Проводки транзакции для журнала LedgerEntry
 
-class Report(Model):
+        Отправитель списывает amount со своей корзины from_, получатель
+        зачисляет real_amount в корзину where, комиссия проводится отдельно.
+        Если отправителя или получателя нет (внешнее пополнение/вывод),
+        вместо него проводится сущность external, так что сумма проводок
+        по транзакции всегда равна нулю.
+        """
+        if self.sender_wallet_id is not None:
+            sender = ("wallet", self.sender_wallet_id)
+        elif self.sender_bookmaker_id is not None:
+            sender = ("bookmaker", self.sender_bookmaker_id)
+        else:
+            sender = ("external", None)
+        if self.receiver_wallet_id is not None:
+            receiver = ("wallet", self.receiver_wallet_id)
+        elif self.receiver_bookmaker_id is not None:
+            receiver = ("bookmaker", self.receiver_bookmaker_id)
+        else:
+            receiver = ("external", None)
+
+        entries = [
+            LedgerEntry(transaction_id=self.id, entity_type=sender[0],
+                        entity_id=sender[1], bucket=self.from_,
+                        amount=-self.amount, timestamp=self.timestamp),
+            LedgerEntry(transaction_id=self.id, entity_type=receiver[0],
+                        entity_id=receiver[1], bucket=self.where,
+                        amount=self.real_amount, timestamp=self.timestamp),
+        ]
+        if self.commission:
+            entries.append(
+                LedgerEntry(transaction_id=self.id, entity_type="commission",
+                            entity_id=None, bucket=None,
+                            amount=self.commission,
+                            timestamp=self.timestamp))
+        return entries
+
+
+class Report(ReportAmounts, Model):
     """
     Модель отчета
 
@@ -344,10 +427,11 @@ class Report(Model):
     employee -- сотрудник, связанный с отчетом
     is_error -- статус ошибки в отчете
     is_deleted -- статус удаления отчета
+    version -- версия строки для проверки конфликтов в Model.update
     """
     __tablename__ = "report"
     id = Column(Integer, primary_key=True)
-    date = Column(DateTime)
+    date = Column(DateTime, index=True)
     source_id = Column(Integer, ForeignKey('source.id'))
     source = relationship('Source', back_populates='reports', lazy='joined')
     country_id = Column(Integer, ForeignKey('country.id'))
@@ -358,14 +442,15 @@ class Report(Model):
                              lazy='joined')
     match_name = Column(String)
     nickname = Column(String)
-    bet_amount = Column(Float)
-    return_amount = Column(Float)
+    bet_amount = Column(Money)
+    return_amount = Column(Money)
     _salary_percentage = Column(Float)
     employee_id = Column(Integer, ForeignKey('employee.id'))
     employee = relationship('Employee', back_populates='reports',
                             lazy='joined')
     is_error = Column(Boolean, default=False)
     is_deleted = Column(Boolean, default=False)
+    version = version_column()
 
     # задаем комиссию из бк если она не задана
     @hybrid_property
@@ -386,38 +471,32 @@ class Report(Model):
     def salary_percentage(self, value):
         self._salary_percentage = value
 
-    @property
-    def profit(self):
-        """Прибыль отчета"""
+    # правила зарплаты и штрафа - в data/salary.py, здесь к ним добавлены
+    # SQL-выражения; как и salary_percentage, они требуют join с букмекером.
+    # Суммы берутся сырыми копейками (Integer), иначе числа в выражении
+    # тоже переводились бы в копейки как Money
+    salary = hybrid_property(ReportAmounts.salary.fget)
 
-        return self.return_amount - self.bet_amount
+    @salary.expression
+    def salary(cls):
+        return type_coerce(salary_cents(
+            SQL_OPS, type_coerce(cls.bet_amount, Integer),
+            cls.salary_percentage, cls.is_error), Money)
 
-    @property
-    def salary(self):
-        """Зарплата за отчет"""
-        if not self.is_error:
-            return self.bet_amount * self.salary_percentage / 100
-        else:
-            return 0
+    penalty = hybrid_property(ReportAmounts.penalty.fget)
 
-    @property
-    def penalty(self):
-        """Штраф за ошибку в отчете"""
-        if self.is_error and self.profit < 0:
-            return abs(self.profit) * 3 * self.salary_percentage / 100
-        else:
-            return 0
+    @penalty.expression
+    def penalty(cls):
+        return type_coerce(penalty_cents(
+            SQL_OPS, type_coerce(cls.bet_amount, Integer),
+            type_coerce(cls.return_amount, Integer),
+            cls.salary_percentage, cls.is_error), Money)
 
-    @property
-    def real_profit(self):
-        """Реальная прибыль отчета"""
-        # return self.profit - self.salary
-        return self.profit
+    real_salary = hybrid_property(ReportAmounts.real_salary.fget)
 
-    @property
-    def real_salary(self):
-        """Реальная зарплата за отчет"""
-        return self.salary - self.penalty
+    @real_salary.expression
+    def real_salary(cls):
+        return cls.salary - cls.penalty
 
 
 class Source(Model):
@@ -429,12 +508,20 @@ class Source(Model):
     name -- название источника
     reports -- список отчетов, связанных с источником
     is_deleted -- статус удаления источника
+    name_key -- нормализованное название источника
+    version -- версия строки для проверки конфликтов в Model.update
     """
     __tablename__ = "source"
+    __table_args__ = (
+        Index("ux_source_name_key", "name_key", unique=True,
+              sqlite_where=text("is_deleted = 0")),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
+    name_key = name_key_column("name")
     reports = relationship('Report', back_populates='source')
     is_deleted = Column(Boolean, default=False)
+    version = version_column()
 
 
 class Admin(Model):
@@ -464,16 +551,24 @@ class Template(Model):
     employee_percentage -- процент зарплаты сотрудника
     bookmakers -- список букмекеров, связанных с шаблоном
     is_deleted -- статус удаления шаблона отчета
+    name_key -- нормализованное название шаблона
+    version -- версия строки для проверки конфликтов в Model.update
     """
     __tablename__ = "template"
+    __table_args__ = (
+        Index("ux_template_name_key", "country_id", "name_key", unique=True,
+              sqlite_where=text("is_deleted = 0")),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
+    name_key = name_key_column("name")
     country_id = Column(Integer, ForeignKey('country.id'))
     country = relationship('Country', back_populates='templates')
     employee_percentage = Column(Float)
     bookmakers = relationship('Bookmaker', back_populates='template',
                               lazy='joined')
     is_deleted = Column(Boolean, default=False)
+    version = version_column()
 
 
 class WaitingUser(Model):
@@ -521,11 +616,178 @@ class CommissionHistory(Model):
     commission -- сумма комиссии
     commission_type -- тип комиссии
     commission_description -- описание комиссии
+    transaction_id -- транзакция, при которой взята комиссия (для записей,
+                      созданных до ее появления, пусто)
     """
     __tablename__ = "commission_history"
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, default=datetime.datetime.utcnow)
     user_name = Column(String)
-    commission = Column(Float)
+    commission = Column(Money)
     commission_type = Column(String)
     commission_description = Column(String)
+    transaction_id = Column(Integer, ForeignKey('transaction.id'), index=True)
+
+
+class LedgerEntry(Model):
+    """
+    Модель проводки журнала транзакций
+
+    Каждая транзакция раскладывается на проводки со знаком, поэтому баланс
+    любой сущности или её корзины считается одним SUM по индексу, а история
+    сущности - проходом по диапазону индекса. Кроме транзакций в журнал
+    проводятся начальный депозит кошелька (корзина opening), прибыль
+    отчета букмекеру (balance) и зарплата по нему сотруднику (salary), а
+    также корректировки балансов (adjustment). Бот и статистика читают
+    балансы только из журнала; get_balance() моделей считает то же по
+    загруженным связям и нужен для сверки с журналом.
+
+    Поля:
+    id -- уникальный идентификатор проводки
+    transaction_id -- идентификатор транзакции, породившей проводку (None для
+                      отчетов, депозитов, корректировок и архивных
+                      транзакций)
+    report_id -- идентификатор отчета, породившего проводку (None после
+                 архивации отчета)
+    entity_type -- тип сущности (wallet, bookmaker, employee, commission,
+                   external)
+    entity_id -- идентификатор сущности
+    bucket -- корзина сущности (deposit, balance, adjustment или None)
+    amount -- сумма проводки (минус - списание, плюс - зачисление)
+    timestamp -- дата и время транзакции
+    """
+    __tablename__ = "ledger_entry"
+    __table_args__ = (
+        Index("ix_ledger_entry_balance", "entity_type", "entity_id", "bucket",
+              "amount"),
+        Index("ix_ledger_entry_history", "entity_type", "entity_id",
+              "timestamp"),
+    )
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(Integer, ForeignKey('transaction.id'), index=True)
+    report_id = Column(Integer, ForeignKey('report.id'), index=True)
+    entity_type = Column(String, nullable=False)
+    entity_id = Column(Integer)
+    bucket = Column(String)
+    amount = Column(Money, nullable=False)
+    timestamp = Column(DateTime)
+
+
+class BalanceSnapshot(Model):
+    """
+    Модель снимка баланса на конец дня
+
+    Поля:
+    id -- уникальный идентификатор снимка
+    date -- дата, на конец которой снят баланс
+    entity_type -- тип сущности (country, bookmaker, wallet, employee)
+    entity_id -- идентификатор сущности
+    balance -- баланс (для страны - активный баланс)
+    deposit -- депозит букмекера или пассивный баланс страны
+    """
+    __tablename__ = "balance_snapshot"
+    __table_args__ = (
+        Index("ix_balance_snapshot_entity", "date", "entity_type",
+              "entity_id", unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+    entity_type = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    balance = Column(Money, nullable=False)
+    deposit = Column(Money)
+
+
+class BookmakerSummary(Model):
+    """
+    Модель замороженных итогов архивированного букмекера
+
+    Поля:
+    id -- уникальный идентификатор записи
+    bookmaker_id -- идентификатор букмекера
+    deposit -- депозит по транзакциям, перенесенным в архив
+    balance -- баланс по архивным отчетам и транзакциям (включая депозит)
+    reports_count -- количество отчетов в архиве
+    transactions_count -- количество транзакций в архиве
+    archived_at -- дата последней архивации
+    """
+    __tablename__ = "bookmaker_summary"
+    id = Column(Integer, primary_key=True)
+    bookmaker_id = Column(Integer, ForeignKey('bookmaker.id'), unique=True,
+                          nullable=False)
+    deposit = Column(Money, default=0)
+    balance = Column(Money, default=0)
+    reports_count = Column(Integer, default=0)
+    transactions_count = Column(Integer, default=0)
+    archived_at = Column(DateTime)
+
+
+class IngestJob(Model):
+    """
+    Модель фоновой загрузки файла отчетов
+
+    Поля:
+    id -- уникальный идентификатор задачи
+    user_id -- id администратора в телеграм
+    username -- имя пользователя администратора в телеграм
+    chat_id -- чат для сообщений о ходе загрузки
+    message_id -- сообщение с прогрессом, которое редактируется
+    file_path -- путь к загруженному файлу
+    status -- queued, running, done или failed
+    total_rows -- строк в файле (по данным файла, может отсутствовать)
+    processed_rows -- обработано строк (зафиксировано в базе)
+    created_reports -- создано отчетов
+    error_rows -- строк с ошибками
+    error -- текст ошибки, если загрузка прервалась
+    created_at -- время постановки в очередь
+    finished_at -- время завершения
+    """
+    __tablename__ = "ingest_job"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    username = Column(String)
+    chat_id = Column(Integer)
+    message_id = Column(Integer)
+    file_path = Column(String, nullable=False)
+    status = Column(String, default="queued", index=True)
+    total_rows = Column(Integer)
+    processed_rows = Column(Integer, default=0)
+    created_reports = Column(Integer, default=0)
+    error_rows = Column(Integer, default=0)
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    finished_at = Column(DateTime)
+
+
+class IngestError(Model):
+    """
+    Модель строки файла, не прошедшей загрузку
+
+    Поля:
+    id -- уникальный идентификатор записи
+    job_id -- идентификатор задачи загрузки
+    row_number -- номер строки данных в файле (с 1, без заголовка)
+    message -- текст ошибки
+    suggestion -- похожие названия для ненайденных (см. data/fuzzy.py)
+    """
+    __tablename__ = "ingest_error"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('ingest_job.id'), nullable=False,
+                    index=True)
+    row_number = Column(Integer, nullable=False)
+    message = Column(String)
+    suggestion = Column(String)
+
+
+def _archive_table(name, table):
+    """Таблица архива с теми же колонками, но без внешних ключей"""
+    return Table(name, Model.metadata,
+                 *(Column(c.name, c.type, primary_key=c.primary_key,
+                          info=c.info)
+                   for c in table.columns),
+                 Column("archived_at", DateTime))
+
+
+report_archive = _archive_table("report_archive", Report.__table__)
+transaction_archive = _archive_table("transaction_archive",
+                                     Transaction.__table__)
@@ -0,0 +1,54 @@
+"""Денежные суммы с фиксированной точкой
+
+Суммы хранятся в базе целым числом копеек (центов), поэтому SUM по ним
+считается SQLite точно и без плавающей арифметики. В Python значения
+по-прежнему выглядят как числа в евро: Money переводит их в копейки при
+записи и обратно при чтении. Для точного сложения в Python используйте
+to_cents/from_cents или money_sum.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import Integer
+from sqlalchemy.types import TypeDecorator
+
+CENTS = 100
+
+
+def to_cents(value) -> int:
+    """Сумма в евро -> целое число копеек (округление до ближайшей)"""
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        return value * CENTS
+    return int((Decimal(str(value)) * CENTS).to_integral_value(ROUND_HALF_UP))
+
+
+def from_cents(cents) -> float:
+    """Копейки -> сумма в евро"""
+    return cents / CENTS
+
+
+def money_sum(values) -> float:
+    """Точная сумма денежных значений"""
+    return from_cents(sum(to_cents(value) for value in values))
+
+
+class Money(TypeDecorator):
+    """
+    Денежная колонка: INTEGER копеек в базе, float евро в Python
+
+    Выражения Money +/- Money и SUM сохраняют тип Money. Произведение на
+    процент (Float) теряет его - такие выражения нужно оборачивать в
+    type_coerce(..., Money), см. Report.salary.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return from_cents(value)
@@ -0,0 +1,44 @@
+"""Нормализованные ключи названий
+
+Страны, источники, шаблоны и букмекеры ищутся по названию из Excel-файлов
+и сообщений администраторов, где регистр и пробелы не постоянны. Рядом с
+названием хранится ключ name_key(название): без лишних пробелов и в
+нижнем регистре (casefold, в том числе для кириллицы). Поиск идет по
+равенству ключей и использует уникальный индекс по ним.
+
+Колонка ключа создается name_key_column(исходная колонка): ключ
+заполняется при вставке (ORM и Core insert) и пересчитывается в
+Model.update при изменении исходной колонки.
+"""
+import unicodedata
+from typing import Optional
+from sqlalchemy import Column, String
+
+# Column.info: колонка ключа -> имя исходной колонки
+NAME_KEY_INFO = "name_key_of"
+
+
+def name_key(value) -> Optional[str]:
+    """Название -> ключ для поиска: NFKC, пробелы схлопнуты, casefold"""
+    if value is None:
+        return None
+    value = unicodedata.normalize("NFKC", str(value))
+    return " ".join(value.split()).casefold()
+
+
+def name_key_column(source: str) -> Column:
+    """Колонка ключа, вычисляемого из колонки source"""
+
+    def default(context):
+        return name_key(context.get_current_parameters().get(source))
+
+    return Column(String, default=default, info={NAME_KEY_INFO: source})
+
+
+def with_name_keys(table, values: dict) -> dict:
+    """Добавление пересчитанных ключей к значениям для UPDATE"""
+    for column in table.columns:
+        source = column.info.get(NAME_KEY_INFO)
+        if source in values and column.key not in values:
+            values[column.key] = name_key(values[source])
+    return values
@@ -0,0 +1,161 @@
+"""Сводная статистика по отчетам
+
+Любая комбинация измерений (страна, источник, букмекер, сотрудник, день,
+неделя, месяц) за период считается одним SQL-запросом с GROUP BY по
+индексу report.date. Показатели - те же, что у ReportMetrics.
+"""
+import datetime
+from dataclasses import dataclass
+from sqlalchemy import select, func, and_
+from data.tools import session_scope
+from data.models import *
+from data.analytics import ReportMetrics
+from data.money import money_sum
+
+PIVOT_DIMENSIONS = {
+    "country": ("Страна", Report.country_id,
+                func.coalesce(Country.flag + " " + Country.name,
+                              Country.name)),
+    "source": ("Источник", Report.source_id, Source.name),
+    "bookmaker": ("БК", Report.bookmaker_id, Bookmaker.name),
+    "employee": ("Сотрудник", Report.employee_id, Employee.name),
+    "day": ("День", None, func.date(Report.date)),
+    # понедельник недели отчета
+    "week": ("Неделя", None,
+             func.date(Report.date, "-6 days", "weekday 1")),
+    "month": ("Месяц", None, func.strftime("%Y-%m", Report.date)),
+}
+
+# русские названия измерений для команды бота
+DIMENSION_ALIASES = {
+    "страна": "country",
+    "источник": "source",
+    "бк": "bookmaker",
+    "букмекер": "bookmaker",
+    "сотрудник": "employee",
+    "день": "day",
+    "неделя": "week",
+    "месяц": "month",
+}
+
+
+def parse_dimension(name: str) -> str:
+    name = name.strip().lower()
+    name = DIMENSION_ALIASES.get(name, name)
+    if name not in PIVOT_DIMENSIONS:
+        raise ValueError(f"unknown dimension: {name}")
+    return name
+
+
+def encode_dimensions(dimensions) -> str:
+    """Короткая запись измерений для callback_data: первые буквы имен"""
+    return "".join(name[0] for name in dimensions)
+
+
+def decode_dimensions(code: str) -> list:
+    by_letter = {name[0]: name for name in PIVOT_DIMENSIONS}
+    return [by_letter[letter] for letter in code]
+
+
+@dataclass(slots=True)
+class PivotRow:
+    keys: tuple
+    metrics: ReportMetrics
+
+
+@dataclass
+class PivotTable:
+    """
+    Результат сводного запроса
+
+    Поля:
+    dimensions -- измерения в порядке группировки
+    start_date, end_date -- период (включительно)
+    rows -- строки PivotRow, отсортированные по ключам
+    """
+    dimensions: tuple
+    start_date: datetime.date
+    end_date: datetime.date
+    rows: list
+
+    @property
+    def headers(self) -> list:
+        return [PIVOT_DIMENSIONS[d][0] for d in self.dimensions]
+
+    def total(self) -> ReportMetrics:
+        metrics = [row.metrics for row in self.rows]
+        return ReportMetrics(
+            reports=sum(m.reports for m in metrics),
+            errors=sum(m.errors for m in metrics),
+            **{field: money_sum(getattr(m, field) for m in metrics)
+               for field in ("bet", "returned", "profit", "salary",
+                             "penalty")})
+
+
+async def run_pivot(dimensions, start_date: datetime.date,
+                    end_date: datetime.date) -> PivotTable:
+    """Сводная таблица по измерениям за период одним GROUP BY"""
+    dimensions = tuple(parse_dimension(d) for d in dimensions)
+    if not dimensions:
+        raise ValueError("at least one dimension is required")
+
+    labels = []
+    group_by = []
+    for index, name in enumerate(dimensions):
+        _, key, label = PIVOT_DIMENSIONS[name]
+        labels.append(label.label(f"d{index}"))
+        group_by.append(key if key is not None else label)
+
+    profit = Report.return_amount - Report.bet_amount
+    query = (
+        select(*labels,
+               func.count(Report.id),
+               func.count(Report.id).filter(Report.is_error == True),
+               func.sum(Report.bet_amount),
+               func.sum(Report.return_amount),
+               func.sum(profit),
+               func.sum(Report.salary),
+               func.sum(Report.penalty))
+        .select_from(Report)
+        .outerjoin(Bookmaker, Report.bookmaker_id == Bookmaker.id)
+        .outerjoin(Country, Report.country_id == Country.id)
+        .outerjoin(Source, Report.source_id == Source.id)
+        .outerjoin(Employee, Report.employee_id == Employee.id)
+        .where(and_(Report.date >= start_date,
+                    Report.date < end_date + datetime.timedelta(days=1),
+                    Report.is_deleted == False))
+        .group_by(*group_by)
+        .order_by(*(label.name for label in labels)))
+
+    async with session_scope() as session:
+        result = await session.execute(query)
+        rows = []
+        for row in result:
+            keys = tuple(row[:len(dimensions)])
+            reports, errors, bet, returned, profit_sum, salary, penalty = \
+                row[len(dimensions):]
+            rows.append(PivotRow(keys=keys, metrics=ReportMetrics(
+                reports=reports, errors=errors or 0, bet=bet or 0,
+                returned=returned or 0, profit=profit_sum or 0,
+                salary=salary or 0, penalty=penalty or 0)))
+
+    return PivotTable(dimensions=dimensions, start_date=start_date,
+                      end_date=end_date, rows=rows)
+
+
+def iter_pivot_lines(table: PivotTable):
+    """Компактное текстовое представление сводной таблицы"""
+    yield "📊 {} за {} - {}".format(
+        " × ".join(table.headers), table.start_date.strftime('%d.%m.%Y'),
+        table.end_date.strftime('%d.%m.%Y'))
+    yield " / ".join(table.headers) + " | отчеты | ставки | профит | зарплата"
+    yield ""
+    for row in table.rows:
+        m = row.metrics
+        yield "{} | {} | {:.1f} | {:.1f} | {:.1f}".format(
+            " / ".join(str(k) if k is not None else "—" for k in row.keys),
+            m.reports, m.bet, m.profit, m.real_salary)
+    total = table.total()
+    yield ""
+    yield "Итого: {} | {:.1f} | {:.1f} | {:.1f}".format(
+        total.reports, total.bet, total.profit, total.real_salary)
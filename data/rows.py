@@ -0,0 +1,125 @@
+"""Компактные строки для статистики, выгрузок и клавиатур
+
+Списки и отчеты используют только несколько колонок, поэтому вместо
+ORM-объектов (с identity map и жадно загружаемыми связями) запросы здесь
+выбирают нужные колонки и возвращают неизменяемые dataclass со __slots__.
+Названия полей совпадают с полями моделей, так что строки можно
+передавать в те же форматтеры.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import select
+from data.tools import session_scope
+from data.models import *
+from data.salary import ReportAmounts
+
+
+@dataclass(slots=True, frozen=True)
+class ReportRow(ReportAmounts):
+    """
+    Строка отчета (прибыль и зарплата - по правилам data/salary.py)
+
+    Поля:
+    id -- номер отчета
+    date -- дата отчета
+    bet_amount -- сумма ставки
+    return_amount -- сумма возврата
+    is_error -- статус ошибки в отчете
+    salary_percentage -- процент зарплаты (из отчета или букмекера)
+    employee_username -- имя пользователя сотрудника в телеграм
+    source_name -- название источника
+    country_name -- название страны
+    bookmaker_name -- название профиля букмекера
+    nickname -- никнейм
+    match_name -- название матча
+    """
+    id: int
+    date: Optional[datetime.datetime]
+    bet_amount: float
+    return_amount: float
+    is_error: bool
+    salary_percentage: float
+    employee_username: Optional[str]
+    source_name: Optional[str]
+    country_name: Optional[str]
+    bookmaker_name: Optional[str]
+    nickname: Optional[str]
+    match_name: Optional[str]
+
+
+@dataclass(slots=True, frozen=True)
+class CountryRow:
+    id: int
+    name: str
+    flag: Optional[str]
+
+
+@dataclass(slots=True, frozen=True)
+class WalletRow:
+    id: int
+    name: str
+    wallet_type: Optional[str]
+    general_wallet_type: Optional[str]
+    country_id: Optional[int]
+
+
+@dataclass(slots=True, frozen=True)
+class EmployeeRow:
+    id: int
+    name: Optional[str]
+    username: Optional[str]
+
+
+REPORT_ROW_COLUMNS = (
+    Report.id, Report.date, Report.bet_amount, Report.return_amount,
+    Report.is_error, Report.salary_percentage, Employee.username,
+    Source.name, Country.name, Bookmaker.name, Report.nickname,
+    Report.match_name,
+)
+
+
+async def _fetch_rows(row_type, query, offset=0, limit=None):
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    async with session_scope() as session:
+        result = await session.execute(query)
+        return [row_type(*row) for row in result]
+
+
+async def get_report_rows(*criteria, order_by=(Report.date, Report.id),
+                          offset: int = 0, limit: int = None) -> list:
+    """Строки отчетов с именами сотрудника, источника, страны и букмекера"""
+    query = (select(*REPORT_ROW_COLUMNS)
+             .select_from(Report)
+             .outerjoin(Employee, Report.employee_id == Employee.id)
+             .outerjoin(Source, Report.source_id == Source.id)
+             .outerjoin(Country, Report.country_id == Country.id)
+             .outerjoin(Bookmaker, Report.bookmaker_id == Bookmaker.id)
+             .where(*criteria)
+             .order_by(*order_by))
+    return await _fetch_rows(ReportRow, query, offset, limit)
+
+
+async def get_country_rows(offset: int = 0, limit: int = None) -> list:
+    query = (select(Country.id, Country.name, Country.flag)
+             .where(Country.is_deleted == False)
+             .order_by(Country.id))
+    return await _fetch_rows(CountryRow, query, offset, limit)
+
+
+async def get_wallet_rows(*criteria, offset: int = 0,
+                          limit: int = None) -> list:
+    query = (select(Wallet.id, Wallet.name, Wallet.wallet_type,
+                    Wallet.general_wallet_type, Wallet.country_id)
+             .where(Wallet.is_deleted == False, *criteria)
+             .order_by(Wallet.id))
+    return await _fetch_rows(WalletRow, query, offset, limit)
+
+
+async def get_employee_rows(offset: int = 0, limit: int = None) -> list:
+    query = (select(Employee.id, Employee.name, Employee.username)
+             .order_by(Employee.id))
+    return await _fetch_rows(EmployeeRow, query, offset, limit)
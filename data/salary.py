@@ -0,0 +1,101 @@
+"""Правила зарплаты и штрафа по отчету
+
+Правила записаны один раз над набором операций Ops и применяются тремя
+способами: к числам (свойства Report и ReportRow), к SQL-выражениям
+(Report.salary/penalty в запросах, проводках журнала и сводных таблицах)
+и к колонкам NumPy (data/analytics.py). Суммы в копейках; зарплата и
+штраф округляются до копейки по каждому отчету половиной от нуля, как
+ROUND в SQLite, поэтому суммы по отчетам в любой статистике совпадают с
+проводками журнала.
+"""
+import math
+from dataclasses import dataclass
+from typing import Callable
+from sqlalchemy import and_, case, func
+from data.money import to_cents, from_cents
+
+# во сколько раз штраф за ошибочный отчет больше зарплаты с его убытка
+PENALTY_MULTIPLIER = 3
+
+
+@dataclass(frozen=True)
+class Ops:
+    """
+    Операции, через которые записаны правила
+
+    Поля:
+    is_true -- условие "флаг установлен" (NULL - не установлен)
+    and_ -- логическое И двух условий
+    where -- выбор значения по условию (условие, да, нет)
+    round -- округление до целого половиной от нуля
+    """
+    is_true: Callable
+    and_: Callable
+    where: Callable
+    round: Callable
+
+
+PYTHON_OPS = Ops(
+    is_true=bool,
+    and_=lambda left, right: left and right,
+    where=lambda condition, yes, no: yes if condition else no,
+    round=lambda value: math.trunc(value + math.copysign(0.5, value)))
+
+SQL_OPS = Ops(
+    is_true=lambda column: column == True,
+    and_=and_,
+    where=lambda condition, yes, no: case((condition, yes), else_=no),
+    round=func.round)
+
+
+def salary_cents(ops: Ops, bet, percentage, is_error):
+    """Зарплата за неошибочный отчет: процент от ставки"""
+    return ops.round(ops.where(ops.is_true(is_error), 0,
+                               bet * percentage / 100.0))
+
+
+def penalty_cents(ops: Ops, bet, returned, percentage, is_error):
+    """Штраф за ошибочный отчет в минус: процент от убытка × множитель"""
+    loss = bet - returned
+    return ops.round(ops.where(
+        ops.and_(ops.is_true(is_error), loss > 0),
+        loss * PENALTY_MULTIPLIER * percentage / 100.0, 0))
+
+
+class ReportAmounts:
+    """
+    Прибыль, зарплата и штраф отчета по полям bet_amount, return_amount,
+    is_error и salary_percentage (суммы в евро)
+    """
+    __slots__ = ()
+
+    @property
+    def profit(self):
+        """Прибыль отчета"""
+        return from_cents(to_cents(self.return_amount) -
+                          to_cents(self.bet_amount))
+
+    @property
+    def real_profit(self):
+        """Реальная прибыль отчета"""
+        return self.profit
+
+    @property
+    def salary(self):
+        """Зарплата за отчет"""
+        return from_cents(salary_cents(
+            PYTHON_OPS, to_cents(self.bet_amount), self.salary_percentage,
+            self.is_error))
+
+    @property
+    def penalty(self):
+        """Штраф за ошибку в отчете"""
+        return from_cents(penalty_cents(
+            PYTHON_OPS, to_cents(self.bet_amount),
+            to_cents(self.return_amount), self.salary_percentage,
+            self.is_error))
+
+    @property
+    def real_salary(self):
+        """Реальная зарплата за отчет"""
+        return from_cents(to_cents(self.salary) - to_cents(self.penalty))
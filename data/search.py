@@ -0,0 +1,157 @@
+"""Полнотекстовый поиск по отчетам, букмекерам, кошелькам и сотрудникам
+
+Виртуальная таблица SQLite FTS5 search_index хранит по одной строке на
+объект: вид объекта, его id и текст для поиска (матч и никнейм отчета,
+название БК и профиля букмекера, название кошелька, имя пользователя и
+имя сотрудника). Таблица создается миграцией и поддерживается триггерами
+на исходных таблицах, поэтому любые способы записи (ORM, массовые
+вставки, архивация) сразу отражаются в поиске.
+
+rowid строки индекса вычисляется как id * len(SEARCH_KINDS) + номер вида,
+поэтому триггеры обновляют и удаляют строку по первичному ключу, а не
+перебором индекса. Поиск идет по префиксам слов и сортируется по bm25.
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import text
+from data.tools import session_scope
+
+SEARCH_TABLE = "search_index"
+
+
+@dataclass(frozen=True)
+class SearchSource:
+    """
+    Таблица, попадающая в индекс
+
+    Поля:
+    code -- номер вида объекта в rowid
+    table -- имя таблицы
+    body -- SQL-выражение текста по строке new
+    columns -- колонки, при изменении которых строка индекса пересчитывается
+    deleted -- колонка мягкого удаления (удаленные строки не индексируются)
+    """
+    code: int
+    table: str
+    body: str
+    columns: tuple
+    deleted: Optional[str] = "is_deleted"
+
+
+# вид объекта -> источник
+SEARCH_KINDS = {
+    "report": SearchSource(
+        0, "report",
+        "coalesce(new.match_name, '') || ' ' || coalesce(new.nickname, '')",
+        ("match_name", "nickname")),
+    "bookmaker": SearchSource(
+        1, "bookmaker",
+        "coalesce(new.bk_name, '') || ' ' || coalesce(new.name, '')",
+        ("bk_name", "name")),
+    "wallet": SearchSource(2, "wallet", "coalesce(new.name, '')", ("name",)),
+    "employee": SearchSource(
+        3, "employee",
+        "coalesce(new.username, '') || ' ' || coalesce(new.name, '')",
+        ("username", "name"), deleted=None),
+}
+
+KIND_LABELS = {
+    "report": "Отчет",
+    "bookmaker": "Букмекер",
+    "wallet": "Кошелек",
+    "employee": "Сотрудник",
+}
+
+
+@dataclass
+class SearchHit:
+    """
+    Результат поиска
+
+    Поля:
+    kind -- вид объекта (ключ SEARCH_KINDS)
+    ref_id -- id объекта в его таблице
+    body -- проиндексированный текст
+    rank -- оценка bm25 (меньше - лучше)
+    """
+    kind: str
+    ref_id: int
+    body: str
+    rank: float
+
+    @property
+    def title(self) -> str:
+        body = " ".join(self.body.split()) or "без названия"
+        return f"{KIND_LABELS[self.kind]} № {self.ref_id}: {body}"
+
+
+def _rowid(kind: str, row: str) -> str:
+    return f"{row}.id * {len(SEARCH_KINDS)} + {SEARCH_KINDS[kind].code}"
+
+
+def create_search_index(connection):
+    """
+    Создание (пересоздание) индекса, триггеров и заполнение по текущим
+    данным. Синхронная функция над Connection, как миграции.
+    """
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        f"kind UNINDEXED, ref_id UNINDEXED, body, "
+        f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"))
+    for kind, source in SEARCH_KINDS.items():
+        columns = source.columns
+        where = ""
+        if source.deleted:
+            columns += (source.deleted,)
+            where = f" WHERE NOT coalesce(new.{source.deleted}, 0)"
+        # SELECT вместо VALUES, чтобы удаленные строки отсекались условием
+        insert = (f"INSERT INTO {SEARCH_TABLE} (rowid, kind, ref_id, body) "
+                  f"SELECT {_rowid(kind, 'new')}, '{kind}', new.id, "
+                  f"{source.body}")
+        delete = (f"DELETE FROM {SEARCH_TABLE} "
+                  f"WHERE rowid = {_rowid(kind, 'old')}")
+        triggers = {
+            "ai": f"AFTER INSERT ON {source.table} "
+                  f"BEGIN {insert}{where}; END",
+            "au": f"AFTER UPDATE OF {', '.join(columns)} ON {source.table} "
+                  f"BEGIN {delete}; {insert}{where}; END",
+            "ad": f"AFTER DELETE ON {source.table} BEGIN {delete}; END",
+        }
+        for suffix, trigger in triggers.items():
+            name = f"{SEARCH_TABLE}_{kind}_{suffix}"
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+            connection.execute(text(f"CREATE TRIGGER {name} {trigger}"))
+        connection.execute(text(
+            f"{insert} FROM {source.table} AS new{where}"))
+
+
+def match_expression(query: str) -> Optional[str]:
+    """
+    Запрос пользователя -> выражение FTS5: все слова обязательны,
+    каждое ищется как префикс. None, если в запросе нет слов.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+async def search(query: str, kinds=None, offset=0, limit=10) -> list:
+    """Поиск по индексу, результаты SearchHit в порядке релевантности"""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    params = {"expression": expression, "offset": offset, "limit": limit}
+    kind_filter = ""
+    if kinds:
+        names = [f":kind{n}" for n in range(len(kinds))]
+        kind_filter = f"AND kind IN ({', '.join(names)})"
+        params.update({f"kind{n}": kind for n, kind in enumerate(kinds)})
+    async with session_scope() as session:
+        rows = await session.execute(text(
+            f"SELECT kind, ref_id, body, rank FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH :expression {kind_filter} "
+            f"ORDER BY rank LIMIT :limit OFFSET :offset"), params)
+        return [SearchHit(*row) for row in rows]
@@ -0,0 +1,227 @@
+"""Снимки балансов на конец дня
+
+Снимок (BalanceSnapshot) хранит балансы всех стран, букмекеров, кошельков и
+сотрудников на конец дня. Баланс на произвольную дату считается как
+ближайший снимок не позже этой даты плюс изменения после него - проводки
+журнала LedgerEntry (транзакции, отчеты, депозиты и корректировки) за
+промежуток между снимком и датой. Снимок - сумма всего журнала до конца
+дня одним GROUP BY.
+
+Запись задним числом (отчет из файла, удаление старого отчета, проводки
+старых транзакций) удаляет снимки с ее даты и позже через
+data.utils.invalidate_snapshots, и баланс на дату считается от более
+раннего снимка.
+"""
+import datetime
+from sqlalchemy import select, delete, func
+from data.tools import session_scope
+from data.models import *
+from data.statistic import BalanceSheet, get_balance_sheet
+from data.utils import get_countries, get_bookmakers, get_wallets, \
+    get_employees
+
+
+def _day_end(day: datetime.date) -> datetime.datetime:
+    """Начало следующего дня - граница "конца дня" для выборок"""
+    return datetime.datetime.combine(day + datetime.timedelta(days=1),
+                                     datetime.time())
+
+
+def _window(column, start, end):
+    criteria = []
+    if start is not None:
+        criteria.append(column >= start)
+    if end is not None:
+        criteria.append(column < end)
+    return criteria
+
+
+async def get_balance_deltas(start=None, end=None) -> BalanceSheet:
+    """
+    Изменения балансов букмекеров, кошельков и сотрудников за [start, end)
+
+    Считается одним агрегатным запросом по журналу проводок, без загрузки
+    самих транзакций и отчетов. Границы None означают открытый интервал.
+    Поле countries не заполняется - оно зависит от флагов букмекеров и
+    кошельков, см. get_balances_as_of.
+    """
+    deltas = BalanceSheet(bookmakers={}, wallets={}, countries={},
+                          employees={})
+    async with session_scope() as session:
+        ledger = await session.execute(
+            select(LedgerEntry.entity_type, LedgerEntry.entity_id,
+                   LedgerEntry.bucket, func.sum(LedgerEntry.amount))
+            .where(LedgerEntry.entity_type.in_(
+                ("wallet", "bookmaker", "employee")),
+                *_window(LedgerEntry.timestamp, start, end))
+            .group_by(LedgerEntry.entity_type, LedgerEntry.entity_id,
+                      LedgerEntry.bucket))
+        for entity_type, entity_id, bucket, amount in ledger:
+            if entity_type == "wallet":
+                deltas.wallets[entity_id] = deltas.wallets.get(
+                    entity_id, 0) + amount
+            elif entity_type == "employee":
+                deltas.employees[entity_id] = deltas.employees.get(
+                    entity_id, 0) + amount
+            else:
+                deposit, balance = deltas.bookmakers.get(entity_id, (0, 0))
+                if bucket == "deposit":
+                    deposit += amount
+                deltas.bookmakers[entity_id] = (deposit, balance + amount)
+    return deltas
+
+
+def _add_country_deltas(sheet: BalanceSheet, deltas: BalanceSheet,
+                        bookmakers, wallets, sign=1):
+    """Перенос изменений букмекеров и кошельков на балансы их стран"""
+    for country_id in sheet.countries:
+        balance, active_balance = sheet.countries[country_id]
+        for bookmaker in bookmakers:
+            if bookmaker.country_id != country_id:
+                continue
+            deposit, bk_balance = deltas.bookmakers.get(bookmaker.id, (0, 0))
+            if bookmaker.is_active:
+                balance += sign * deposit
+            if not bookmaker.is_deleted:
+                active_balance += sign * bk_balance
+        for wallet in wallets:
+            if wallet.country_id == country_id and not wallet.is_deleted:
+                active_balance += sign * deltas.wallets.get(wallet.id, 0)
+        sheet.countries[country_id] = (balance, active_balance)
+
+
+def _apply_deltas(sheet: BalanceSheet, deltas: BalanceSheet, bookmakers,
+                  wallets, sign=1) -> BalanceSheet:
+    for bookmaker_id, (deposit, balance) in deltas.bookmakers.items():
+        if bookmaker_id in sheet.bookmakers:
+            old_deposit, old_balance = sheet.bookmakers[bookmaker_id]
+            sheet.bookmakers[bookmaker_id] = (old_deposit + sign * deposit,
+                                              old_balance + sign * balance)
+    for wallet_id, balance in deltas.wallets.items():
+        if wallet_id in sheet.wallets:
+            sheet.wallets[wallet_id] += sign * balance
+    for employee_id, balance in deltas.employees.items():
+        if employee_id in sheet.employees:
+            sheet.employees[employee_id] += sign * balance
+    _add_country_deltas(sheet, deltas, bookmakers, wallets, sign)
+    return sheet
+
+
+async def _compute_balances_at_day_end(day: datetime.date, countries,
+                                       bookmakers, wallets,
+                                       employees) -> BalanceSheet:
+    """Суммы журнала до конца дня day"""
+    return await get_balance_sheet(countries, bookmakers, wallets, employees,
+                                   end=_day_end(day))
+
+
+async def take_balance_snapshot(day: datetime.date = None) -> int:
+    """
+    Снятие снимка балансов на конец дня day (по умолчанию - вчера)
+
+    Снимок можно снимать в любой момент после окончания дня: изменения,
+    сделанные позже, вычитаются. Повторный вызов для той же даты
+    перезаписывает снимок. Возвращает количество записанных строк.
+    """
+    if day is None:
+        day = datetime.date.today() - datetime.timedelta(days=1)
+    countries = await get_countries()
+    bookmakers = await get_bookmakers()
+    wallets = await get_wallets()
+    employees = await get_employees()
+    sheet = await _compute_balances_at_day_end(day, countries, bookmakers,
+                                               wallets, employees)
+
+    rows = [BalanceSnapshot(date=day, entity_type="country", entity_id=id_,
+                            balance=active_balance, deposit=balance)
+            for id_, (balance, active_balance) in sheet.countries.items()]
+    rows += [BalanceSnapshot(date=day, entity_type="bookmaker",
+                             entity_id=id_, balance=balance, deposit=deposit)
+             for id_, (deposit, balance) in sheet.bookmakers.items()]
+    rows += [BalanceSnapshot(date=day, entity_type="wallet", entity_id=id_,
+                             balance=balance)
+             for id_, balance in sheet.wallets.items()]
+    rows += [BalanceSnapshot(date=day, entity_type="employee", entity_id=id_,
+                             balance=balance)
+             for id_, balance in sheet.employees.items()]
+
+    async with session_scope() as session:
+        await session.execute(
+            delete(BalanceSnapshot).where(BalanceSnapshot.date == day))
+        session.add_all(rows)
+    return len(rows)
+
+
+async def get_last_snapshot_date(day: datetime.date = None):
+    """Дата последнего снимка не позже day"""
+    async with session_scope() as session:
+        q = select(func.max(BalanceSnapshot.date))
+        if day is not None:
+            q = q.where(BalanceSnapshot.date <= day)
+        return (await session.execute(q)).scalar()
+
+
+async def _read_snapshot(day: datetime.date, countries, bookmakers, wallets,
+                         employees) -> BalanceSheet:
+    snapshots = await BalanceSnapshot.filter(BalanceSnapshot.date == day)
+    stored = {(s.entity_type, s.entity_id): s for s in snapshots}
+
+    def value(entity_type, entity_id, default=0):
+        snapshot = stored.get((entity_type, entity_id))
+        return snapshot.balance if snapshot else default
+
+    def deposit(entity_type, entity_id):
+        snapshot = stored.get((entity_type, entity_id))
+        return (snapshot.deposit or 0) if snapshot else 0
+
+    # сущности, созданные после снимка, начинают с нуля (начальный депозит
+    # кошелька - проводка после снимка)
+    return BalanceSheet(
+        bookmakers={b.id: (deposit("bookmaker", b.id),
+                           value("bookmaker", b.id)) for b in bookmakers},
+        wallets={w.id: value("wallet", w.id) for w in wallets},
+        countries={c.id: (deposit("country", c.id), value("country", c.id))
+                   for c in countries},
+        employees={e.id: value("employee", e.id) for e in employees})
+
+
+async def get_balances_as_of(day: datetime.date):
+    """
+    Балансы на конец дня day
+
+    Возвращает словарь в формате get_total_balances, поэтому его можно
+    вывести через iter_balance_stats_lines. Если снимков до day нет,
+    балансы считаются от текущих значений назад.
+    """
+    countries = await get_countries()
+    bookmakers = await get_bookmakers()
+    wallets = await get_wallets()
+    employees = await get_employees()
+
+    snapshot_date = await get_last_snapshot_date(day)
+    if snapshot_date is None:
+        sheet = await _compute_balances_at_day_end(day, countries, bookmakers,
+                                                   wallets, employees)
+    else:
+        sheet = await _read_snapshot(snapshot_date, countries, bookmakers,
+                                     wallets, employees)
+        if snapshot_date < day:
+            deltas = await get_balance_deltas(start=_day_end(snapshot_date),
+                                              end=_day_end(day))
+            _apply_deltas(sheet, deltas, bookmakers, wallets)
+
+    return {
+        'date': day,
+        'snapshot_date': snapshot_date,
+        'total_balance': sum(sheet.countries[c.id][1] for c in countries),
+        'total_bookmaker_balance': sum(
+            sheet.bookmakers[b.id][1] for b in bookmakers),
+        'total_active_bookmaker_balance': sum(
+            sheet.bookmakers[b.id][1] for b in bookmakers if b.is_active),
+        'total_wallet_balance': sum(sheet.wallets[w.id] for w in wallets),
+        'countries': countries,
+        'bookmakers': bookmakers,
+        'wallets': wallets,
+        'employees': employees,
+        'sheet': sheet
+    }
@@ -1,6 +1,11 @@
 from sqlalchemy import select, func, and_, case
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from data.utils import *
+from data.rows import get_report_rows
+from data.analytics import get_report_metrics, load_report_extract
+from data.money import money_sum
+from data.cache import cached
+from data.tools import gather_reads
 from datetime import timedelta, datetime
 
 
@@ -13,61 +18,105 @@ class TotalStats:
 
 async def get_total_stats_by_period(start_date: datetime.date,
                                     end_date: datetime.date) -> TotalStats:
-    async with session_scope() as session:
-        query = (
-            select(
-                func.sum(Report.bet_amount).label('total_bet'),
-                func.sum(Report.return_amount - Report.bet_amount).label(
-                    'total_profit'),
-                func.sum(
-                    case(
-                        (Report.is_error == False,
-                         Report.bet_amount * Report.salary_percentage / 100),
-                        else_=0
-                    )
-                ).label('total_salary'),
-                func.sum(
-                    case(
-                        (and_(Report.is_error == True,
-                              Report.return_amount - Report.bet_amount < 0),
-                         func.abs(
-                             Report.return_amount - Report.bet_amount) * 3 * Report.salary_percentage / 100),
-                        else_=0
-                    )
-                ).label('total_penalty')
-            )
-            .select_from(Report.__table__.join(Bookmaker.__table__,
-                                               Report.bookmaker_id == Bookmaker.id))
-            .where(Report.date >= start_date)
-            .where(Report.date < end_date + timedelta(days=1),
-                   Report.is_deleted == False)
-        )
-
-        result = await session.execute(query)
-        row = result.first()
-
-        total_bet = row.total_bet or 0
-        total_profit = row.total_profit or 0
-        total_salary = row.total_salary or 0
-        total_penalty = row.total_penalty or 0
-
+    metrics = await get_report_metrics(
+        Report.date >= start_date,
+        Report.date < end_date + timedelta(days=1))
     return TotalStats(
-        total_bet=total_bet,
-        total_profit=total_profit,
-        total_salary=total_salary - total_penalty
+        total_bet=metrics.bet,
+        total_profit=metrics.profit,
+        total_salary=metrics.real_salary
     )
 
 
+@dataclass
+class BalanceSheet:
+    """
+    Балансы, посчитанные один раз для всех сущностей
+
+    Поля:
+    bookmakers -- id букмекера -> (депозит, баланс)
+    wallets -- id кошелька -> баланс
+    countries -- id страны -> (пассивный баланс, активный баланс)
+    employees -- id сотрудника -> баланс
+    """
+    bookmakers: dict
+    wallets: dict
+    countries: dict
+    employees: dict = field(default_factory=dict)
+
+
+def compute_balance_sheet(countries, bookmakers, wallets,
+                          ledger: dict) -> BalanceSheet:
+    """
+    Расчет балансов всех стран, букмекеров и кошельков
+
+    Балансы букмекеров и кошельков берутся из сумм журнала ledger
+    (результат get_ledger_sums), балансы стран собираются из уже
+    посчитанных значений.
+    """
+    bookmaker_values = {}
+    wallet_values = {}
+
+    def bookmaker_value(bookmaker):
+        if bookmaker.id not in bookmaker_values:
+            buckets = ledger.get(("bookmaker", bookmaker.id), {})
+            bookmaker_values[bookmaker.id] = (buckets.get("deposit") or 0,
+                                              money_sum(buckets.values()))
+        return bookmaker_values[bookmaker.id]
+
+    def wallet_value(wallet):
+        if wallet.id not in wallet_values:
+            wallet_values[wallet.id] = money_sum(
+                ledger.get(("wallet", wallet.id), {}).values())
+        return wallet_values[wallet.id]
+
+    for bookmaker in bookmakers:
+        bookmaker_value(bookmaker)
+    for wallet in wallets:
+        wallet_value(wallet)
+
+    country_values = {}
+    for country in countries:
+        balance = sum(bookmaker_value(b)[0] for b in country.bookmakers
+                      if b.is_active)
+        active_balance = sum(
+            bookmaker_value(b)[1] for b in country.bookmakers
+            if not b.is_deleted) + sum(
+            wallet_value(w) for w in country.wallets if not w.is_deleted)
+        country_values[country.id] = (balance, active_balance)
+
+    return BalanceSheet(bookmakers=bookmaker_values, wallets=wallet_values,
+                        countries=country_values)
+
+
+async def get_balance_sheet(countries, bookmakers, wallets, employees=(),
+                            end=None) -> BalanceSheet:
+    """
+    Балансы стран, букмекеров, кошельков и сотрудников по журналу
+    проводок одним GROUP BY (с end - на момент end)
+    """
+    ledger = await get_ledger_sums(("bookmaker", "wallet", "employee"),
+                                   end=end)
+    sheet = compute_balance_sheet(countries, bookmakers, wallets, ledger)
+    sheet.employees = {
+        e.id: money_sum(ledger.get(("employee", e.id), {}).values())
+        for e in employees}
+    return sheet
+
+
+@cached()
 async def get_total_balances():
-    countries = await get_countries()
-    bookmakers = await get_bookmakers()
-    wallets = await get_wallets()
+    countries, bookmakers, wallets = await gather_reads(
+        get_countries(), get_bookmakers(), get_wallets())
 
-    total_balance = sum(c.get_active_balance() for c in countries)
-    total_bookmaker_balance = sum(b.get_balance() for b in bookmakers)
+    sheet = await get_balance_sheet(countries, bookmakers, wallets)
+
+    total_balance = sum(sheet.countries[c.id][1] for c in countries)
+    total_bookmaker_balance = sum(
+        sheet.bookmakers[b.id][1] for b in bookmakers)
     total_active_bookmaker_balance = sum(
-        b.get_balance() for b in bookmakers if b.is_active)
-    total_wallet_balance = sum(w.get_balance() for w in wallets)
+        sheet.bookmakers[b.id][1] for b in bookmakers if b.is_active)
+    total_wallet_balance = sum(sheet.wallets[w.id] for w in wallets)
 
     return {
         'total_balance': total_balance,
@@ -76,12 +125,25 @@ async def get_total_balances():
         'total_wallet_balance': total_wallet_balance,
         'countries': countries,
         'bookmakers': bookmakers,
-        'wallets': wallets
+        'wallets': wallets,
+        'sheet': sheet
     }
 
 
+async def get_country_balances(country) -> tuple:
+    """Пассивный и активный баланс страны по журналу проводок"""
+    sheet = await get_balance_sheet([country], country.bookmakers,
+                                    country.wallets)
+    return sheet.countries[country.id]
+
+
+@cached()
 async def get_country_stats_by_id(country_id):
-    country = await Country.get(id=country_id)
+    country, extract, transactions = await gather_reads(
+        Country.get(id=country_id),
+        load_report_extract(Report.country_id == country_id),
+        Transaction.filter(Transaction.country_id == country_id,
+                           Transaction.is_deleted == False))
     if not country:
         return None
 
@@ -89,170 +151,92 @@ async def get_country_stats_by_id(country_id):
     month_start = datetime(today.year, today.month, 1).date()
     week_start = today - timedelta(days=today.weekday())
 
-    filters = [Report.country_id == country_id, Report.is_deleted == False]
-
-    reports = await Report.filter(*filters)
-    transactions = await Transaction.filter(
-        Transaction.country_id == country_id, Transaction.is_deleted == False)
-
-    total_bet = sum(r.bet_amount for r in reports)
-    total_profit = sum(r.real_profit for r in reports)
-    total_expenses = sum(t.real_amount for t in transactions)
-    total_salary = sum(r.real_salary for r in reports) - sum(
-        r.penalty for r in reports)
-
-    month_bet = sum(
-        r.bet_amount for r in reports if r.date.date() >= month_start)
-    month_profit = sum(
-        r.real_profit for r in reports if r.date.date() >= month_start)
-    month_expenses = sum(
-        t.real_amount for t in transactions if t.date.date() >= month_start)
-    month_salary = sum(
-        r.real_salary for r in reports if r.date.date() >= month_start)
-
-    week_bet = sum(
-        r.bet_amount for r in reports if r.date.date() >= week_start)
-    week_profit = sum(
-        r.real_profit for r in reports if r.date.date() >= week_start)
-    week_expenses = sum(
-        t.real_amount for t in transactions if t.date.date() >= week_start)
-    week_salary = sum(
-        r.real_salary for r in reports if r.date.date() >= week_start)
-
-    day_bet = sum(r.bet_amount for r in reports if r.date.date() == today)
-    day_profit = sum(r.real_profit for r in reports if r.date.date() == today)
-    day_expenses = sum(
-        t.real_amount for t in transactions if t.date.date() == today)
-    day_salary = sum(r.real_salary for r in reports if r.date.date() == today)
-
-    return {
+    periods = {
+        'total': None,
+        'month': datetime.combine(month_start, datetime.min.time()),
+        'week': datetime.combine(week_start, datetime.min.time()),
+        'day': datetime.combine(today, datetime.min.time()),
+    }
+    balance, active_balance = await get_country_balances(country)
+    stats = {
         'country': country,
-        'balance': country.get_balance(),
-        'active_balance': country.get_active_balance(),
-        'total_bet': total_bet,
-        'total_profit': total_profit,
-        'total_expenses': total_expenses,
-        'total_salary': total_salary,
-        'month_bet': month_bet,
-        'month_profit': month_profit,
-        'month_expenses': month_expenses,
-        'month_salary': month_salary,
-        'week_bet': week_bet,
-        'week_profit': week_profit,
-        'week_expenses': week_expenses,
-        'week_salary': week_salary,
-        'day_bet': day_bet,
-        'day_profit': day_profit,
-        'day_expenses': day_expenses,
-        'day_salary': day_salary
+        'balance': balance,
+        'active_balance': active_balance,
     }
+    for period, since in periods.items():
+        metrics = extract.totals(
+            None if since is None else extract.since(since))
+        stats[f'{period}_bet'] = metrics.bet
+        stats[f'{period}_profit'] = metrics.profit
+        stats[f'{period}_expenses'] = money_sum(
+            t.real_amount for t in transactions
+            if since is None or (t.timestamp and t.timestamp >= since))
+        stats[f'{period}_salary'] = metrics.real_salary
+    return stats
 
 
 async def get_country_stats_by_period(country_id, start_date=None,
                                       end_date=None):
-    country = await Country.get(id=country_id)
-    if not country:
-        return None
-
-    filters = [Report.country_id == country_id, Report.is_deleted == False]
+    filters = [Report.country_id == country_id]
     if start_date and end_date:
         filters.append(
             and_(Report.date >= start_date,
                  Report.date < end_date + timedelta(days=1)))
 
-    reports = await Report.filter(*filters)
-    transactions = await Transaction.filter(
-        Transaction.country_id == country_id, Transaction.is_deleted == False)
-
-    total_bet = sum(r.bet_amount for r in reports)
-    total_profit = sum(r.real_profit for r in reports)
-    total_expenses = sum(t.real_amount for t in transactions)
-    total_salary = sum(r.real_salary for r in reports) - sum(
-        r.penalty for r in reports)
+    country, metrics, transactions = await gather_reads(
+        Country.get(id=country_id),
+        get_report_metrics(*filters),
+        Transaction.filter(Transaction.country_id == country_id,
+                           Transaction.is_deleted == False))
+    if not country:
+        return None
 
+    balance, active_balance = await get_country_balances(country)
     return {
         "start_date": start_date,
         "end_date": end_date,
         'country': country,
-        "balance": country.get_balance(),
-        'active_balance': country.get_active_balance(),
-        'total_bet': total_bet,
-        'total_profit': total_profit,
-        'total_expenses': total_expenses,
-        'total_salary': total_salary
+        "balance": balance,
+        'active_balance': active_balance,
+        'total_bet': metrics.bet,
+        'total_profit': metrics.profit,
+        'total_expenses': money_sum(t.real_amount for t in transactions),
+        'total_salary': metrics.real_salary
     }
 
 
+@cached()
 async def get_bookmaker_stats_by_id(bookmaker_id):
-    bookmaker = await get_bk_by_id(bookmaker_id)
+    bookmaker, extract = await gather_reads(
+        get_bk_by_id(bookmaker_id),
+        load_report_extract(Report.bookmaker_id == bookmaker_id))
     if not bookmaker:
         return None
 
     today = datetime.today().date()
     month_start = datetime(today.year, today.month, 1).date()
     week_start = today - timedelta(days=today.weekday())
-
-    async with session_scope() as session:
-        query = (
-            select(
-                func.count(Report.id).label('total_reports'),
-                func.sum(Report.bet_amount).label('total_bet'),
-                func.sum(Report.return_amount).label('total_return'),
-                func.sum(Report.return_amount - Report.bet_amount).label(
-                    'total_profit'),
-                func.count(Report.id).filter(
-                    Report.date >= month_start).label('month_reports'),
-                func.sum(Report.bet_amount).filter(
-                    Report.date >= month_start).label('month_bet'),
-                func.sum(Report.return_amount).filter(
-                    Report.date >= month_start).label('month_return'),
-                func.sum(Report.return_amount - Report.bet_amount).filter(
-                    Report.date >= month_start).label('month_profit'),
-                func.count(Report.id).filter(Report.date >= week_start).label(
-                    'week_reports'),
-                func.sum(Report.bet_amount).filter(
-                    Report.date >= week_start).label('week_bet'),
-                func.sum(Report.return_amount).filter(
-                    Report.date >= week_start).label('week_return'),
-                func.sum(Report.return_amount - Report.bet_amount).filter(
-                    Report.date >= week_start).label('week_profit'),
-                func.count(Report.id).filter(Report.date == today).label(
-                    'day_reports'),
-                func.sum(Report.bet_amount).filter(
-                    Report.date == today).label('day_bet'),
-                func.sum(Report.return_amount).filter(
-                    Report.date == today).label('day_return'),
-                func.sum(Report.return_amount - Report.bet_amount).filter(
-                    Report.date == today).label('day_profit')
-            )
-            .join(Bookmaker, Report.bookmaker_id == Bookmaker.id)
-            .where(Report.bookmaker_id == bookmaker.id)
-            .where(Report.is_deleted == False)  # Фильтрация по is_deleted
-        )
-        result = await session.execute(query)
-        stats = result.fetchone()
-
-    return {
+    periods = {
+        'total': None,
+        'month': datetime.combine(month_start, datetime.min.time()),
+        'week': datetime.combine(week_start, datetime.min.time()),
+        'day': datetime.combine(today, datetime.min.time()),
+    }
+    sheet = await get_balance_sheet([], [bookmaker], [])
+    deposit, balance = sheet.bookmakers[bookmaker.id]
+    stats = {
         'bookmaker': bookmaker,
-        'deposit': bookmaker.get_deposit(),
-        'balance': bookmaker.get_balance(),
-        'total_reports': stats.total_reports,
-        'total_bet': stats.total_bet,
-        'total_return': stats.total_return,
-        'total_profit': stats.total_profit,
-        'month_reports': stats.month_reports,
-        'month_bet': stats.month_bet,
-        'month_return': stats.month_return,
-        'month_profit': stats.month_profit,
-        'week_reports': stats.week_reports,
-        'week_bet': stats.week_bet,
-        'week_return': stats.week_return,
-        'week_profit': stats.week_profit,
-        'day_reports': stats.day_reports,
-        'day_bet': stats.day_bet,
-        'day_return': stats.day_return,
-        'day_profit': stats.day_profit
+        'deposit': deposit,
+        'balance': balance,
     }
+    for period, since in periods.items():
+        metrics = extract.totals(
+            None if since is None else extract.since(since))
+        stats[f'{period}_reports'] = metrics.reports
+        stats[f'{period}_bet'] = metrics.bet
+        stats[f'{period}_return'] = metrics.returned
+        stats[f'{period}_profit'] = metrics.profit
+    return stats
 
 
 async def get_source_stats_data(source_id, start_date, end_date):
@@ -260,73 +244,29 @@ async def get_source_stats_data(source_id, start_date, end_date):
     if not source:
         return None
 
-    async with session_scope() as session:
-        query = (
-            select(
-                func.sum(Report.bet_amount).label('total_bet'),
-                func.sum(Report.return_amount).label('total_return'),
-                func.sum(Report.return_amount - Report.bet_amount).label(
-                    'total_profit'),
-                func.sum(
-                    case(
-                        (Report.is_error == False,
-                         Report.bet_amount * Report.salary_percentage / 100),
-                        else_=0
-                    )
-                ).label('total_salary'),
-                func.sum(
-                    case(
-                        (and_(Report.is_error == True,
-                              Report.return_amount - Report.bet_amount < 0),
-                         func.abs(
-                             Report.return_amount - Report.bet_amount) * 3 * Report.salary_percentage / 100),
-                        else_=0
-                    )
-                ).label('total_penalty')
-            )
-            .join(Bookmaker, Report.bookmaker_id == Bookmaker.id)
-            .where(
-                and_(
-                    Report.source_id == source_id,
-                    Report.date >= start_date,
-                    Report.date < end_date + timedelta(days=1),
-                    Report.is_deleted == False
-                )
-            )
-        )
-
-        result = await session.execute(query)
-        stats = result.fetchone()
-
-        if stats is None or all(value is None for value in stats):
-            return {
-                "start_date": start_date,
-                "end_date": end_date,
-                'source': source,
-                'total_bet': 0,
-                'total_return': 0,
-                'total_profit': 0,
-                'total_salary': 0
-            }
-
-        return {
-            "start_date": start_date,
-            "end_date": end_date,
-            'source': source,
-            'total_bet': stats.total_bet or 0,
-            'total_return': stats.total_return or 0,
-            'total_profit': stats.total_profit or 0,
-            'total_salary': (stats.total_salary or 0) - (
-                        stats.total_penalty or 0)
-        }
+    metrics = await get_report_metrics(
+        Report.source_id == source_id,
+        Report.date >= start_date,
+        Report.date < end_date + timedelta(days=1))
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        'source': source,
+        'total_bet': metrics.bet,
+        'total_return': metrics.returned,
+        'total_profit': metrics.profit,
+        'total_salary': metrics.real_salary
+    }
 
 
+@cached()
 async def salary_stats():
     employees = await get_employees()
-    total_salary = sum(e.get_balance() for e in employees)
+    sheet = await get_balance_sheet([], [], [], employees)
     return {
-        'total_salary': total_salary,
-        'employees': employees
+        'total_salary': money_sum(sheet.employees.values()),
+        'employees': employees,
+        'balances': sheet.employees
     }
 
 
@@ -337,62 +277,73 @@ async def get_employee_stats_by_id(employee_id):
 
     return {
         'employee': employee,
-        'salary': employee.get_balance()
+        'salary': await get_ledger_balance("employee", employee.id)
     }
 
 
-async def get_reports_by_period(start_date, end_date, source_id=None):
+async def get_reports_by_period(start_date, end_date, source_id=None,
+                                offset: int = 0, limit: int = None):
     filters = [and_(Report.date >= start_date,
                     Report.date < end_date + timedelta(days=1),
                     Report.is_deleted == False)]
     if source_id:
         filters.append(Report.source_id == source_id)
+    return await get_report_rows(*filters, offset=offset, limit=limit)
 
-    async with session_scope() as session:
-        query = select(Report).where(and_(*filters)).order_by(Report.date)
-        result = await session.execute(query)
-        reports = result.scalars().unique().all()
 
-    return reports
+def iter_balance_stats_lines(stats):
+    """
+    Построчное форматирование общей статистики балансов
 
+    Все суммы берутся из заранее посчитанного по журналу BalanceSheet.
+    """
+    sheet = stats["sheet"]
+    bookmakers = stats["bookmakers"]
+    active_bookmakers = [b for b in bookmakers if b.is_active]
 
-async def format_balance_stats(stats):
-    output = "🏦 Общий баланс в бизнесе - {:.1f} EUR\n\n".format(
+    yield "🏦 Общий баланс в бизнесе - {:.1f} EUR".format(
         stats["total_balance"])
-    output += "🌎 Страны ({}) - {:.1f} EUR\n\n".format(len(stats["countries"]),
-                                                      stats["total_balance"])
+    yield ""
+    yield "🌎 Страны ({}) - {:.1f} EUR".format(len(stats["countries"]),
+                                               stats["total_balance"])
+    yield ""
     for country in sorted(stats["countries"], key=lambda c: c.name):
-        output += "- {} {} - {:.1f}({:.1f}) EUR\n".format(country.flag,
-                                                          country.name,
-                                                          country.get_balance(),
-                                                          country.get_active_balance())
-    output += "\n💸 БК ({}) {:.1f}({:.1f}) EUR\n".format(
-        len(stats["bookmakers"]),
-        sum(b.get_deposit() for b in stats["bookmakers"]),
-        sum(b.get_balance() for b in stats["bookmakers"]))
-    output += "💸 Активные БК ({}) {:.1f}({:.1f}) EUR\n\n".format(
-        len([b for b in stats["bookmakers"] if b.is_active]),
-        sum(b.get_deposit() for b in stats["bookmakers"] if b.is_active),
-        sum(b.get_balance() for b in stats["bookmakers"] if b.is_active))
-    for bookmaker in sorted(stats["bookmakers"],
-                            key=lambda bk: bk.country.name):
-        output += "{} {} | {} | {} | {:.1f} ({:.1f}) EUR\n".format(
+        balance, active_balance = sheet.countries[country.id]
+        yield "- {} {} - {:.1f}({:.1f}) EUR".format(country.flag,
+                                                    country.name,
+                                                    balance, active_balance)
+    yield ""
+    yield "💸 БК ({}) {:.1f}({:.1f}) EUR".format(
+        len(bookmakers),
+        sum(sheet.bookmakers[b.id][0] for b in bookmakers),
+        sum(sheet.bookmakers[b.id][1] for b in bookmakers))
+    yield "💸 Активные БК ({}) {:.1f}({:.1f}) EUR".format(
+        len(active_bookmakers),
+        sum(sheet.bookmakers[b.id][0] for b in active_bookmakers),
+        sum(sheet.bookmakers[b.id][1] for b in active_bookmakers))
+    yield ""
+    for bookmaker in sorted(bookmakers, key=lambda bk: bk.country.name):
+        deposit, balance = sheet.bookmakers[bookmaker.id]
+        yield "{} {} | {} | {} | {:.1f} ({:.1f}) EUR".format(
             bookmaker.country.flag, bookmaker.country.name, bookmaker.bk_name,
-            bookmaker.name,
-            bookmaker.get_deposit(), bookmaker.get_balance())
-    output += "\n👛 Кошельки ({}) {:.1f} EUR\n\n".format(len(stats["wallets"]),
-                                                        stats[
-                                                            "total_wallet_balance"])
+            bookmaker.name, deposit, balance)
+    yield ""
+    yield "👛 Кошельки ({}) {:.1f} EUR".format(len(stats["wallets"]),
+                                              stats["total_wallet_balance"])
+    yield ""
     for wallet in stats["wallets"]:
         if wallet.country:
-            output += "{} {} | {} | {:.1f} EUR\n".format(wallet.country.flag,
-                                                         wallet.country.name,
-                                                         wallet.name,
-                                                         wallet.get_balance())
+            yield "{} {} | {} | {:.1f} EUR".format(wallet.country.flag,
+                                                  wallet.country.name,
+                                                  wallet.name,
+                                                  sheet.wallets[wallet.id])
         else:
-            output += "{} | {:.1f} EUR\n".format(wallet.name,
-                                                 wallet.get_balance())
-    return output
+            yield "{} | {:.1f} EUR".format(wallet.name,
+                                          sheet.wallets[wallet.id])
+
+
+async def format_balance_stats(stats):
+    return "".join(line + "\n" for line in iter_balance_stats_lines(stats))
 
 
 async def format_country_stats(stats):
@@ -510,7 +461,7 @@ async def format_salary_stats(stats):
         stats["total_salary"])
     for employee in stats["employees"]:
         output += "{} - {:.1f}\n".format(employee.name,
-                                         employee.get_balance())
+                                         stats["balances"][employee.id])
     return output
 
 
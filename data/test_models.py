@@ -1,20 +1,39 @@
+import asyncio
 import pytest
-from sqlalchemy import select
+from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from unittest.mock import patch
-from data.base import Model
+from data.base import Model, UpdateConflict, retry_on_conflict
 import pytest_asyncio
 from contextlib import asynccontextmanager
 import logging
 from data.statistic import *
 from data.utils import *
+from data.snapshots import *
+from data.archive import *
+from data.money import to_cents, money_sum
+from data.migrations import apply_migrations, MIGRATIONS
+from data.analytics import *
+from data.pivot import *
+from data.commissions import run_commission_stats
+from data.search import search
+from data.cache import watch_engine, cache_metrics
+from data.metrics import Registry, instrument_engine, SQL_STATEMENTS
+from data.tools import gather_reads
+from report_logic.excel_ingest import ingest_excel_file, run_ingest_job
+from report_logic.transfer_import import import_transfers
+import openpyxl
 
 # Define the async engine and sessionmaker
 engine = create_async_engine("sqlite+aiosqlite:///:memory:")
 async_session = sessionmaker(engine, class_=AsyncSession,
                              expire_on_commit=False)
 
+# записи в тестовую базу сбрасывают кэш статистики
+watch_engine(engine)
+instrument_engine(engine)
+
 _logger = logging.getLogger(__name__)
 
 
@@ -231,6 +250,27 @@ async def test_employee_adjustment(db):
         assert employee.get_balance() == -40
 
 
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_pay_all_employee_salaries(db):
+    async with session_scope_test() as session:
+        paid = await Employee.create(id=1, name="John", adjustment=5)
+        await Employee.create(id=2, name="Jane", adjustment=-10)
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        await Report.create(employee_id=paid.id, bookmaker_id=bookmaker.id,
+                            bet_amount=100, return_amount=200)
+        await backfill_ledger()
+
+        assert await pay_all_employee_salaries() == {1: 15}
+        assert (await Employee.get(id=1)).get_balance() == 0
+        assert (await Employee.get(id=2)).get_balance() == -10
+        assert await get_ledger_balance("employee", 1) == 0
+        assert await get_ledger_balance("employee", 2) == -10
+        assert await pay_all_employee_salaries() == {}
+
+
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_delete_country(db):
@@ -263,6 +303,87 @@ async def test_update_bookmaker(db):
         assert updated_bookmaker.name == "Bet365 Canada"
 
 
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_update_version_conflict(db):
+    async with session_scope_test() as session:
+        wallet = await Wallet.create(name="Binance", adjustment=0)
+        assert wallet.version == 1
+        stale = await Wallet.get(id=wallet.id)
+
+        await wallet.update(adjustment=10)
+        assert wallet.version == 2
+        with pytest.raises(UpdateConflict):
+            await stale.update(adjustment=stale.adjustment + 5)
+        assert (await Wallet.get(id=wallet.id)).adjustment == 10
+
+        calls = []
+
+        async def adjust():
+            current = stale if not calls else await Wallet.get(id=wallet.id)
+            calls.append(current.version)
+            await current.update(adjustment=current.adjustment + 5)
+
+        await retry_on_conflict(adjust)
+        assert calls == [1, 2]
+        updated = await Wallet.get(id=wallet.id)
+        assert (updated.adjustment, updated.version) == (15, 3)
+
+        with pytest.raises(UpdateConflict):
+            await retry_on_conflict(
+                lambda: stale.update(adjustment=0), attempts=2)
+
+
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_bulk_operations(db):
+    async with session_scope_test() as session:
+        ids = await Country.bulk_create(
+            [{"name": "USA"}, {"name": " Spain ", "flag": "🇪🇸"},
+             {"name": "UK"}], return_ids=True, chunk_size=1)
+        countries = {c.id: c for c in await Country.all()}
+        assert [countries[i].name_key for i in ids] == ["usa", "spain", "uk"]
+        assert {c.version for c in countries.values()} == {1}
+        with pytest.raises(TypeError):
+            await Country.bulk_create([{"title": "France"}])
+
+        # строки с разными наборами колонок вставляются разными запросами,
+        # id все равно возвращаются в порядке rows
+        rows = [{"name": "Italy"}, {"name": "Peru", "flag": "PE"},
+                {"name": "Chile"}, {"id": 100, "name": "Cuba"},
+                {"name": "Oman", "flag": "OM"}, {"name": "Iraq"}]
+        mixed = await Country.bulk_create(rows, return_ids=True)
+        assert mixed[3] == 100
+        countries = {c.id: c for c in await Country.all()}
+        assert [countries[i].name for i in mixed] == \
+            [row["name"] for row in rows]
+        assert [countries[i].flag for i in mixed] == \
+            [row.get("flag") for row in rows]
+        await Country.bulk_soft_delete(Country.id.in_(mixed))
+
+        stale = await Country.get(id=ids[0])
+        assert await Country.bulk_update({
+            ids[0]: {"name": "Canada"},
+            ids[1]: {"flag": "ES", "version": 1}}) == 2
+        canada, spain = await Country.get(id=ids[0]), \
+            await Country.get(id=ids[1])
+        assert (canada.name_key, canada.version) == ("canada", 2)
+        assert (spain.flag, spain.version) == ("ES", 2)
+
+        # устаревшая версия откатывает всю транзакцию
+        with pytest.raises(UpdateConflict):
+            await Country.bulk_update({ids[2]: {"flag": "UK"},
+                                       ids[1]: {"flag": "?", "version": 1}})
+        assert (await Country.get(id=ids[2])).flag is None
+        with pytest.raises(UpdateConflict):
+            await stale.update(flag="?")
+
+        assert await Country.bulk_soft_delete(Country.id.in_(ids[:2])) == 2
+        assert await Country.bulk_soft_delete(Country.id.in_(ids[:2])) == 0
+        assert [c.id for c in await Country.filter_by(is_deleted=False)] == \
+            [ids[2]]
+
+
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_create_and_find_template_by_country(db):
@@ -299,6 +420,7 @@ async def test_create_transaction(db):
         assert wallet2.get_balance() == 2000
 
 
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
@@ -315,8 +437,20 @@ async def test_get_total_stats_by_period(db):
         assert result.total_profit == 100
         assert result.total_salary == 10
 
+        # отчет без букмекера тоже учитывается (внешнее соединение)
+        await Report.create(bet_amount=50, return_amount=20,
+                            date=datetime.date(2022, 1, 2))
+        result = await get_total_stats_by_period(datetime.date(2022, 1, 1),
+                                                 datetime.date(2022, 1, 2))
+
+        assert result.total_bet == 150
+        assert result.total_profit == 70
+        assert result.total_salary == 10
+
 
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_get_total_balances(db):
@@ -325,6 +459,7 @@ async def test_get_total_balances(db):
         bookmaker = await Bookmaker.create(name="Bet365",
                                            country_id=country.id)
         wallet = await Wallet.create(deposit=500, country_id=country.id)
+        await backfill_ledger()
 
         result = await get_total_balances()
 
@@ -334,7 +469,9 @@ async def test_get_total_balances(db):
         assert result['total_wallet_balance'] == 500
 
 
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_get_bookmaker_stats(db):
@@ -342,6 +479,7 @@ async def test_get_bookmaker_stats(db):
         bookmaker = await Bookmaker.create(name="Bet365", salary_percentage=0)
         report = await Report.create(bet_amount=100, return_amount=200,
                                      bookmaker_id=bookmaker.id)
+        await backfill_ledger()
 
         result = await get_bookmaker_stats_by_id(bookmaker.id)
 
@@ -352,6 +490,7 @@ async def test_get_bookmaker_stats(db):
         assert result['total_profit'] == 100
 
 
+# @patch('data.analytics.session_scope', new=session_scope_test)
 # @patch('data.statistic.session_scope', new=session_scope_test)
 # @patch('data.base.session_scope', new=session_scope_test)
 # @pytest.mark.asyncio
@@ -394,7 +533,34 @@ async def test_get_country_stats(db):
         assert result['total_salary'] == 10
 
 
+@patch('data.analytics.session_scope', new=session_scope_test)
+@patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_get_country_stats_penalty(db):
+    async with session_scope_test() as session:
+        country = await Country.create(name="USA")
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           country_id=country.id,
+                                           salary_percentage=10)
+        await Report.create(bet_amount=100, return_amount=200,
+                            country_id=country.id, bookmaker_id=bookmaker.id)
+        # ошибочный отчет в минус: штраф 50 * 3 * 10% = 15
+        await Report.create(bet_amount=100, return_amount=50, is_error=True,
+                            country_id=country.id, bookmaker_id=bookmaker.id)
+        await backfill_ledger()
+
+        # штраф вычитается из зарплаты один раз
+        result = await get_country_stats_by_id(country.id)
+        assert result['total_salary'] == -5
+        result = await get_country_stats_by_period(country.id)
+        assert result['total_salary'] == -5
+
+
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_get_salary_stats(db):
@@ -405,6 +571,7 @@ async def test_get_salary_stats(db):
         report = await Report.create(bet_amount=100, return_amount=200,
                                      employee_id=employee.id,
                                      bookmaker_id=bookmaker.id)
+        await backfill_ledger()
 
         result = await salary_stats()
 
@@ -412,7 +579,9 @@ async def test_get_salary_stats(db):
         assert len(result['employees']) == 1
 
 
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_get_employee_stats(db):
@@ -423,12 +592,15 @@ async def test_get_employee_stats(db):
         report = await Report.create(bet_amount=100, return_amount=200,
                                      employee_id=employee.id,
                                      bookmaker_id=bookmaker.id)
+        await backfill_ledger()
 
         result = await get_employee_stats_by_id(employee.id)
 
         assert result['salary'] == 10
 
 
+@patch('data.rows.session_scope', new=session_scope_test)
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
@@ -522,6 +694,7 @@ async def test_create_transaction_with_country(db):
         assert country.get_active_balance() == 500
 
 
+@patch('data.utils.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
 async def test_create_transaction(db):
@@ -549,6 +722,7 @@ async def test_create_transaction(db):
         assert wallet2.get_balance() == 1150
 
 
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
@@ -576,6 +750,7 @@ async def test_get_source_stats_data(db):
         assert result['total_salary'] == 30
 
 
+@patch('data.analytics.session_scope', new=session_scope_test)
 @patch('data.statistic.session_scope', new=session_scope_test)
 @patch('data.base.session_scope', new=session_scope_test)
 @pytest.mark.asyncio
@@ -606,4 +781,940 @@ async def test_employee_salary_calculation(db):
         employee2 = await Employee.get(id=employee2.id)
 
         assert employee1.salary() == 175  # (1000 * 0.1) + (500 * 0.15)
-        assert employee2.salary() == 200  # 2000 * 0.1
\ No newline at end of file
+        assert employee2.salary() == 200  # 2000 * 0.1
+
+
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_get_countries_page(db):
+    async with session_scope_test() as session:
+        for i in range(5):
+            await Country.create(name=f"Country{i}")
+
+        first_page = await get_countries(offset=0, limit=2)
+        last_page = await get_countries(offset=4, limit=2)
+
+        assert [c.name for c in first_page] == ["Country0", "Country1"]
+        assert [c.name for c in last_page] == ["Country4"]
+
+
+@patch('data.analytics.session_scope', new=session_scope_test)
+@patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_format_balance_stats(db):
+    async with session_scope_test() as session:
+        country = await Country.create(name="USA", flag="🇺🇸")
+        bookmaker = await Bookmaker.create(name="Profile", bk_name="Bet365",
+                                           country_id=country.id)
+        await Transaction.create(amount=300, where="deposit",
+                                 receiver_bookmaker_id=bookmaker.id)
+        await Wallet.create(name="Card", deposit=500, country_id=country.id)
+        await backfill_ledger()
+
+        stats = await get_total_balances()
+        lines = list(iter_balance_stats_lines(stats))
+
+        assert "- 🇺🇸 USA - 300.0(800.0) EUR" in lines
+        assert "🇺🇸 USA | Bet365 | Profile | 300.0 (300.0) EUR" in lines
+        assert "🇺🇸 USA | Card | 500.0 EUR" in lines
+        assert await format_balance_stats(stats) == "\n".join(lines) + "\n"
+
+
+
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_create_transaction_ledger(db):
+    async with session_scope_test() as session:
+        await add_wallet_to_db("Card", "Binance", "Общий", 1000)
+        wallet = (await Wallet.all())[0]
+        bookmaker = await Bookmaker.create(name="Bet365")
+
+        await create_transaction(wallet.id, None, None, bookmaker.id,
+                                 700, 650, None, "deposit")
+        await create_transaction(None, wallet.id, bookmaker.id, None,
+                                 100, 100, "deposit", None)
+
+        wallet = await Wallet.get(id=wallet.id)
+        bookmaker = await Bookmaker.get(id=bookmaker.id)
+
+        assert await get_ledger_balance("wallet", wallet.id) == \
+            wallet.get_balance() == 400
+        assert await get_ledger_balance("bookmaker", bookmaker.id,
+                                        "deposit") == bookmaker.get_deposit()
+        assert await get_ledger_balance("commission", None) == 50
+        # начальный депозит и два перевода
+        assert len(await get_ledger_history("wallet", wallet.id)) == 3
+
+        entries = await LedgerEntry.all()
+        # все, кроме внешнего начального депозита, - двойная запись
+        assert sum(e.amount for e in entries) == 1000
+
+
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_backfill_ledger(db):
+    async with session_scope_test() as session:
+        wallet = await Wallet.create(deposit=1000)
+        await Transaction.create(amount=300, commission=10,
+                                 sender_wallet_id=wallet.id)
+
+        assert await backfill_ledger() == 1
+        assert await backfill_ledger() == 0
+        # начальный депозит доносится сверкой с колонкой
+        wallet = await Wallet.get(id=wallet.id)
+        assert await get_ledger_balance("wallet", wallet.id) == \
+            wallet.get_balance() == 700
+        assert await get_ledger_balance("wallet", wallet.id,
+                                        "opening") == 1000
+
+
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_report_ledger(db):
+    async with session_scope_test() as session:
+        country = await Country.create(name="USA")
+        await Source.create(name="Ads")
+        bookmaker = await Bookmaker.create(name="Login", bk_name="Bet365",
+                                           country_id=country.id,
+                                           salary_percentage=10)
+        employee = await Employee.create(id=1, name="John")
+        now = datetime.datetime.now()
+
+        async def assert_ledger_matches():
+            bk = await Bookmaker.get(id=bookmaker.id)
+            worker = await Employee.get(id=employee.id)
+            assert await get_ledger_balance("bookmaker", bk.id) == \
+                bk.get_balance()
+            assert await get_ledger_balance("employee", worker.id) == \
+                worker.get_balance()
+            return bk.get_balance(), worker.get_balance()
+
+        await add_report_to_db(now, False, "Ads", "USA", "Bet365", "Login",
+                               100, 200, employee.id, "john")
+        await add_report_to_db(now, True, "Ads", "USA", "Bet365", "Login",
+                               100, 50, employee.id, "john")
+        # прибыль 100 - 50, зарплата 10 - штраф 50 * 3 * 10%
+        assert await assert_ledger_matches() == (50, -5)
+
+        await edit_bk_percent(bookmaker.id, 20)
+        assert await assert_ledger_matches() == (50, -10)
+
+        report = [r for r in await Report.all() if r.is_error][0]
+        assert report.nickname == "john"
+        assert await delete_report_by_id(report.id)
+        assert await assert_ledger_matches() == (100, 20)
+        assert await get_ledger_balances("bookmaker", [bookmaker.id, 999]) \
+            == {bookmaker.id: 100, 999: 0}
+
+        # сверка переносит в журнал корректировки, сделанные мимо него
+        await employee.update(adjustment=7)
+        assert await backfill_ledger() == 0
+        assert await assert_ledger_matches() == (100, 27)
+        assert await backfill_ledger() == 0
+        assert await get_ledger_balance("employee", employee.id,
+                                        "adjustment") == 7
+
+
+@patch('data.snapshots.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_balances_as_of(db):
+    async with session_scope_test() as session:
+        today = datetime.date.today()
+        yesterday = today - datetime.timedelta(days=1)
+        country = await Country.create(name="USA")
+        wallet = await Wallet.create(deposit=1000, country_id=country.id)
+        employee = await Employee.create(id=1, name="John")
+        await backfill_ledger()
+
+        assert await take_balance_snapshot(yesterday) == 3
+        # сделано сегодня - в снимок за вчера не попадает
+        await create_transaction(wallet.id, None, None, None, 200, 200,
+                                 None, None)
+        await edit_wallet_balans(wallet.id, 50)
+        await update_employee_salary(employee.id, 30)
+        # повторный снимок за вчера вычитает сегодняшние изменения
+        assert await take_balance_snapshot(yesterday) == 3
+        assert len(await BalanceSnapshot.all()) == 3
+
+        stats = await get_balances_as_of(yesterday)
+        assert stats["snapshot_date"] == yesterday
+        assert stats["sheet"].wallets[wallet.id] == 1000
+        assert stats["sheet"].employees[employee.id] == 0
+
+        stats = await get_balances_as_of(today)
+        assert stats["sheet"].wallets[wallet.id] == 850
+        assert stats["sheet"].countries[country.id] == (0, 850)
+        assert stats["sheet"].employees[employee.id] == 30
+        assert stats["total_wallet_balance"] == 850
+
+        stats = await get_balances_as_of(yesterday - datetime.timedelta(1))
+        assert stats["snapshot_date"] is None
+        assert stats["sheet"].wallets[wallet.id] == 1000
+
+
+@patch('data.snapshots.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_backdated_report_invalidates_snapshots(db):
+    async with session_scope_test() as session:
+        today = datetime.date.today()
+        yesterday = today - datetime.timedelta(days=1)
+        backdated = datetime.datetime.combine(
+            today - datetime.timedelta(days=3), datetime.time())
+        country = await Country.create(name="USA")
+        await Source.create(name="Ads")
+        bookmaker = await Bookmaker.create(name="Login", bk_name="Bet365",
+                                           country_id=country.id,
+                                           salary_percentage=10)
+        employee = await Employee.create(id=1, name="John")
+        await take_balance_snapshot(today - datetime.timedelta(days=5))
+        assert await take_balance_snapshot(yesterday) == 3
+
+        # отчет задним числом: снимки с его даты удаляются
+        assert await add_report_to_db(backdated, False, "Ads", "USA",
+                                      "Bet365", "Login", 100, 150,
+                                      employee.id, "john") is True
+        assert await get_last_snapshot_date() == \
+            today - datetime.timedelta(days=5)
+
+        stats = await get_balances_as_of(yesterday)
+        assert stats["sheet"].bookmakers[bookmaker.id] == (0, 50)
+        assert stats["sheet"].employees[employee.id] == 10
+        assert (await get_balances_as_of(backdated.date() -
+                                         datetime.timedelta(days=1))
+                )["sheet"].bookmakers[bookmaker.id] == (0, 0)
+
+        # новый снимок уже учитывает отчет
+        await take_balance_snapshot(yesterday)
+        stats = await get_balances_as_of(today)
+        assert stats["snapshot_date"] == yesterday
+        assert stats["sheet"].bookmakers[bookmaker.id] == (0, 50)
+
+        report = (await Report.all())[0]
+        assert await delete_report_by_id(report.id)
+        assert await get_last_snapshot_date() == \
+            today - datetime.timedelta(days=5)
+        stats = await get_balances_as_of(today)
+        assert stats["sheet"].bookmakers[bookmaker.id] == (0, 0)
+        assert stats["sheet"].employees[employee.id] == 0
+
+
+@patch('data.archive.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_archive_bookmakers(db):
+    async with session_scope_test() as session:
+        now = datetime.datetime.now()
+        wallet = await Wallet.create(deposit=1000)
+        employee = await Employee.create(id=1, name="John")
+        old = await Bookmaker.create(name="Old", salary_percentage=10,
+                                     is_active=False,
+                                     deactivated_at=now - ARCHIVE_AFTER)
+        fresh = await Bookmaker.create(name="Fresh", is_active=False,
+                                       deactivated_at=now)
+        await Report.create(bookmaker_id=old.id, employee_id=employee.id,
+                            bet_amount=100, return_amount=150)
+        await backfill_ledger()
+        # внешнее пополнение уходит в архив, перевод с кошелька остается
+        await create_transaction(None, None, None, old.id, 500, 500, None,
+                                 "deposit")
+        await create_transaction(wallet.id, None, None, old.id, 200, 200,
+                                 None, "balance")
+
+        old = await Bookmaker.get(id=old.id)
+        employee = await Employee.get(id=employee.id)
+        stale = await Employee.get(id=employee.id)
+        deposit, balance = old.get_deposit(), old.get_balance()
+        employee_balance = employee.get_balance()
+
+        assert await get_bookmakers_to_archive(now) == [old.id]
+        counts = await archive_bookmakers(now)
+        assert counts == {"bookmakers": 1, "reports": 1, "transactions": 1}
+        assert await archive_bookmakers(now) == {
+            "bookmakers": 0, "reports": 0, "transactions": 0}
+
+        old = await Bookmaker.get(id=old.id)
+        employee = await Employee.get(id=employee.id)
+        wallet = await Wallet.get(id=wallet.id)
+        assert old.reports == []
+        assert len(old.transactions_receiver) == 1
+        assert old.summary.reports_count == 1
+        assert (old.get_deposit(), old.get_balance()) == (deposit, balance)
+        assert employee.reports == []
+        assert employee.get_balance() == employee_balance
+        assert await get_ledger_balance("employee", employee.id) == \
+            employee_balance
+        # зарплата перенесена в корректировку: версия и журнал
+        assert employee.version == stale.version + 1
+        assert await get_ledger_balance("employee", employee.id,
+                                        "adjustment") == employee.adjustment
+        with pytest.raises(UpdateConflict):
+            await stale.update(name="Jack")
+        assert wallet.get_balance() == 800
+        assert fresh.id not in await get_bookmakers_to_archive(now)
+
+
+@patch('data.archive.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_archive_reused_ids(db):
+    async with session_scope_test() as session:
+        country = await Country.create(name="USA")
+        await Source.create(name="Ads")
+        live = await Bookmaker.create(name="Live", bk_name="Bet365",
+                                      country_id=country.id)
+        old = await Bookmaker.create(name="Old", bk_name="Bet365",
+                                     country_id=country.id)
+        employee = await Employee.create(id=1, name="John")
+        now = datetime.datetime.now()
+        await add_report_to_db(now, False, "Ads", "USA", "Bet365", "Live",
+                               100, 100, employee.id, "john")
+        # у отчета и транзакции архивного букмекера наибольшие id
+        await add_report_to_db(now, False, "Ads", "USA", "Bet365", "Old",
+                               100, 150, employee.id, "john")
+        await create_transaction(None, None, None, old.id, 500, 500, None,
+                                 "deposit")
+        await (await Bookmaker.get(id=old.id)).update(is_deleted=True)
+        await archive_bookmakers(now)
+
+        # SQLite отдает освободившиеся id новым строкам
+        await add_report_to_db(now, False, "Ads", "USA", "Bet365", "Live",
+                               100, 500, employee.id, "john")
+        await Transaction.create(amount=30, where="deposit",
+                                 receiver_bookmaker_id=live.id)
+        await backfill_ledger()
+        assert max(r.id for r in await Report.all()) == 2
+        assert await get_ledger_balance("bookmaker", live.id) == 430
+        assert await get_ledger_balance("bookmaker", live.id,
+                                        "deposit") == 30
+
+
+@patch('data.analytics.session_scope', new=session_scope_test)
+@patch('data.statistic.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_money_cents(db):
+    async with session_scope_test() as session:
+        assert to_cents(0.1) + to_cents(0.2) == to_cents(0.3)
+        assert money_sum([0.1, 0.2]) == 0.3
+
+        wallet = await Wallet.create(deposit=0.1, adjustment=0.2)
+        for _ in range(10):
+            await create_transaction(None, wallet.id, None, None, 0.1, 0.1,
+                                     None, None)
+        wallet = await Wallet.get(id=wallet.id)
+        assert wallet.get_balance() == 1.3
+        assert await is_wallet_balance_positive(wallet.id)
+
+        raw = await session.execute(text("SELECT deposit FROM wallet"))
+        assert raw.scalar() == 10
+        assert await get_ledger_balance("wallet", wallet.id) == 1.0
+
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        await Report.create(bookmaker_id=bookmaker.id, bet_amount=0.7,
+                            return_amount=0.1, date=datetime.datetime.now())
+        today = datetime.date.today()
+        stats = await get_total_stats_by_period(today, today)
+        assert stats.total_profit == -0.6
+        assert stats.total_salary == pytest.approx(0.07)
+
+
+@patch('data.pivot.session_scope', new=session_scope_test)
+@patch('data.rows.session_scope', new=session_scope_test)
+@patch('data.analytics.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_salary_rounding(db):
+    async with session_scope_test() as session:
+        employee = await Employee.create(id=1, name="John")
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        now = datetime.datetime.now()
+        # 0.5 и 1.5 копейки округляются от нуля, как ROUND в журнале
+        for bet, returned, is_error in [(0.05, 0, False),
+                                        (0.15, 0.1, True),
+                                        (0.25, 0.3, False)]:
+            await Report.create(employee_id=employee.id,
+                                bookmaker_id=bookmaker.id, bet_amount=bet,
+                                return_amount=returned, is_error=is_error,
+                                date=now)
+        await backfill_ledger()
+
+        reports = await Report.filter(order_by=Report.id)
+        assert [(r.salary, r.penalty) for r in reports] == [
+            (0.01, 0), (0, 0.02), (0.03, 0)]
+        rows = await get_report_rows()
+        assert [r.real_salary for r in rows] == [0.01, -0.02, 0.03]
+
+        today = datetime.date.today()
+        ledger = await get_ledger_balance("employee", employee.id)
+        metrics = await get_report_metrics()
+        pivot = await run_pivot(["сотрудник"], today, today)
+        assert ledger == metrics.real_salary == \
+            pivot.rows[0].metrics.real_salary == pivot.total().real_salary \
+            == money_sum(r.real_salary for r in reports) == 0.02
+
+
+@pytest.mark.asyncio
+async def test_money_migration(db):
+    async with engine.begin() as conn:
+        # таблица из старой схемы: суммы в евро во Float-колонках
+        await conn.execute(text("DROP TABLE wallet"))
+        await conn.execute(text(
+            "CREATE TABLE wallet (id INTEGER PRIMARY KEY, name VARCHAR, "
+            "deposit FLOAT, adjustment FLOAT, is_deleted BOOLEAN DEFAULT 0)"))
+        await conn.execute(text(
+            "INSERT INTO wallet (id, deposit, adjustment) "
+            "VALUES (1, 12.345, 0.1)"))
+        # новая таблица (create_all) уже хранит копейки
+        await conn.execute(text(
+            "INSERT INTO employee (id, adjustment) VALUES (1, 1235)"))
+        assert "0001_money_cents" in await conn.run_sync(apply_migrations)
+        assert await conn.run_sync(apply_migrations) == []
+        row = (await conn.execute(
+            text("SELECT deposit, adjustment FROM wallet"))).first()
+        assert tuple(row) == (1235, 10)
+        assert (await conn.execute(
+            text("SELECT adjustment FROM employee"))).scalar() == 1235
+
+
+@patch('data.rows.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_report_rows(db):
+    async with session_scope_test() as session:
+        employee = await Employee.create(id=1, name="John", username="john")
+        source = await Source.create(name="Test Source")
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        await Report.create(bet_amount=100, return_amount=50, is_error=True,
+                            date=datetime.datetime(2023, 1, 1),
+                            employee_id=employee.id, source_id=source.id,
+                            bookmaker_id=bookmaker.id)
+        await Report.create(bet_amount=100, return_amount=50,
+                            date=datetime.datetime(2023, 1, 2),
+                            employee_id=employee.id, _salary_percentage=5)
+
+        rows = await get_report_rows(Report.employee_id == employee.id)
+        assert [type(row) for row in rows] == [ReportRow, ReportRow]
+        assert not hasattr(rows[0], "__dict__")
+        assert rows[0].employee_username == "john"
+        assert rows[0].source_name == "Test Source"
+        assert rows[0].bookmaker_name == "Bet365"
+        assert rows[0].real_salary == -15
+        assert rows[1].source_name is None
+        assert rows[1].salary == 5
+
+        await Country.create(name="USA", flag="🇺🇸")
+        assert await get_country_rows() == [CountryRow(1, "USA", "🇺🇸")]
+
+
+@patch('data.analytics.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_report_metrics(db):
+    async with session_scope_test() as session:
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        reports = [
+            (1, datetime.datetime(2024, 6, 3, 10), 100, 150, False),
+            (1, datetime.datetime(2024, 6, 9, 23), 100, 50, True),
+            (2, datetime.datetime(2024, 6, 10, 1), 20.1, 0, False),
+        ]
+        for country_id, date, bet, ret, is_error in reports:
+            await Report.create(country_id=country_id, date=date,
+                                bet_amount=bet, return_amount=ret,
+                                is_error=is_error, bookmaker_id=bookmaker.id)
+        await Report.create(country_id=1, bet_amount=1000, return_amount=0,
+                            is_deleted=True)
+
+        totals = await get_report_metrics()
+        assert (totals.reports, totals.errors) == (3, 1)
+        assert totals.bet == 220.1
+        assert totals.profit == -20.1
+        assert totals.real_salary == pytest.approx(10 + 2.01 - 15)
+
+        report = (await Report.filter(Report.is_error == True))[0]
+        assert (await get_report_metrics(Report.id == report.id)
+                ).penalty == report.penalty
+
+        by_week = await get_report_metrics(by=("week",))
+        assert list(by_week) == [datetime.date(2024, 6, 3),
+                                 datetime.date(2024, 6, 10)]
+        assert by_week[datetime.date(2024, 6, 3)].reports == 2
+
+        by_country = await get_report_metrics(by=("country", "month"))
+        assert by_country[(2, datetime.date(2024, 6, 1))].bet == 20.1
+
+
+@patch('data.pivot.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_run_pivot(db):
+    async with session_scope_test() as session:
+        usa = await Country.create(name="USA", flag="🇺🇸")
+        uk = await Country.create(name="UK")
+        source = await Source.create(name="Telegram")
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        for country, day, bet, ret in [(usa, 1, 100, 150), (usa, 2, 50, 0),
+                                       (uk, 3, 10.5, 20), (uk, 40, 99, 0)]:
+            await Report.create(country_id=country.id, source_id=source.id,
+                                bookmaker_id=bookmaker.id, bet_amount=bet,
+                                return_amount=ret,
+                                date=datetime.datetime(2024, 3, 1) +
+                                datetime.timedelta(days=day - 1))
+
+        table = await run_pivot(["источник", "страна"],
+                                datetime.date(2024, 3, 1),
+                                datetime.date(2024, 3, 31))
+        assert table.headers == ["Источник", "Страна"]
+        assert [row.keys for row in table.rows] == [
+            ("Telegram", "UK"), ("Telegram", "🇺🇸 USA")]
+        uk_row, usa_row = table.rows
+        assert (uk_row.metrics.reports, uk_row.metrics.profit) == (1, 9.5)
+        assert (usa_row.metrics.reports, usa_row.metrics.bet) == (2, 150)
+        assert usa_row.metrics.real_salary == 15
+        assert table.total().reports == 3
+
+        table = await run_pivot(["week"], datetime.date(2024, 3, 1),
+                                datetime.date(2024, 4, 30))
+        assert [row.keys for row in table.rows] == [
+            ("2024-02-26",), ("2024-04-08",)]
+        assert decode_dimensions(encode_dimensions(
+            ["source", "country", "month"])) == ["source", "country", "month"]
+        with pytest.raises(ValueError):
+            parse_dimension("weather")
+
+
+@patch('data.commissions.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_run_commission_stats(db):
+    async with session_scope_test() as session:
+        usa = await Country.create(name="USA")
+        wallet = await Wallet.create(name="Binance", country_id=usa.id)
+        card = await Wallet.create(name="Card")
+        bookmaker = await Bookmaker.create(name="Login", bk_name="Bet365",
+                                           country_id=usa.id)
+        for sender, receiver, bk, sent, received, kind in [
+                (wallet.id, None, bookmaker.id, 100, 90, "withdraw"),
+                (wallet.id, None, bookmaker.id, 50, 49.5, "withdraw"),
+                (card.id, wallet.id, None, 10, 10, "replenish")]:
+            transaction = await create_transaction(
+                sender, receiver, None, bk, sent, received, None, "balance")
+            await add_to_commission_history("admin", sent - received, kind,
+                                            "", transaction.id)
+        # повторная запись истории по транзакции не удваивает перевод,
+        # тип берется из последней
+        await add_to_commission_history("admin", 0, "replenish", "",
+                                        transaction.id)
+        # запись до появления transaction_id не влияет на аналитику
+        await add_to_commission_history("admin", 7, "withdraw", "")
+
+        today = datetime.date.today()
+        table = await run_commission_stats(["кошелек", "тип"], today, today)
+        assert table.headers == ["Кошелек", "Тип"]
+        assert [(row.keys, row.transfers, row.commission, row.average)
+                for row in table.rows] == [
+            (("Binance", "withdraw"), 2, 10.5, 5.25),
+            (("Card", "replenish"), 1, 0, 0)]
+        assert (table.total().amount, table.total().commission) == (160, 10.5)
+
+        table = await run_commission_stats(["страна", "бк"], today, today)
+        assert [row.keys for row in table.rows] == [
+            (None, None), ("USA", "Bet365 Login")]
+
+        table = await run_commission_stats(
+            ["month"], today - datetime.timedelta(days=2),
+            today - datetime.timedelta(days=1))
+        assert table.rows == []
+
+
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_stats_cache(db):
+    async with session_scope_test() as session:
+        employee = await Employee.create(name="John Doe")
+        bookmaker = await Bookmaker.create(name="Bet365",
+                                           salary_percentage=10)
+        await Report.create(bet_amount=100, return_amount=200,
+                            employee_id=employee.id,
+                            bookmaker_id=bookmaker.id)
+        await backfill_ledger()
+
+        metrics = cache_metrics()["salary_stats"]
+        hits, misses = metrics.hits, metrics.misses
+        first = await salary_stats()
+        assert await salary_stats() is first
+        assert (metrics.hits, metrics.misses) == (hits + 1, misses + 1)
+        # прогресс загрузки не сбрасывает кэш
+        job = await IngestJob.create(file_path="reports.xlsx",
+                                     status="running")
+        await job.update(processed_rows=10)
+        assert await salary_stats() is first
+
+        await Report.create(bet_amount=50, return_amount=0,
+                            employee_id=employee.id,
+                            bookmaker_id=bookmaker.id)
+        await backfill_ledger()
+        result = await salary_stats()
+        assert result is not first
+        assert result['total_salary'] == 15
+        assert metrics.misses == misses + 2
+
+
+@pytest.mark.asyncio
+async def test_gather_reads():
+    running = []
+    peak = []
+
+    async def read(value):
+        running.append(value)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(value)
+        return value
+
+    assert await gather_reads(*(read(i) for i in range(5)), limit=2) == \
+        [0, 1, 2, 3, 4]
+    assert max(peak) == 2
+
+    peak.clear()
+    assert await gather_reads(read(1), read(2), limit=1) == [1, 2]
+    assert max(peak) == 1
+
+
+@patch('report_logic.excel_ingest.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_ingest_excel_file(db, tmp_path):
+    async with session_scope_test() as session:
+        employee = await Employee.create(name="John Doe")
+        source = await Source.create(name="Telegram")
+        country = await Country.create(name="USA")
+        bookmaker = await Bookmaker.create(name="Login", bk_name="Bet365",
+                                           country_id=country.id,
+                                           salary_percentage=10)
+
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Дата', 'Источник', 'Страна', 'Букмекер', 'Профиль',
+                      'Сумма Проставленных', 'Возврат',
+                      'Является Ли Ошибочным', 'userID', 'nickName'])
+        row = [datetime.datetime(2024, 3, 1), "Telegram", "USA", "bet365",
+               "login", 100, 150, "Нет", employee.id, "john"]
+        sheet.append(row)
+        sheet.append(row[:1] + ["Unknown"] + row[2:])
+        sheet.append(row[:3] + [None] + row[4:])
+        sheet.append(row[:7] + ["Да"] + row[8:])
+        sheet.append(row[:1] + ["Telegran", "USAA"] + row[3:])
+        sheet.append(row[:3] + ["Bet 365", "Logn"] + row[5:])
+        file_path = tmp_path / "reports.xlsx"
+        errors_path = tmp_path / "errors.xlsx"
+        workbook.save(file_path)
+
+        result = await ingest_excel_file(str(file_path), str(errors_path),
+                                         chunk_size=2)
+        assert (result.rows, result.created, result.errors) == (6, 2, 4)
+
+        reports = await Report.filter(order_by=Report.id)
+        assert [r.bookmaker_id for r in reports] == [bookmaker.id] * 2
+        assert [r.is_error for r in reports] == [False, True]
+        assert reports[0].bet_amount == 100
+        # никнейм сохраняется для поиска по отчетам
+        assert [r.nickname for r in reports] == ["john"] * 2
+
+        errors = list(openpyxl.load_workbook(errors_path).active.values)
+        assert errors[0][-2:] == ("Error", "Возможно, имелось в виду")
+        assert errors[1][-2:] == ("Источник Unknown не найден", None)
+        assert errors[2][-2:] == ("Не хватает полей: Букмекер", None)
+        assert errors[3][-1] == "Источник: Telegram; Страна: USA"
+        assert errors[4][-1] == "Букмекер: Bet365, профиль: Login"
+
+
+@patch('report_logic.transfer_import.session_scope', new=session_scope_test)
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_import_transfers(db, tmp_path):
+    async with session_scope_test() as session:
+        usa = await Country.create(name="USA")
+        spain = await Country.create(name="Spain")
+        wallet = await Wallet.create(name="Binance Main")
+        bk_usa = await Bookmaker.create(name="Login", bk_name="Bet365",
+                                        country_id=usa.id)
+        bk_spain = await Bookmaker.create(name="Login", bk_name="Bet365",
+                                          country_id=spain.id)
+
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Отправитель', 'Получатель', 'Корзина', 'Отправлено',
+                      'Получено'])
+        sheet.append(["binance  main", "Bet365 / Login / USA", "deposit",
+                      100, 95])
+        sheet.append(["Binance Main", "Bet365/Login", "deposit", 10, 10])
+        file_path = tmp_path / "transfers.xlsx"
+        workbook.save(file_path)
+
+        # одна ошибка - ничего не создается
+        result = await import_transfers(str(file_path), 1, "admin")
+        assert (result.rows, result.created) == (2, 0)
+        assert [number for number, _ in result.errors] == [2]
+        assert await Transaction.all() == []
+
+        file_path = tmp_path / "transfers.csv"
+        file_path.write_text(
+            "sender;receiver;bucket;sent;received\n"
+            "Binance Main;Bet365 / Login / USA;deposit;100;95\n"
+            f"bk:{bk_spain.id};Binance Main;баланс;50,5;50\n"
+            f"bk:{bk_usa.id};bk:{bk_spain.id};balance;20;20\n",
+            encoding="utf-8")
+        result = await import_transfers(str(file_path), 1, "admin")
+        assert result.ok
+        assert (result.created, result.sent, result.commission) == \
+            (3, 170.5, 5.5)
+
+        transactions = await Transaction.filter(order_by=Transaction.id)
+        assert [(t.sender_wallet_id, t.receiver_bookmaker_id, t.from_,
+                 t.where) for t in transactions] == [
+            (wallet.id, bk_usa.id, None, "deposit"),
+            (None, None, "balance", None),
+            (None, bk_spain.id, "balance", "balance")]
+        assert transactions[1].receiver_wallet_id == wallet.id
+        assert await get_ledger_balance("wallet", wallet.id) == -50
+        assert len(await OperationHistory.all()) == 3
+        assert [(c.commission, c.transaction_id)
+                for c in await CommissionHistory.all()] == \
+            [(5, transactions[0].id), (0.5, transactions[1].id),
+             (0, transactions[2].id)]
+
+
+@patch('report_logic.excel_ingest.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_run_ingest_job_resumes(db, tmp_path):
+    async with session_scope_test() as session:
+        employee = await Employee.create(name="John Doe")
+        await Source.create(name="Telegram")
+        country = await Country.create(name="USA")
+        await Bookmaker.create(name="Login", bk_name="Bet365",
+                               country_id=country.id)
+
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Дата', 'Источник', 'Страна', 'Букмекер', 'Профиль',
+                      'Сумма Проставленных', 'Возврат',
+                      'Является Ли Ошибочным', 'userID', 'nickName'])
+        row = [datetime.datetime(2024, 3, 1), "Telegram", "USA", "bet365",
+               "login", 100, 150, "Нет", employee.id, "john"]
+        for number in range(1, 6):
+            sheet.append(row[:5] + [number] + row[6:] if number != 2 else
+                         row[:1] + ["Unknown"] + row[2:])
+        file_path = tmp_path / "reports.xlsx"
+        workbook.save(file_path)
+        job = await create_ingest_job(str(file_path), chat_id=1)
+
+        # остановка бота отменяет обработчик посреди загрузки
+        async def crash(result):
+            raise asyncio.CancelledError
+
+        with pytest.raises(asyncio.CancelledError):
+            await run_ingest_job(job.id, on_progress=crash, chunk_size=2)
+        assert [j.id for j in await get_unfinished_ingest_jobs()] == [job.id]
+
+        errors_path = str(tmp_path / "errors.xlsx")
+        job = await IngestJob.get(id=job.id)
+        assert (job.processed_rows, job.created_reports) == (2, 1)
+        result, path = await run_ingest_job(job.id, errors_path=errors_path,
+                                            chunk_size=2)
+        assert (result.rows, result.created, result.errors) == (5, 4, 1)
+        assert path == errors_path
+        assert [r.bet_amount for r in await Report.all()] == [1, 3, 4, 5]
+        assert await get_unfinished_ingest_jobs() == []
+
+        errors = list(openpyxl.load_workbook(errors_path).active.values)
+        assert len(errors) == 2
+        assert errors[1][-2:] == ("Источник Unknown не найден", None)
+
+
+def test_make_bd_import(tmp_path, capsys):
+    import sqlite3
+    import make_bd
+
+    data = openpyxl.Workbook()
+    countries = data.active
+    countries.title = "СТРАНЫ И ЭМОДЗИ"
+    countries.append(["Страна", "Эмодзи"])
+    countries.append(["USA", "🇺🇸"])
+    countries.append(["UK", "🇬🇧"])
+    countries.append(["USA", "🇺🇸"])
+    templates = data.create_sheet("ШАБЛОНЫ БК")
+    templates.append(["Страна", "БК", "Процент"])
+    templates.append(["USA", "bet365", 10])
+    templates.append(["Mars", "bet365", 10])
+    partners = data.create_sheet("ПАРТНЕРЫ")
+    partners.append(["Партнер"])
+    partners.append(["Telegram"])
+    data.save(tmp_path / "data.xlsx")
+
+    bookmakers = openpyxl.Workbook()
+    sheet = bookmakers.active
+    sheet.append(["Страна", "БК", "Профиль", "Депозит", "Баланс"])
+    sheet.append(["USA", "bet365", "login", 100, 150])
+    sheet.append(["USA", "unknown", "login", 100, "-"])
+    bookmakers.save(tmp_path / "bookmakers.xlsx")
+
+    legacy = sqlite3.connect(tmp_path / "legacy.sqlite3")
+    legacy.execute("CREATE TABLE Users (id, user_id, username, first_name, "
+                   "is_accepted)")
+    legacy.execute("INSERT INTO Users VALUES (1, 111, 'john', 'John', 1), "
+                   "(2, 222, 'jane', 'Jane', 0)")
+    legacy.execute("CREATE TABLE Wallets (id, type, name, country, x, "
+                   "deposit)")
+    legacy.execute("INSERT INTO Wallets VALUES (4, 'card', '', 1, 0, 12.5), "
+                   "(5, 'card', '', 1, 0, 1)")
+    legacy.commit()
+    legacy.close()
+
+    argv = ["--db", f"sqlite:///{tmp_path / 'new.db'}",
+            "--legacy", str(tmp_path / "legacy.sqlite3"),
+            "--data", str(tmp_path / "data.xlsx"),
+            "--bookmakers", str(tmp_path / "bookmakers.xlsx")]
+    dry_run = make_bd.main(argv + ["--dry-run"])
+    assert dry_run.steps["countries"][:2] == (2, 1)
+    assert "  + USA" in capsys.readouterr().out
+
+    importer = make_bd.main(argv)
+    added = {name: step[0] for name, step in importer.steps.items()}
+    assert added == {"countries": 2, "templates": 1, "sources": 1,
+                     "employees": 1, "bookmakers": 1,
+                     "bookmaker balances": 2, "wallets": 1}
+
+    again = make_bd.main(argv)
+    assert all(step[0] == 0 for step in again.steps.values())
+
+    new_db = sqlite3.connect(tmp_path / "new.db")
+    assert new_db.execute("SELECT name, deposit FROM wallet").fetchall() == \
+        [("Вова", 1250)]
+    assert new_db.execute(
+        "SELECT count(*) FROM schema_migrations").fetchone()[0] == \
+        len(MIGRATIONS)
+    new_db.close()
+
+
+def test_metrics_registry():
+    registry = Registry()
+    updates = registry.counter("updates_total", "Updates", ("type",))
+    latency = registry.histogram("handler_seconds", "Latency", ("handler",),
+                                 buckets=(0.1, 1))
+    updates.inc(type="message")
+    updates.inc(2, type="message")
+    latency.observe(0.05, handler="start")
+    latency.observe(0.5, handler="start")
+    latency.observe(5, handler="start")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE updates_total counter" in lines
+    assert 'updates_total{type="message"} 3' in lines
+    assert 'handler_seconds_bucket{handler="start",le="0.1"} 1' in lines
+    assert 'handler_seconds_bucket{handler="start",le="1"} 2' in lines
+    assert 'handler_seconds_bucket{handler="start",le="+Inf"} 3' in lines
+    assert 'handler_seconds_count{handler="start"} 3' in lines
+    with pytest.raises(ValueError):
+        updates.inc(kind="message")
+
+
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_sql_metrics(db):
+    selects = SQL_STATEMENTS.value(kind="SELECT")
+    inserts = SQL_STATEMENTS.value(kind="INSERT")
+    await Country.create(name="USA")
+    await Country.all()
+    assert SQL_STATEMENTS.value(kind="INSERT") == inserts + 1
+    assert SQL_STATEMENTS.value(kind="SELECT") == selects + 1
+
+
+@patch('data.search.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_search(db):
+    await Report.create(match_name="Реал Мадрид - Барселона",
+                        nickname="lucky7")
+    async with engine.begin() as conn:
+        # миграция заполняет индекс существующими строками
+        await conn.run_sync(apply_migrations)
+    wallet = await Wallet.create(name="Binance основной")
+    bookmaker = await Bookmaker.create(name="Login1", bk_name="Pinnacle")
+    await Employee.create(id=42, name="Иван", username="ivan_bet")
+
+    hits = await search("барс")
+    assert [(hit.kind, hit.ref_id) for hit in hits] == [("report", 1)]
+    assert (await search("luck мадр"))[0].ref_id == 1
+    assert await search("барс lucky8") == []
+    assert [hit.kind for hit in await search("ivan")] == ["employee"]
+    assert (await search("binance"))[0].ref_id == wallet.id
+    assert await search("binance", kinds=["report"]) == []
+    assert await search("   ") == []
+
+    await bookmaker.update(name="Login2")
+    assert await search("login1") == []
+    assert (await search("login2"))[0].kind == "bookmaker"
+    await wallet.update(is_deleted=True)
+    assert await search("binance") == []
+    await wallet.update(is_deleted=False)
+    assert (await search("binance"))[0].title == \
+        f"Кошелек № {wallet.id}: Binance основной"
+
+
+@patch('data.utils.session_scope', new=session_scope_test)
+@patch('data.base.session_scope', new=session_scope_test)
+@pytest.mark.asyncio
+async def test_name_keys(db):
+    country = await Country.create(name="  Россия ", flag="🇷🇺")
+    assert country.name_key == "россия"
+    source = await Source.create(name="Telegram  Ads")
+    template = await Template.create(name="Bet365", country_id=country.id,
+                                     employee_percentage=10)
+    bookmaker = await Bookmaker.create(name="Login1", bk_name="Bet365",
+                                       country_id=country.id,
+                                       template_id=template.id,
+                                       salary_percentage=10)
+    employee = await Employee.create(id=1, name="Иван", username="ivan")
+
+    assert await is_country_exists("РОССИЯ")
+    assert await is_source_exists("telegram ads")
+    assert (await get_source_by_name(" TELEGRAM ads")).id == source.id
+    assert await is_template_exists(country.id, " bet365")
+    assert await is_bk_exists(template.id, country.id, "BET365", "login1 ")
+    assert await add_report_to_db(
+        datetime.datetime.now(), False, " telegram ads", "россия",
+        "BET365", "LOGIN1", 100, 50, employee.id, "ivan") is True
+
+    # ключ пересчитывается вместе с названием
+    await bookmaker.update(name="Login 2")
+    assert (await Bookmaker.get(id=bookmaker.id)).name_key == "login 2"
+    assert not await is_bk_exists(template.id, country.id, "Bet365",
+                                  "Login1")
+
+    with pytest.raises(Exception):
+        await Country.create(name="россия", flag="🇷🇺")
+    # удаленные записи не мешают создать запись с тем же названием
+    await country.update(is_deleted=True)
+    assert (await Country.create(name="Россия", flag="🇷🇺")).id != country.id
@@ -1,8 +1,10 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from data.config import async_session
+from data.config import async_session, READ_CONCURRENCY
+from data.metrics import SESSIONS_OPENED, SESSIONS_CLOSED
 
 _logger = logging.getLogger(__name__)
 
@@ -10,12 +12,46 @@ _logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def session_scope() -> AsyncSession:
     session = async_session()
+    SESSIONS_OPENED.inc()
+    outcome = "commit"
     try:
         yield session
         await session.commit()
     except Exception as e:
+        outcome = "rollback"
         _logger.error("session scope error: {}".format(e))
         await session.rollback()
         raise
     finally:
         await session.close()
+        SESSIONS_CLOSED.inc(outcome=outcome)
+
+
+async def gather_reads(*aws, limit: int = None) -> list:
+    """
+    Выполнить независимые запросы на чтение одновременно
+
+    Каждая корутина открывает свою сессию (и соединение из пула), поэтому
+    время ответа близко к самому долгому запросу, а не к сумме. Не больше
+    limit (по умолчанию READ_CONCURRENCY) запросов выполняются сразу; для
+    базы в памяти запросы идут по очереди. Результаты - в порядке aws.
+    """
+    limit = limit or READ_CONCURRENCY
+    if limit <= 1:
+        results = []
+        try:
+            for aw in aws:
+                results.append(await aw)
+        finally:
+            # после ошибки оставшиеся корутины не запускаются
+            for aw in aws[len(results) + 1:]:
+                aw.close()
+        return results
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return list(await asyncio.gather(*(run(aw) for aw in aws)))
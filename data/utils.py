@@ -1,6 +1,11 @@
 from data.tools import session_scope
 from data.models import *
-from sqlalchemy import select
+from data.money import to_cents, money_sum
+from data.names import name_key
+from data.base import retry_on_conflict
+from data.rows import *
+from sqlalchemy import select, insert, delete, func, literal, exists, \
+    union_all, or_, and_
 import datetime
 
 
@@ -86,8 +91,9 @@ async def get_admins():
     return await Admin.all()
 
 
-async def get_employees():
-    return await Employee.all()
+async def get_employees(offset: int = 0, limit: int = None):
+    return await Employee.filter(order_by=Employee.id, offset=offset,
+                                 limit=limit)
 
 
 async def get_employee(user_id):
@@ -111,8 +117,10 @@ async def add_source_to_db(name):
     return source
 
 
-async def get_countries():
-    return await Country.filter_by(is_deleted=False)
+async def get_countries(offset: int = 0, limit: int = None):
+    return await Country.filter(Country.is_deleted == False,
+                                order_by=Country.id, offset=offset,
+                                limit=limit)
 
 
 async def remove_country_from_db(country_id):
@@ -174,9 +182,12 @@ async def add_bk_to_db(profile_name, template_id, country_id):
     return bookmaker
 
 
-async def get_bk_by_template_id(template_id):
-    return await Bookmaker.filter_by(template_id=template_id,
-                                     is_deleted=False)
+async def get_bk_by_template_id(template_id, offset: int = 0,
+                                limit: int = None):
+    return await Bookmaker.filter(Bookmaker.template_id == template_id,
+                                  Bookmaker.is_deleted == False,
+                                  order_by=Bookmaker.id, offset=offset,
+                                  limit=limit)
 
 
 async def get_bk_by_id(bk_id):
@@ -194,7 +205,13 @@ async def edit_bk_name(bk_id, new_name):
 async def edit_bk_percent(bk_id, new_percent):
     bk = await get_bk_by_id(bk_id)
     if bk:
-        await bk.update(salary_percentage=new_percent)
+        # зарплата по всем отчетам букмекера пересчитывается в журнале
+        async with session_scope() as session:
+            await bk.update(salary_percentage=new_percent, session=session)
+            if await repost_report_salaries(session,
+                                            Report.bookmaker_id == bk.id):
+                await invalidate_snapshots(datetime.date.min,
+                                           session=session)
         return True
     return False
 
@@ -234,9 +251,16 @@ async def delite_bk(bk_id):
 async def add_wallet_to_db(wallet_name: str, wallet_type: str,
                            general_wallet_type: str, deposit: float,
                            country_id: int = None):
-    wallet = await Wallet.create(name=wallet_name, wallet_type=wallet_type,
-                                 general_wallet_type=general_wallet_type,
-                                 deposit=deposit, country_id=country_id)
+    # кошелек и проводка начального депозита записываются в одной сессии
+    async with session_scope() as session:
+        wallet = Wallet(name=wallet_name, wallet_type=wallet_type,
+                        general_wallet_type=general_wallet_type,
+                        deposit=deposit, country_id=country_id)
+        session.add(wallet)
+        await session.flush()
+        session.add(LedgerEntry(entity_type="wallet", entity_id=wallet.id,
+                                bucket="opening", amount=deposit,
+                                timestamp=datetime.datetime.now()))
     return wallet
 
 
@@ -244,14 +268,21 @@ async def get_wallets():
     return await Wallet.filter_by(is_deleted=False)
 
 
-async def get_wallets_by_country_id(country_id):
-    wallets = await Wallet.filter_by(country_id=country_id, is_deleted=False)
+async def get_wallets_by_country_id(country_id, offset: int = 0,
+                                    limit: int = None):
+    wallets = await Wallet.filter(Wallet.country_id == country_id,
+                                  Wallet.is_deleted == False,
+                                  order_by=Wallet.id, offset=offset,
+                                  limit=limit)
     return wallets
 
 
-async def get_wallets_by_wallet_type(wallet_type):
-    wallets = await Wallet.filter_by(wallet_type=wallet_type,
-                                     is_deleted=False)
+async def get_wallets_by_wallet_type(wallet_type, offset: int = 0,
+                                     limit: int = None):
+    wallets = await Wallet.filter(Wallet.wallet_type == wallet_type,
+                                  Wallet.is_deleted == False,
+                                  order_by=Wallet.id, offset=offset,
+                                  limit=limit)
     return wallets
 
 
@@ -267,12 +298,27 @@ async def remove_wallet_from_db(wallet_id):
     return False
 
 
+def adjustment_entry(entity_type, entity_id, amount) -> LedgerEntry:
+    """Проводка корректировки баланса в журнал"""
+    return LedgerEntry(entity_type=entity_type, entity_id=entity_id,
+                       bucket="adjustment", amount=amount,
+                       timestamp=datetime.datetime.now())
+
+
 async def edit_wallet_balans(wallet_id, adjustment_now):
-    wallet = await get_wallet_by_id(wallet_id)
-    if wallet:
-        await wallet.update(adjustment=wallet.adjustment + adjustment_now)
-        return True
-    return False
+    async def adjust():
+        wallet = await get_wallet_by_id(wallet_id)
+        if wallet:
+            # корректировка и ее проводка фиксируются вместе
+            async with session_scope() as session:
+                await wallet.update(
+                    adjustment=wallet.adjustment + adjustment_now,
+                    session=session)
+                session.add(adjustment_entry("wallet", wallet.id,
+                                             adjustment_now))
+        return wallet
+
+    return await retry_on_conflict(adjust) is not None
 
 
 async def edit_wallet_country_by_id(wallet_id, country_id):
@@ -292,25 +338,235 @@ async def edit_wallet_country_by_id(wallet_id, country_id):
 async def create_transaction(sender_wallet_id, receiver_wallet_id,
                              sender_bk_id, receiver_bk_id, sum, sum_received,
                              from_, where):
-    # print(sender_wallet_id, receiver_wallet_id, sender_bk_id, receiver_bk_id, sum, sum_received, from_, where)
-    transaction = await Transaction.create(
-        sender_wallet_id=sender_wallet_id,
-        receiver_wallet_id=receiver_wallet_id,
-        sender_bookmaker_id=sender_bk_id,
-        receiver_bookmaker_id=receiver_bk_id,
-        amount=sum,
-        commission=sum - sum_received,
-        from_=from_,
-        where=where
-    )
+    # транзакция и её проводки записываются в одной сессии
+    async with session_scope() as session:
+        transaction = Transaction(
+            sender_wallet_id=sender_wallet_id,
+            receiver_wallet_id=receiver_wallet_id,
+            sender_bookmaker_id=sender_bk_id,
+            receiver_bookmaker_id=receiver_bk_id,
+            amount=sum,
+            commission=sum - sum_received,
+            from_=from_,
+            where=where,
+            timestamp=datetime.datetime.now()
+        )
+        session.add(transaction)
+        await session.flush()
+        session.add_all(transaction.postings())
     return transaction
 
 
+_LEDGER_COLUMNS = ["report_id", "entity_type", "entity_id", "bucket",
+                   "amount", "timestamp"]
+
+
+def _report_with_bookmaker():
+    # процент зарплаты отчета берется у букмекера
+    return Report.__table__.outerjoin(Bookmaker.__table__,
+                                      Report.bookmaker_id == Bookmaker.id)
+
+
+async def post_reports(session, *criteria) -> int:
+    """
+    Проводки еще не проведенных неудаленных отчетов по условию
+
+    Прибыль отчета зачисляется на баланс букмекера (корзина balance),
+    зарплата за вычетом штрафа - сотруднику (корзина salary), обе с датой
+    отчета. Проводки считаются одним INSERT ... SELECT, возвращает их
+    количество.
+    """
+    criteria = (Report.is_deleted == False,
+                ~exists().where(LedgerEntry.report_id == Report.id),
+                *criteria)
+    profits = select(Report.id, literal("bookmaker"), Report.bookmaker_id,
+                     literal("balance"),
+                     Report.return_amount - Report.bet_amount, Report.date) \
+        .where(Report.bookmaker_id.is_not(None), *criteria)
+    salaries = select(Report.id, literal("employee"), Report.employee_id,
+                      literal("salary"), Report.real_salary, Report.date) \
+        .select_from(_report_with_bookmaker()) \
+        .where(Report.employee_id.is_not(None), *criteria)
+    result = await session.execute(
+        insert(LedgerEntry).from_select(_LEDGER_COLUMNS,
+                                        union_all(profits, salaries)))
+    return result.rowcount
+
+
+async def reverse_reports(session, *criteria) -> int:
+    """Сторно проводок отчетов по условию (при удалении отчета)"""
+    report_ids = select(Report.id).where(*criteria)
+    result = await session.execute(
+        insert(LedgerEntry).from_select(_LEDGER_COLUMNS, select(
+            LedgerEntry.report_id, LedgerEntry.entity_type,
+            LedgerEntry.entity_id, LedgerEntry.bucket, -LedgerEntry.amount,
+            LedgerEntry.timestamp)
+            .where(LedgerEntry.report_id.in_(report_ids))))
+    return result.rowcount
+
+
+async def repost_report_salaries(session, *criteria) -> int:
+    """
+    Поправки зарплаты по отчетам, если она изменилась после проводки
+    (например, после смены процента букмекера)
+    """
+    posted = func.sum(LedgerEntry.amount)
+    result = await session.execute(
+        insert(LedgerEntry).from_select(_LEDGER_COLUMNS, select(
+            Report.id, literal("employee"), Report.employee_id,
+            literal("salary"), Report.real_salary - posted, Report.date)
+            .select_from(_report_with_bookmaker().join(
+                LedgerEntry.__table__,
+                and_(LedgerEntry.report_id == Report.id,
+                     LedgerEntry.bucket == "salary")))
+            .where(Report.is_deleted == False, *criteria)
+            .group_by(Report.id)
+            .having(Report.real_salary != posted)))
+    return result.rowcount
+
+
+async def _reconcile_column(session, column, entity_type, bucket) -> int:
+    """
+    Проводка расхождения колонки (депозит, корректировка) с корзиной
+    журнала - для данных, записанных до журнала или в обход него
+
+    Проводка без даты, то есть учитывается на любую дату.
+    """
+    model = column.class_
+    posted = select(LedgerEntry.entity_id,
+                    func.sum(LedgerEntry.amount).label("amount")) \
+        .where(LedgerEntry.entity_type == entity_type,
+               LedgerEntry.bucket == bucket) \
+        .group_by(LedgerEntry.entity_id).subquery()
+    difference = func.coalesce(column, 0) - func.coalesce(posted.c.amount, 0)
+    result = await session.execute(
+        insert(LedgerEntry).from_select(
+            ["entity_type", "entity_id", "bucket", "amount"],
+            select(literal(entity_type), model.id, literal(bucket),
+                   difference)
+            .outerjoin(posted, posted.c.entity_id == model.id)
+            .where(difference != 0)))
+    return result.rowcount
+
+
+async def backfill_ledger():
+    """
+    Проводки для данных, записанных в обход журнала: транзакций, отчетов,
+    депозитов и корректировок (старые записи, make_bd.py, правки базы)
+
+    Возвращает количество проведенных транзакций.
+    """
+    async with session_scope() as session:
+        q = select(Transaction).where(Transaction.id.not_in(
+            select(LedgerEntry.transaction_id).where(
+                LedgerEntry.transaction_id.is_not(None))))
+        transactions = (await session.execute(q)).scalars().unique().all()
+        for transaction in transactions:
+            session.add_all(transaction.postings())
+        # проводки датированы временем транзакций, то есть задним числом
+        since = min((t.timestamp for t in transactions if t.timestamp),
+                    default=None)
+        posted = await post_reports(session)
+        for column, entity_type, bucket in (
+                (Wallet.deposit, "wallet", "opening"),
+                (Wallet.adjustment, "wallet", "adjustment"),
+                (Employee.adjustment, "employee", "adjustment")):
+            posted += await _reconcile_column(session, column, entity_type,
+                                              bucket)
+        if posted:
+            # отчеты задним числом и проводки без даты меняют всю историю
+            since = datetime.date.min
+        await invalidate_snapshots(since, session=session)
+    return len(transactions)
+
+
+async def invalidate_snapshots(since, session=None) -> int:
+    """
+    Удаление снимков балансов на конец дня since и позже
+
+    Вызывается при записи задним числом (отчет или проводка с датой не
+    позже последнего снимка): такие снимки ее не учитывают, а
+    get_balances_as_of берет изменения только после снимка. Возвращает
+    количество удаленных строк снимков.
+    """
+    if since is None:
+        return 0
+    if isinstance(since, datetime.datetime):
+        since = since.date()
+    q = delete(BalanceSnapshot).where(BalanceSnapshot.date >= since)
+    if session is not None:
+        return (await session.execute(q)).rowcount
+    async with session_scope() as session:
+        return (await session.execute(q)).rowcount
+
+
+async def get_ledger_balance(entity_type, entity_id, bucket=None,
+                             session=None):
+    """Сумма проводок сущности (или одной её корзины)"""
+    q = select(func.coalesce(func.sum(LedgerEntry.amount), 0)).where(
+        LedgerEntry.entity_type == entity_type,
+        LedgerEntry.entity_id == entity_id)
+    if bucket is not None:
+        q = q.where(LedgerEntry.bucket == bucket)
+    if session is not None:
+        return await session.scalar(q)
+    async with session_scope() as session:
+        return await session.scalar(q)
+
+
+async def get_ledger_sums(entity_types, end=None, entity_ids=None) -> dict:
+    """
+    Суммы проводок по корзинам для всех сущностей типов entity_types
+    одним GROUP BY по индексу: {(тип, id): {корзина: сумма}}
+
+    С end учитываются только проводки до end и проводки без даты, с
+    entity_ids - только проводки этих сущностей.
+    """
+    q = select(LedgerEntry.entity_type, LedgerEntry.entity_id,
+               LedgerEntry.bucket, func.sum(LedgerEntry.amount)) \
+        .where(LedgerEntry.entity_type.in_(entity_types)) \
+        .group_by(LedgerEntry.entity_type, LedgerEntry.entity_id,
+                  LedgerEntry.bucket)
+    if entity_ids is not None:
+        q = q.where(LedgerEntry.entity_id.in_(entity_ids))
+    if end is not None:
+        q = q.where(or_(LedgerEntry.timestamp < end,
+                        LedgerEntry.timestamp.is_(None)))
+    sums = {}
+    async with session_scope() as session:
+        for entity_type, entity_id, bucket, amount in await session.execute(q):
+            sums.setdefault((entity_type, entity_id), {})[bucket] = amount
+    return sums
+
+
+async def get_ledger_balances(entity_type, entity_ids) -> dict:
+    """Балансы сущностей одного типа по журналу: {id: сумма всех корзин}"""
+    entity_ids = list(entity_ids)
+    sums = await get_ledger_sums((entity_type,), entity_ids=entity_ids)
+    return {entity_id: money_sum(sums.get((entity_type, entity_id),
+                                          {}).values())
+            for entity_id in entity_ids}
+
+
+async def get_ledger_history(entity_type, entity_id, start_date=None,
+                             end_date=None):
+    """Проводки сущности за период в хронологическом порядке"""
+    filters = [LedgerEntry.entity_type == entity_type,
+               LedgerEntry.entity_id == entity_id]
+    if start_date is not None:
+        filters.append(LedgerEntry.timestamp >= start_date)
+    if end_date is not None:
+        filters.append(LedgerEntry.timestamp <= end_date)
+    return await LedgerEntry.filter(*filters, order_by=LedgerEntry.timestamp)
+
+
 async def add_report_to_db(date, wrong_report_value, source, country, bk_name,
-                           bk_login, placed, received, userid, nick_name):
-    # Получаем объекты Source, Country и Bookmaker по их именам
-    source_obj = await Source.get(name=source, is_deleted=False)
-    country_obj = await Country.get(name=country, is_deleted=False)
+                           bk_login, placed, received, userid, nick_name,
+                           match_name=None):
+    # Получаем объекты Source, Country и Bookmaker по ключам их названий
+    source_obj = await Source.get(name_key=name_key(source), is_deleted=False)
+    country_obj = await Country.get(name_key=name_key(country),
+                                    is_deleted=False)
     employee = await Employee.get(id=userid)
     errors = []
     if not employee:
@@ -321,30 +577,48 @@ async def add_report_to_db(date, wrong_report_value, source, country, bk_name,
         errors.append(f"Страна {country} не найдена")
     if errors:
         return " ".join(errors)
-    bk_name = bk_name.capitalize()
-    bk_login = bk_login.capitalize()
-    bookmaker_obj = await Bookmaker.get(name=bk_login,
-                                        bk_name=bk_name,
+    bookmaker_obj = await Bookmaker.get(name_key=name_key(bk_login),
+                                        bk_name_key=name_key(bk_name),
                                         country_id=country_obj.id,
                                         is_active=True, is_deleted=False)
     if not bookmaker_obj:
         return f"Букмекер {bk_name} с логином {bk_login} в стране {country} с isActive=True не найден"
 
-    # Создаем новый отчет
-    report = await Report.create(
-        date=date,
-        is_error=wrong_report_value,
-        source_id=source_obj.id,
-        country_id=country_obj.id,
-        bookmaker_id=bookmaker_obj.id,
-        bet_amount=placed,
-        return_amount=received,
-        employee_id=employee.id,
-    )
+    # Создаем новый отчет и его проводки в одной сессии
+    async with session_scope() as session:
+        report = Report(
+            date=date,
+            is_error=wrong_report_value,
+            source_id=source_obj.id,
+            country_id=country_obj.id,
+            bookmaker_id=bookmaker_obj.id,
+            bet_amount=placed,
+            return_amount=received,
+            employee_id=employee.id,
+            nickname=nick_name,
+            match_name=match_name,
+        )
+        session.add(report)
+        await session.flush()
+        await post_reports(session, Report.id == report.id)
+        await invalidate_snapshots(report.date, session=session)
 
     return True
 
 
+async def create_ingest_job(file_path, user_id=None, username=None,
+                            chat_id=None, message_id=None):
+    return await IngestJob.create(file_path=file_path, user_id=user_id,
+                                  username=username, chat_id=chat_id,
+                                  message_id=message_id, status="queued")
+
+
+async def get_unfinished_ingest_jobs():
+    """Задачи загрузки, прерванные перезапуском или ждущие очереди"""
+    return await IngestJob.filter(
+        IngestJob.status.in_(("queued", "running")), order_by=IngestJob.id)
+
+
 async def add_to_history(user_name, operation_type,
                          operation_description):
     history = await OperationHistory.create(
@@ -356,12 +630,14 @@ async def add_to_history(user_name, operation_type,
 
 
 async def add_to_commission_history(user_name, commission,
-                                    commission_type, commission_description):
+                                    commission_type, commission_description,
+                                    transaction_id=None):
     history = await CommissionHistory.create(
         user_name=user_name,
         commission=commission,
         commission_type=commission_type,
-        commission_description=commission_description
+        commission_description=commission_description,
+        transaction_id=transaction_id
     )
     return history
 
@@ -377,7 +653,7 @@ async def get_last_10_commissions():
 
 
 async def get_source_by_name(source_name):
-    return await Source.get(name=source_name, is_deleted=False)
+    return await Source.get(name_key=name_key(source_name), is_deleted=False)
 
 
 async def get_bookmakers_by_country(country_id):
@@ -396,22 +672,76 @@ async def get_report_by_id(report_id):
 
 
 async def update_employee_salary(employee_id, adjustment_now):
-    employee = await get_employee(employee_id)
-    if employee:
-        await employee.update(adjustment=employee.adjustment + adjustment_now)
+    async def adjust():
+        employee = await get_employee(employee_id)
+        if employee:
+            async with session_scope() as session:
+                await employee.update(
+                    adjustment=employee.adjustment + adjustment_now,
+                    session=session)
+                session.add(adjustment_entry("employee", employee.id,
+                                             adjustment_now))
+        return employee
+
+    await retry_on_conflict(adjust)
 
 
 async def pay_employee_salary(employee_id):
-    employee = await get_employee(employee_id)
-    if employee:
-        await employee.update(
-            adjustment=employee.adjustment - employee.get_balance())
+    async def pay():
+        employee = await get_employee(employee_id)
+        if employee is None:
+            return None
+        async with session_scope() as session:
+            balance = await get_ledger_balance("employee", employee.id,
+                                               session=session)
+            await employee.update(adjustment=employee.adjustment - balance,
+                                  session=session)
+            session.add(adjustment_entry("employee", employee.id, -balance))
+        return balance
+
+    return await retry_on_conflict(pay)
+
+
+async def pay_all_employee_salaries():
+    """
+    Выплата положительных балансов всех сотрудников одной транзакцией,
+    возвращает {id сотрудника: выплаченная сумма}
+    """
+    async def pay():
+        payments = {}
+        adjustments = {}
+        sums = await get_ledger_sums(("employee",))
+        for employee in await get_employees():
+            balance = money_sum(sums.get(("employee", employee.id),
+                                         {}).values())
+            if balance > 0:
+                payments[employee.id] = balance
+                adjustments[employee.id] = {
+                    "adjustment": employee.adjustment - balance,
+                    "version": employee.version}
+        if not payments:
+            return payments
+        timestamp = datetime.datetime.now()
+        async with session_scope() as session:
+            await Employee.bulk_update(adjustments, session=session)
+            await LedgerEntry.bulk_create(
+                [{"entity_type": "employee", "entity_id": employee_id,
+                  "bucket": "adjustment", "amount": -balance,
+                  "timestamp": timestamp}
+                 for employee_id, balance in payments.items()],
+                session=session)
+        return payments
+
+    return await retry_on_conflict(pay)
 
 
 async def delete_report_by_id(report_id):
     report = await get_report_by_id(report_id)
     if report:
-        await report.update(is_deleted=True)
+        async with session_scope() as session:
+            await report.update(is_deleted=True, session=session)
+            await reverse_reports(session, Report.id == report.id)
+            await invalidate_snapshots(report.date, session=session)
         return True
     return False
 
@@ -421,11 +751,15 @@ async def get_bookmakers():
 
 
 async def get_reports_by_period_and_employee(start_date,
-                                             end_date, employee_id):
-    reports = await Report.filter(Report.date >= start_date,
-                                  Report.date <= end_date,
-                                  Report.employee_id == employee_id,
-                                  Report.is_deleted == False)
+                                             end_date, employee_id,
+                                             offset: int = 0,
+                                             limit: int = None):
+    reports = await get_report_rows(Report.date >= start_date,
+                                    Report.date <= end_date,
+                                    Report.employee_id == employee_id,
+                                    Report.is_deleted == False,
+                                    order_by=(Report.id,), offset=offset,
+                                    limit=limit)
     return reports
 
 
@@ -457,27 +791,50 @@ async def get_commissions_by_period(start_date, end_date):
 
 async def is_country_balance_positive(country_id):
     country = await Country.get(id=country_id, is_deleted=False)
-    if country:
-        return country.get_active_balance() > 0
-    return False
+    if country is None:
+        return False
+    # активный баланс страны: неудаленные букмекеры и кошельки
+    async with session_scope() as session:
+        balance = await session.scalar(
+            select(func.coalesce(func.sum(LedgerEntry.amount), 0)).where(or_(
+                and_(LedgerEntry.entity_type == "bookmaker",
+                     LedgerEntry.entity_id.in_(select(Bookmaker.id).where(
+                         Bookmaker.country_id == country_id,
+                         Bookmaker.is_deleted == False))),
+                and_(LedgerEntry.entity_type == "wallet",
+                     LedgerEntry.entity_id.in_(select(Wallet.id).where(
+                         Wallet.country_id == country_id,
+                         Wallet.is_deleted == False))))))
+    return to_cents(balance) > 0
 
 
 async def is_wallet_balance_positive(wallet_id):
     wallet = await Wallet.get(id=wallet_id, is_deleted=False)
     if wallet:
-        return wallet.get_balance() > 0
+        return to_cents(await get_ledger_balance("wallet", wallet.id)) > 0
     return False
 
 
 async def is_template_exists(country_id, template_name):
-    template = await Template.get(name=template_name.capitalize(),
+    template = await Template.get(name_key=name_key(template_name),
                                   country_id=country_id, is_deleted=False)
     return template is not None
 
 
 async def is_bk_exists(template_id, country_id, bk_name, bk_login):
-    bookmaker = await Bookmaker.get(name=bk_login.capitalize(),
-                                    bk_name=bk_name.capitalize(),
-                                    template_id=template_id,
+    # шаблон не входит в уникальный ключ: профиль с тем же названием БК и
+    # логином в стране может быть только один
+    bookmaker = await Bookmaker.get(name_key=name_key(bk_login),
+                                    bk_name_key=name_key(bk_name),
                                     country_id=country_id, is_deleted=False)
     return bookmaker is not None
+
+
+async def is_country_exists(name):
+    country = await Country.get(name_key=name_key(name), is_deleted=False)
+    return country is not None
+
+
+async def is_source_exists(name):
+    source = await Source.get(name_key=name_key(name), is_deleted=False)
+    return source is not None
@@ -6,15 +6,30 @@ from config import BOT_TOKEN
 from bot.utils import on_startup, on_shutdown
 from aiogram import executor
 from bot.stats_admin import register_stats_handlers
+from bot.pagination import register_pagination_handlers
+from bot.metrics import MetricsMiddleware
+from bot.profiler import ProfilerMiddleware, profiler
 
-# Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(bot, storage=MemoryStorage())
 
-# Register handlers
-register_admin_handlers(dp)
-register_stats_handlers(dp)
-register_user_handlers(dp)
+def create_dispatcher(bot: Bot, storage=None) -> Dispatcher:
+    """Dispatcher with all middlewares and handlers of the bot"""
+    dp = Dispatcher(bot, storage=storage or MemoryStorage())
+
+    # Update counters and handler latency for /metrics
+    dp.middleware.setup(MetricsMiddleware())
+    # /profile: does nothing until the profiler is armed
+    dp.middleware.setup(ProfilerMiddleware(profiler))
+
+    # Register handlers
+    register_pagination_handlers(dp)
+    register_admin_handlers(dp)
+    register_stats_handlers(dp)
+    register_user_handlers(dp)
+    return dp
+
 
 if __name__ == '__main__':
+    # Initialize bot and dispatcher
+    bot = Bot(token=BOT_TOKEN)
+    dp = create_dispatcher(bot)
     executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -1,19 +1,28 @@
-from sqlalchemy import create_engine
-from data.models import *
-from openpyxl import load_workbook
-from sqlalchemy.orm import sessionmaker
+"""Перенос данных старого бота в новую базу
+
+Запуск из корня проекта:
+    python make_bd.py --db sqlite:///test_transfer.db --legacy db.sqlite3
+    python make_bd.py --dry-run
+
+Страны, шаблоны БК и партнеры берутся из "Файл для БД.xlsx", сотрудники и
+кошельки - из базы старого бота, букмекеры с начальными балансами - из
+"БК и балансы.xlsx". Существующие записи один раз выгружаются в словари
+ключ названия (data/names.py) -> id, новые вставляются пачками через INSERT ... ON CONFLICT DO
+NOTHING с фиксацией после каждой пачки, поэтому повторный запуск ничего
+не дублирует. С --dry-run все выполняется в одной транзакции, которая
+откатывается, и печатается только список изменений.
+"""
+import argparse
 import sqlite3 as sql
+import time
+from openpyxl import load_workbook
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.sqlite import insert
+from data.models import *
+from data.names import name_key
+from data.migrations import apply_migrations
 
-engine = create_engine('sqlite:///test_transfer.db')
-last_db_engine = sql.connect("db.sqlite3")
-
-Model.metadata.create_all(engine)
-
-Session = sessionmaker(bind=engine)
-session = Session()
-
-old_db = last_db_engine.cursor()
-
+# id страны в старой базе -> id страны в новой
 countries = {
     1: 1,
     2: 2,
@@ -40,6 +49,7 @@ countries = {
     24: 20
 }
 
+# id кошелька в старой базе -> имя кошелька
 wallets = {
     47: 'Семён',
     4: 'Вова',
@@ -52,168 +62,242 @@ wallets = {
     26: 'Соня'
 }
 
-# Загружаем данные из файла "Файл для БД.xmls"
-workbook = load_workbook(filename="Файл для БД.xlsx")
-
-# Получаем лист "СТРАНЫ И ЭМОДЗИ"
-sheet_countries = workbook["СТРАНЫ И ЭМОДЗИ"]
-
-# Создаем страны в базе данных
-for row in sheet_countries.iter_rows(min_row=2, values_only=True):
-    country_name = row[0]
-    country_emoji = row[1]
-
-    # Проверяем, существует ли уже страна с таким названием
-    existing_country = session.query(Country).filter_by(
-        name=country_name).first()
-    if not existing_country:
-        # Создаем новую страну, если она не существует
-        country = Country(name=country_name, flag=country_emoji)
-        session.add(country)
-
-# Получаем лист "ШАБЛОНЫ БК"
-sheet_templates = workbook["ШАБЛОНЫ БК"]
-
-# Создаем шаблоны букмекеров в базе данных
-for row in sheet_templates.iter_rows(min_row=2, values_only=True):
-    country_name = row[0]
-    bookmaker_name = str(row[1]).capitalize()
-    bookmaker_percentage = row[2]
-
-    # Получаем страну по названию
-    country = session.query(Country).filter_by(name=country_name).first()
-    if country:
-        # Проверяем, существует ли уже шаблон с таким названием для данной страны
-        existing_template = session.query(Template).filter_by(
-            name=bookmaker_name, country=country).first()
-        if not existing_template:
-            # Создаем новый шаблон, если он не существует
-            template = Template(name=bookmaker_name, country=country,
-                                employee_percentage=bookmaker_percentage)
-            session.add(template)
-
-# Получаем лист "ПАРТНЕРЫ"
-sheet_partners = workbook["ПАРТНЕРЫ"]
-
-# Создаем партнеров (источники) в базе данных
-for row in sheet_partners.iter_rows(min_row=2, max_col=1, values_only=True):
-    partner_name = row[0]
-
-    # Проверяем, существует ли уже партнер с таким названием
-    existing_source = session.query(Source).filter_by(
-        name=partner_name).first()
-    if not existing_source:
-        # Создаем новый источник, если он не существует
-        source = Source(name=partner_name)
-        session.add(source)
-
-# Создаем пользователей в базе данных
-for user in old_db.execute(
-        "SELECT * FROM Users WHERE is_accepted=1").fetchall():
-    user_id = user[1]
-    username = user[2]
-    first_name = user[3]
-
-    exist = session.query(Employee).filter_by(
-        id=user_id
-    ).first()
-
-    if not exist:
-        employee = Employee(
-            id=user_id,
-            username=username,
-            name=first_name
-        )
-        session.add(employee)
-
-
-# Импорт букмейкеров
-workbook = load_workbook(filename="БК и балансы.xlsx")
-sheet = workbook.active
-
-
-for row in sheet.iter_rows(min_row=2, values_only=True):
-    country_name = row[0]
-    bk_name = row[1].capitalize()
-    profile_name = row[2].capitalize()
-
-    balance_static = int(row[3])
-    balance_active = int(row[3]) if isinstance(row[4], str) else int(row[4])
-
-    country = session.query(Country).filter_by(
-        name=country_name
-    ).first()
-
-    template = session.query(Template).filter_by(
-        name=bk_name
-    ).first()
-
-    if country and template:
-        exist = session.query(Bookmaker).filter_by(
-            name=profile_name, template_id=template.id, country_id=country.id
-        ).first()
-
-        if not exist:
-            bookmaker = Bookmaker(
-                name=profile_name,
-                template_id=template.id,
-                country_id=country.id,
-                bk_name=bk_name
-            )
-            session.add(bookmaker)
-
-            bookmaker = session.query(Bookmaker).filter_by(
-                name=profile_name, template_id=template.id,
-                country_id=country.id, bk_name=bk_name
-            ).first()
-
-            transaction_deposit = Transaction(
-                sender_wallet_id=None,
-                receiver_wallet_id=None,
-                sender_bookmaker_id=None,
-                receiver_bookmaker_id=bookmaker.id,
-                amount=balance_static,
-                commission=None,
-                from_=None,
-                where="deposit"
-            )
-            session.add(transaction_deposit)
-
-            transaction_balance = Transaction(
-                sender_wallet_id=None,
-                receiver_wallet_id=None,
-                sender_bookmaker_id=None,
-                receiver_bookmaker_id=bookmaker.id,
-                amount=(balance_active - balance_static),
-                commission=None,
-                from_=None,
-                where="balance"
-            )
-            session.add(transaction_balance)
-
-# Импорт кошельков
-for row in old_db.execute(f"SELECT * FROM Wallets").fetchall():
-    if row[0] not in list(wallets.keys()):
-        continue
-
-    general_type = 'Карта' if row[1] == 'card' else 'Binance' 
-    wallet_name = wallets[row[0]]
-    wallet_type = 'Страна'
-    country_id = countries[row[3]]
-    deposit = row[5]
-
-    country = session.query(Country).filter_by(
-        id=country_id
-    ).first()
-
-    if country:
-        wallet = Wallet(name=wallet_name, wallet_type=wallet_type,
-                               general_wallet_type=general_type,
-                               deposit=deposit, country_id=country.id)
-        session.add(wallet)
-    
-    
-
-
-# Сохраняем изменения в базе данных
-session.commit()
+BATCH_SIZE = 500
+# сколько новых записей каждого вида показывать в --dry-run
+DIFF_SAMPLE = 10
+
+
+class Importer:
+    """
+    Пакетный импорт в новую базу
+
+    Поля:
+    connection -- соединение с новой базой
+    dry_run -- не фиксировать изменения
+    batch_size -- строк в одной вставке (и фиксации)
+    steps -- имя шага -> (добавлено, пропущено, секунды, примеры)
+    """
+
+    def __init__(self, connection, dry_run=False, batch_size=BATCH_SIZE):
+        self.connection = connection
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.steps = {}
+
+    def _map(self, *columns) -> dict:
+        """(ключевые колонки...) -> id по первой найденной записи"""
+        *keys, id_ = columns
+        result = {}
+        for row in self.connection.execute(select(*keys, id_)):
+            result.setdefault(tuple(row[:-1]) if len(keys) > 1 else row[0],
+                              row[-1])
+        return result
+
+    def insert(self, model, rows: list) -> int:
+        """Вставка пачками с ON CONFLICT DO NOTHING"""
+        inserted = 0
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            result = self.connection.execute(
+                insert(model.__table__).on_conflict_do_nothing(), batch)
+            inserted += max(result.rowcount, 0)
+            if not self.dry_run:
+                self.connection.commit()
+        return inserted
+
+    def step(self, name, model, rows: list, skipped: int, label):
+        started = time.perf_counter()
+        inserted = self.insert(model, rows)
+        self.steps[name] = (inserted, skipped + len(rows) - inserted,
+                            time.perf_counter() - started,
+                            [label(row) for row in rows[:DIFF_SAMPLE]])
+
+    def import_countries(self, sheet):
+        existing = self._map(Country.name_key, Country.id)
+        rows, skipped = {}, 0
+        for name, flag, *_ in sheet.iter_rows(min_row=2, values_only=True):
+            key = name_key(name)
+            if key in existing or key in rows:
+                skipped += 1
+                continue
+            rows[key] = {"name": name, "flag": flag}
+        self.step("countries", Country, list(rows.values()), skipped,
+                  lambda row: row["name"])
+
+    def import_templates(self, sheet):
+        country_ids = self._map(Country.name_key, Country.id)
+        existing = self._map(Template.name_key, Template.country_id,
+                             Template.id)
+        rows, skipped = {}, 0
+        for country_name, name, percentage, *_ in sheet.iter_rows(
+                min_row=2, values_only=True):
+            country_id = country_ids.get(name_key(country_name))
+            key = (name_key(name), country_id)
+            if country_id is None or key in existing or key in rows:
+                skipped += 1
+                continue
+            rows[key] = {"name": str(name).capitalize(),
+                         "country_id": country_id,
+                         "employee_percentage": percentage}
+        self.step("templates", Template, list(rows.values()), skipped,
+                  lambda row: row["name"])
+
+    def import_sources(self, sheet):
+        existing = self._map(Source.name_key, Source.id)
+        rows, skipped = {}, 0
+        for name, *_ in sheet.iter_rows(min_row=2, max_col=1,
+                                        values_only=True):
+            key = name_key(name)
+            if key in existing or key in rows:
+                skipped += 1
+                continue
+            rows[key] = {"name": name}
+        self.step("sources", Source, list(rows.values()), skipped,
+                  lambda row: row["name"])
+
+    def import_employees(self, legacy):
+        rows, skipped = {}, 0
+        existing = set(self.connection.execute(select(Employee.id))
+                       .scalars())
+        for user in legacy.execute(
+                "SELECT * FROM Users WHERE is_accepted=1").fetchall():
+            user_id, username, first_name = user[1], user[2], user[3]
+            if user_id in existing or user_id in rows:
+                skipped += 1
+                continue
+            rows[user_id] = {"id": user_id, "username": username,
+                             "name": first_name}
+        self.step("employees", Employee, list(rows.values()), skipped,
+                  lambda row: row["username"] or row["id"])
+
+    def import_bookmakers(self, sheet):
+        country_ids = self._map(Country.name_key, Country.id)
+        # как и раньше, шаблон ищется только по названию
+        template_ids = self._map(Template.name_key, Template.id)
+        existing = self._map(Bookmaker.name_key, Bookmaker.template_id,
+                             Bookmaker.country_id, Bookmaker.id)
+        rows, balances, skipped = {}, {}, 0
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            country_id = country_ids.get(name_key(row[0]))
+            bk_name = row[1].capitalize()
+            template_id = template_ids.get(name_key(bk_name))
+            key = (name_key(row[2]), template_id, country_id)
+            if country_id is None or template_id is None or \
+                    key in existing or key in rows:
+                skipped += 1
+                continue
+            rows[key] = {"name": row[2].capitalize(),
+                         "template_id": template_id,
+                         "country_id": country_id, "bk_name": bk_name}
+            balance_static = int(row[3])
+            balance_active = balance_static if isinstance(row[4], str) \
+                else int(row[4])
+            balances[key] = (balance_static, balance_active)
+        self.step("bookmakers", Bookmaker, list(rows.values()), skipped,
+                  lambda row: f"{row['bk_name']} / {row['name']}")
+
+        # начальные депозит и баланс - транзакциями на новых букмекеров
+        bookmaker_ids = self._map(Bookmaker.name_key, Bookmaker.template_id,
+                                  Bookmaker.country_id, Bookmaker.id)
+        transactions = []
+        for key, (balance_static, balance_active) in balances.items():
+            bookmaker_id = bookmaker_ids.get(key)
+            if bookmaker_id is None:
+                continue
+            transactions.append({"receiver_bookmaker_id": bookmaker_id,
+                                 "amount": balance_static,
+                                 "where": "deposit"})
+            transactions.append({"receiver_bookmaker_id": bookmaker_id,
+                                 "amount": balance_active - balance_static,
+                                 "where": "balance"})
+        self.step("bookmaker balances", Transaction, transactions, 0,
+                  lambda row: f"{row['where']} {row['amount']}")
+
+    def import_wallets(self, legacy):
+        country_ids = set(self.connection.execute(select(Country.id))
+                          .scalars())
+        existing = self._map(Wallet.name, Wallet.country_id, Wallet.id)
+        rows, skipped = {}, 0
+        for row in legacy.execute("SELECT * FROM Wallets").fetchall():
+            if row[0] not in wallets:
+                continue
+            country_id = countries.get(row[3])
+            key = (wallets[row[0]], country_id)
+            if country_id not in country_ids or key in existing or \
+                    key in rows:
+                skipped += 1
+                continue
+            rows[key] = {"name": key[0], "wallet_type": 'Страна',
+                         "general_wallet_type":
+                             'Карта' if row[1] == 'card' else 'Binance',
+                         "deposit": row[5], "country_id": country_id}
+        self.step("wallets", Wallet, list(rows.values()), skipped,
+                  lambda row: row["name"])
+
+    def report(self):
+        total = 0
+        for name, (inserted, skipped, seconds, sample) in self.steps.items():
+            total += seconds
+            print(f"{name}: +{inserted}, пропущено {skipped} "
+                  f"({seconds:.2f} с)")
+            if self.dry_run:
+                for label in sample:
+                    print(f"  + {label}")
+                if inserted > len(sample):
+                    print(f"  ... еще {inserted - len(sample)}")
+        print(f"итого: {total:.2f} с"
+              + (" (dry run, изменения отменены)" if self.dry_run else ""))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--db", default="sqlite:///test_transfer.db",
+                        help="новая база (URL SQLAlchemy)")
+    parser.add_argument("--legacy", default="db.sqlite3",
+                        help="база старого бота")
+    parser.add_argument("--data", default="Файл для БД.xlsx",
+                        help="страны, шаблоны БК и партнеры")
+    parser.add_argument("--bookmakers", default="БК и балансы.xlsx",
+                        help="букмекеры и балансы")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="показать изменения, ничего не записывая")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> Importer:
+    args = parse_args(argv)
+    engine = create_engine(args.db)
+    legacy = sql.connect(args.legacy)
+    data = load_workbook(filename=args.data, read_only=True)
+    bookmakers = load_workbook(filename=args.bookmakers, read_only=True)
+    try:
+        with engine.connect() as connection:
+            Model.metadata.create_all(connection)
+            # новая база сразу в текущей схеме: отмечаем миграции
+            # примененными, иначе бот при запуске применил бы их к данным
+            apply_migrations(connection)
+            if not args.dry_run:
+                connection.commit()
+
+            importer = Importer(connection, dry_run=args.dry_run,
+                                batch_size=args.batch_size)
+            importer.import_countries(data["СТРАНЫ И ЭМОДЗИ"])
+            importer.import_templates(data["ШАБЛОНЫ БК"])
+            importer.import_sources(data["ПАРТНЕРЫ"])
+            importer.import_employees(legacy)
+            importer.import_bookmakers(bookmakers.active)
+            importer.import_wallets(legacy)
+            if args.dry_run:
+                connection.rollback()
+    finally:
+        data.close()
+        bookmakers.close()
+        legacy.close()
+        engine.dispose()
+    importer.report()
+    return importer
+
+
+if __name__ == "__main__":
+    main()
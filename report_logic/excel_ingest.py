@@ -0,0 +1,407 @@
+"""Потоковая загрузка больших файлов отчетов
+
+В отличие от process_excel_file, файл не загружается в память целиком:
+строки читаются openpyxl в режиме read_only, проверяются и сопоставляются
+со справочниками пачками по chunk_size строк, и каждая пачка записывается
+в базу одной транзакцией. В файл ошибок (write_only) попадают только
+строки, которые не удалось загрузить, с подсказкой похожих названий для
+ненайденных источников, стран и букмекеров (data/fuzzy.py). Память
+зависит от размера пачки, а не от размера файла.
+
+run_ingest_job выполняет ту же загрузку для фоновой задачи IngestJob и
+сохраняет ее прогресс в базе.
+"""
+import datetime
+import time
+from dataclasses import dataclass
+from typing import Optional
+import openpyxl
+import pandas as pd
+from sqlalchemy import select, insert, update
+from data.tools import session_scope
+from data.metrics import observe_ingest
+from data.models import *
+from data.names import name_key
+from data.fuzzy import NameSuggester
+from data.utils import invalidate_snapshots, post_reports
+from report_logic.excel_reports import fields_to_check
+
+CHUNK_SIZE = 1000
+ERROR_COLUMNS = ['Error', 'Возможно, имелось в виду']
+
+
+@dataclass
+class IngestResult:
+    """
+    Итог загрузки файла
+
+    Поля:
+    rows -- номер последней обработанной строки данных
+    created -- создано отчетов
+    errors -- строк с ошибками (они записаны в файл ошибок)
+    total -- строк данных в файле (по размеру листа, если известен)
+    """
+    rows: int = 0
+    created: int = 0
+    errors: int = 0
+    total: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.errors == 0
+
+
+class _ErrorFile:
+    """Файл ошибок, создается при первой ошибке"""
+
+    def __init__(self, header: list):
+        self.header = header
+        self.workbook = None
+        self.sheet = None
+
+    def append(self, values: list):
+        if self.workbook is None:
+            self.workbook = openpyxl.Workbook(write_only=True)
+            self.sheet = self.workbook.create_sheet()
+            self.sheet.append(self.header + ERROR_COLUMNS)
+        self.sheet.append(values)
+
+    def save(self, path: str):
+        if self.workbook is not None:
+            self.workbook.save(path)
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(value) -> Optional[str]:
+    return None if _is_empty(value) else str(value).strip()
+
+
+def _parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    date = pd.to_datetime(value, errors="coerce", dayfirst=True)
+    return None if pd.isna(date) else date.to_pydatetime()
+
+
+def _parse_row(row: dict):
+    """Проверка строки: (поля отчета, None) или (None, ошибка)"""
+    missing_fields = [field for field in fields_to_check
+                      if _is_empty(row.get(field))]
+    if missing_fields:
+        return None, f"Не хватает полей: {', '.join(missing_fields)}"
+
+    date = _parse_date(row['Дата'])
+    if date is None:
+        return None, f"Неверная дата: {row['Дата']}"
+    try:
+        bet_amount = float(row['Сумма Проставленных'])
+        return_amount = float(row['Возврат'])
+    except (TypeError, ValueError):
+        return None, "Суммы должны быть числами"
+    try:
+        userid = int(row['userID'])
+    except (TypeError, ValueError):
+        return None, f"Неверный userID: {row['userID']}"
+
+    cleaned_value = str(row['Является Ли Ошибочным']).replace(" ", "")
+    return {
+        "date": date,
+        "is_error": cleaned_value.lower() == "да",
+        "source": str(row['Источник']),
+        "country": str(row['Страна']),
+        "bk_name": str(row['Букмекер']).capitalize(),
+        "bk_login": str(row['Профиль']).capitalize(),
+        "bet_amount": bet_amount,
+        "return_amount": return_amount,
+        "userid": userid,
+        "nick_name": _text(row['nickName']),
+        "match_name": _text(row.get('Название матча')),
+    }, None
+
+
+async def _resolve_chunk(session, parsed: list) -> dict:
+    """
+    Справочники для пачки строк одним запросом на таблицу
+
+    Названия сравниваются по ключам (data/names.py), словари resolved
+    тоже ключами названий.
+    """
+    sources = await session.execute(
+        select(Source.name_key, Source.id).where(
+            Source.name_key.in_({name_key(r["source"]) for r in parsed}),
+            Source.is_deleted == False))
+    countries = await session.execute(
+        select(Country.name_key, Country.id).where(
+            Country.name_key.in_({name_key(r["country"]) for r in parsed}),
+            Country.is_deleted == False))
+    employees = await session.execute(
+        select(Employee.id).where(
+            Employee.id.in_({r["userid"] for r in parsed})))
+    resolved = {
+        "sources": {},
+        "countries": {},
+        "employees": set(employees.scalars()),
+        "bookmakers": {},
+    }
+    # как и Model.get, при дублях (базы до уникальных индексов) берем
+    # первую запись
+    for key, id_ in sources:
+        resolved["sources"].setdefault(key, id_)
+    for key, id_ in countries:
+        resolved["countries"].setdefault(key, id_)
+
+    bookmakers = await session.execute(
+        select(Bookmaker.name_key, Bookmaker.bk_name_key,
+               Bookmaker.country_id, Bookmaker.id).where(
+            Bookmaker.name_key.in_({name_key(r["bk_login"])
+                                    for r in parsed}),
+            Bookmaker.country_id.in_(set(resolved["countries"].values())),
+            Bookmaker.is_active == True,
+            Bookmaker.is_deleted == False))
+    for key, bk_name_key, country_id, id_ in bookmakers:
+        resolved["bookmakers"].setdefault((key, bk_name_key, country_id),
+                                          id_)
+    return resolved
+
+
+def _report_values(row: dict, resolved: dict):
+    """Значения отчета или текст ошибки (как в add_report_to_db)"""
+    source_id = resolved["sources"].get(name_key(row["source"]))
+    country_id = resolved["countries"].get(name_key(row["country"]))
+    errors = []
+    if row["userid"] not in resolved["employees"]:
+        errors.append(f"Пользователь {row['nick_name']} с id "
+                      f"{row['userid']} не найден")
+    if source_id is None:
+        errors.append(f"Источник {row['source']} не найден")
+    if country_id is None:
+        errors.append(f"Страна {row['country']} не найдена")
+    if errors:
+        return None, " ".join(errors)
+
+    bookmaker_id = resolved["bookmakers"].get(
+        (name_key(row["bk_login"]), name_key(row["bk_name"]), country_id))
+    if bookmaker_id is None:
+        return None, (f"Букмекер {row['bk_name']} с логином "
+                      f"{row['bk_login']} в стране {row['country']} "
+                      f"с isActive=True не найден")
+    return {
+        "date": row["date"],
+        "is_error": row["is_error"],
+        "source_id": source_id,
+        "country_id": country_id,
+        "bookmaker_id": bookmaker_id,
+        "bet_amount": row["bet_amount"],
+        "return_amount": row["return_amount"],
+        "employee_id": row["userid"],
+        "nickname": row["nick_name"],
+        "match_name": row["match_name"],
+    }, None
+
+
+def _suggestion(row: dict, resolved: dict, suggester: NameSuggester):
+    """Похожие названия для ненайденных в строке, None если их нет"""
+    parts = []
+    if name_key(row["source"]) not in resolved["sources"]:
+        source = suggester.source(row["source"])
+        if source:
+            parts.append(f"Источник: {source}")
+    country_id = resolved["countries"].get(name_key(row["country"]))
+    if country_id is None:
+        country = suggester.country(row["country"])
+        if country:
+            parts.append(f"Страна: {country}")
+    elif (name_key(row["bk_login"]), name_key(row["bk_name"]),
+          country_id) not in resolved["bookmakers"]:
+        bookmaker = suggester.bookmaker(country_id, row["bk_name"],
+                                        row["bk_login"])
+        if bookmaker:
+            parts.append(f"Букмекер: {bookmaker[0]}, "
+                         f"профиль: {bookmaker[1]}")
+    return "; ".join(parts) or None
+
+
+async def _ingest_chunk(chunk: list, result: IngestResult, on_chunk=None,
+                        suggester: NameSuggester = None) -> list:
+    """
+    Запись пачки строк (номер, исходные значения, словарь полей) в базу
+
+    Возвращает ошибки [(номер строки, исходные значения, текст,
+    подсказка или None)]. Подсказки ищутся, если передан suggester.
+    on_chunk(session, errors) вызывается в той же транзакции, что и вставка
+    отчетов, - так вместе с отчетами фиксируется и прогресс загрузки.
+    """
+    errors = []
+    parsed = []
+    for number, values, row in chunk:
+        fields, error = _parse_row(row)
+        if error:
+            errors.append((number, values, error, None))
+        else:
+            parsed.append((number, values, fields))
+
+    async with session_scope() as session:
+        reports = []
+        if parsed:
+            resolved = await _resolve_chunk(session,
+                                            [f for _, _, f in parsed])
+            for number, values, fields in parsed:
+                report, error = _report_values(fields, resolved)
+                if error:
+                    suggestion = None
+                    if suggester is not None:
+                        await suggester.load(session)
+                        suggestion = _suggestion(fields, resolved, suggester)
+                    errors.append((number, values, error, suggestion))
+                else:
+                    reports.append(report)
+        if reports:
+            ids = (await session.execute(
+                insert(Report).returning(Report.id), reports)).scalars().all()
+            await post_reports(session, Report.id.in_(ids))
+            # отчеты из файла обычно датированы прошлыми днями
+            await invalidate_snapshots(min(r["date"] for r in reports),
+                                       session=session)
+        result.rows = chunk[-1][0]
+        result.created += len(reports)
+        result.errors += len(errors)
+        if on_chunk is not None:
+            await on_chunk(session, errors)
+    return errors
+
+
+async def ingest_excel_file(file_path: str, errors_path: str = 'errors.xlsx',
+                            chunk_size: int = CHUNK_SIZE,
+                            result: IngestResult = None, on_chunk=None,
+                            on_progress=None) -> IngestResult:
+    """
+    Потоковая загрузка отчетов из файла Excel
+
+    Строки с ошибками записываются в errors_path с колонками ERROR_COLUMNS
+    (текст ошибки и похожие названия), файл создается только если ошибки
+    есть (errors_path=None - не записывать).
+    Чтобы продолжить прерванную загрузку, передайте result прошлого запуска:
+    первые result.rows строк будут пропущены. on_progress(result)
+    вызывается после фиксации каждой пачки.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True,
+                                      data_only=True)
+    result = result or IngestResult()
+    start_row = result.rows
+    try:
+        sheet = workbook.active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else None
+                  for name in next(rows, ())]
+        if sheet.max_row:
+            result.total = sheet.max_row - 1
+        error_sheet = _ErrorFile(header) if errors_path else None
+        suggester = NameSuggester()
+
+        async def flush(chunk):
+            started = time.perf_counter()
+            errors = await _ingest_chunk(chunk, result, on_chunk, suggester)
+            observe_ingest(len(chunk), time.perf_counter() - started)
+            for _, values, error, suggestion in \
+                    errors if error_sheet else ():
+                error_sheet.append(list(values) + [error, suggestion])
+            if on_progress is not None:
+                await on_progress(result)
+
+        chunk = []
+        for number, values in enumerate(rows, start=1):
+            if number <= start_row or all(_is_empty(v) for v in values):
+                continue
+            chunk.append((number, values, dict(zip(header, values))))
+            if len(chunk) >= chunk_size:
+                await flush(chunk)
+                chunk = []
+        if chunk:
+            await flush(chunk)
+    finally:
+        workbook.close()
+
+    if error_sheet is not None:
+        error_sheet.save(errors_path)
+    return result
+
+
+def write_error_file(file_path: str, errors_path: str, messages: dict,
+                     suggestions: dict = None):
+    """
+    Файл ошибок по номерам строк: {номер строки: текст ошибки} и
+    необязательно {номер строки: подсказка}
+
+    Исходный файл читается еще раз потоково, поэтому файл ошибок можно
+    собрать и после перезапуска, когда часть строк обработана раньше.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True,
+                                      data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        error_sheet = _ErrorFile(list(next(rows, ())))
+        for number, values in enumerate(rows, start=1):
+            if number in messages:
+                error_sheet.append(list(values) + [
+                    messages[number], (suggestions or {}).get(number)])
+    finally:
+        workbook.close()
+    error_sheet.save(errors_path)
+
+
+async def _update_job(job_id: int, **values):
+    async with session_scope() as session:
+        await session.execute(
+            update(IngestJob).where(IngestJob.id == job_id).values(**values))
+
+
+async def run_ingest_job(job_id: int, errors_path: str = None,
+                         on_progress=None, chunk_size: int = CHUNK_SIZE):
+    """
+    Выполнение задачи загрузки IngestJob с сохранением прогресса
+
+    Прогресс и ошибки каждой пачки фиксируются вместе с ее отчетами,
+    поэтому после перезапуска задача продолжается с первой
+    необработанной строки. Возвращает (IngestResult, путь к файлу ошибок
+    или None).
+    """
+    job = await IngestJob.get(id=job_id)
+    result = IngestResult(rows=job.processed_rows or 0,
+                          created=job.created_reports or 0,
+                          errors=job.error_rows or 0,
+                          total=job.total_rows)
+    await _update_job(job_id, status="running")
+
+    async def save_chunk(session, errors):
+        session.add_all(IngestError(job_id=job_id, row_number=number,
+                                    message=message, suggestion=suggestion)
+                        for number, _, message, suggestion in errors)
+        await session.execute(
+            update(IngestJob).where(IngestJob.id == job_id).values(
+                processed_rows=result.rows, created_reports=result.created,
+                error_rows=result.errors, total_rows=result.total))
+
+    try:
+        await ingest_excel_file(job.file_path, errors_path=None,
+                                chunk_size=chunk_size, result=result,
+                                on_chunk=save_chunk, on_progress=on_progress)
+        if result.errors:
+            errors_path = errors_path or f"errors_{job_id}.xlsx"
+            errors = await IngestError.filter(IngestError.job_id == job_id)
+            write_error_file(job.file_path, errors_path,
+                             {e.row_number: e.message for e in errors},
+                             {e.row_number: e.suggestion for e in errors})
+        else:
+            errors_path = None
+    except Exception as e:
+        await _update_job(job_id, status="failed", error=str(e),
+                          finished_at=datetime.datetime.now())
+        raise
+    await _update_job(job_id, status="done",
+                      finished_at=datetime.datetime.now())
+    return result, errors_path
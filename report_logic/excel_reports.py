@@ -44,12 +44,14 @@ async def process_excel_file(file_path: str):
         received = row.get('Возврат')
         userid = row.get('userID')
         nick_name = row.get('nickName')
+        match_name = row.get('Название матча')
 
         # Добавление строки в базу данных
         ans = await add_report_to_db(date, wrong_report_value,
                                      source,
                                      country, bk_name, bk_login, placed,
-                                     received, userid, nick_name)
+                                     received, userid, nick_name,
+                                     match_name)
         if ans != True:
             df_copy.at[
                 index, 'Error'] = ans  # Обновление столбца 'Error' в df_copy
@@ -77,15 +79,15 @@ async def export_reports_to_excel(reports, start_date, end_date):
         sheet.append([
             report.id,
             "Не ошибочный" if not report.is_error else "Ошибочный",
-            report.employee.username,
+            report.employee_username,
             report.date.strftime('%d.%m.%Y %H:%M'),
             report.bet_amount,
             report.return_amount,
             report.profit,
             report.salary,
-            report.source.name,
-            report.country.name,
-            report.bookmaker.name,
+            report.source_name,
+            report.country_name,
+            report.bookmaker_name,
             report.nickname,
             report.match_name
         ])
@@ -94,4 +96,49 @@ async def export_reports_to_excel(reports, start_date, end_date):
     excel_file = io.BytesIO()
     workbook.save(excel_file)
     excel_file.seek(0)
-    return excel_file
\ No newline at end of file
+    return excel_file
+
+
+async def export_pivot_to_excel(table):
+    """Выгрузка сводной таблицы (data.pivot.PivotTable) в Excel"""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Сводная"
+    sheet.append(table.headers + ["Отчетов", "Ошибочных",
+                                  "Сумма проставленных", "Сумма возврата",
+                                  "Профит", "Зарплата", "Штрафы",
+                                  "Итого зарплата"])
+    for row in table.rows:
+        m = row.metrics
+        sheet.append(list(row.keys) + [m.reports, m.errors, m.bet,
+                                       m.returned, m.profit, m.salary,
+                                       m.penalty, m.real_salary])
+    total = table.total()
+    sheet.append(["Итого"] + [None] * (len(table.headers) - 1) + [
+        total.reports, total.errors, total.bet, total.returned,
+        total.profit, total.salary, total.penalty, total.real_salary])
+
+    excel_file = io.BytesIO()
+    workbook.save(excel_file)
+    excel_file.seek(0)
+    return excel_file
+
+
+async def export_commission_stats_to_excel(table):
+    """Выгрузка аналитики комиссий (data.commissions.CommissionTable)"""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Комиссии"
+    sheet.append(table.headers + ["Переводов", "Отправлено", "Комиссия",
+                                  "Средняя комиссия"])
+    for row in table.rows:
+        sheet.append(list(row.keys) + [row.transfers, row.amount,
+                                       row.commission, row.average])
+    total = table.total()
+    sheet.append(["Итого"] + [None] * (len(table.headers) - 1) + [
+        total.transfers, total.amount, total.commission, total.average])
+
+    excel_file = io.BytesIO()
+    workbook.save(excel_file)
+    excel_file.seek(0)
+    return excel_file
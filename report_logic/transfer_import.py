@@ -0,0 +1,320 @@
+"""Пакетная загрузка переводов из Excel/CSV
+
+Вместо диалога TransferMoneyState (по одному переводу за десяток
+сообщений) администратор загружает файл с колонками TRANSFER_COLUMNS:
+отправитель, получатель, корзина (balance/deposit), отправлено и
+получено. Отправитель и получатель указываются так:
+
+- кошелек - его названием;
+- букмекер - "БК / профиль" или, если такие есть в нескольких странах,
+  "БК / профиль / страна";
+- любой из них по id: "wallet:12", "bk:7".
+
+Все действующие кошельки и букмекеры загружаются одним запросом в словарь
+ключ названия (data/names.py) -> сущность, и строки проверяются в памяти.
+Если ошибок нет, транзакции с проводками, записи OperationHistory и
+CommissionHistory создаются в одной сессии, то есть фиксируются или
+откатываются вместе. При любой ошибке в файле не создается ничего, а
+администратор получает список ошибок по номерам строк.
+"""
+import csv
+import datetime
+import io
+from dataclasses import dataclass, field
+from typing import Optional
+import openpyxl
+from sqlalchemy import select
+from data.tools import session_scope
+from data.models import *
+from data.money import to_cents, from_cents, money_sum
+from data.names import name_key
+
+TRANSFER_COLUMNS = ['Отправитель', 'Получатель', 'Корзина', 'Отправлено',
+                    'Получено']
+
+# допустимые названия колонок -> колонка TRANSFER_COLUMNS
+COLUMN_ALIASES = {
+    'sender': 'Отправитель',
+    'receiver': 'Получатель',
+    'bucket': 'Корзина',
+    'sent': 'Отправлено',
+    'received': 'Получено',
+}
+
+BUCKETS = {
+    'balance': 'balance',
+    'баланс': 'balance',
+    'deposit': 'deposit',
+    'депозит': 'deposit',
+}
+
+# отмечает ключ, подходящий нескольким сущностям
+_AMBIGUOUS = object()
+
+
+@dataclass(frozen=True)
+class TransferParty:
+    """
+    Отправитель или получатель перевода
+
+    Поля:
+    entity -- "wallet" или "bk", как в диалоге перевода
+    id -- id кошелька или букмекера
+    name -- название для истории операций
+    """
+    entity: str
+    id: int
+    name: str
+
+
+@dataclass
+class TransferRow:
+    """
+    Проверенная строка файла
+
+    Поля:
+    number -- номер строки данных (первая строка после заголовка - 1)
+    sender -- отправитель
+    receiver -- получатель
+    from_ -- корзина отправителя-букмекера (None для кошелька)
+    where -- корзина получателя-букмекера (None для кошелька)
+    sent -- отправленная сумма
+    received -- полученная сумма
+    """
+    number: int
+    sender: TransferParty
+    receiver: TransferParty
+    from_: Optional[str]
+    where: Optional[str]
+    sent: float
+    received: float
+
+    @property
+    def commission(self) -> float:
+        return from_cents(to_cents(self.sent) - to_cents(self.received))
+
+
+@dataclass
+class TransferImportResult:
+    """
+    Итог загрузки переводов
+
+    Поля:
+    rows -- строк данных в файле
+    created -- создано транзакций (0, если в файле есть ошибки)
+    sent -- сумма отправленного по созданным транзакциям
+    commission -- сумма комиссий по созданным транзакциям
+    errors -- ошибки (номер строки, текст)
+    """
+    rows: int = 0
+    created: int = 0
+    sent: float = 0
+    commission: float = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+class TransferEntities:
+    """Словарь ключ названия -> TransferParty для проверки строк"""
+
+    def __init__(self):
+        self._by_key = {}
+
+    def add(self, key: str, party: TransferParty):
+        known = self._by_key.get(key)
+        self._by_key[key] = party if known in (None, party) else _AMBIGUOUS
+
+    async def load(self, session):
+        """Действующие кошельки и букмекеры одним запросом на таблицу"""
+        for wallet_id, name in await session.execute(
+                select(Wallet.id, Wallet.name)
+                .where(Wallet.is_deleted == False)):
+            party = TransferParty("wallet", wallet_id, name)
+            self.add(f"wallet:{wallet_id}", party)
+            self.add(_reference_key(*str(name).split("/")), party)
+        for bk_id, bk_name, login, country in await session.execute(
+                select(Bookmaker.id, Bookmaker.bk_name, Bookmaker.name,
+                       Country.name)
+                .outerjoin(Country, Country.id == Bookmaker.country_id)
+                .where(Bookmaker.is_deleted == False)):
+            party = TransferParty("bk", bk_id, login)
+            self.add(f"bk:{bk_id}", party)
+            self.add(_reference_key(bk_name, login), party)
+            self.add(_reference_key(bk_name, login, country), party)
+
+    def resolve(self, reference):
+        """(TransferParty, None) или (None, ошибка)"""
+        party = self._by_key.get(_reference_key(*str(reference).split("/")))
+        if party is _AMBIGUOUS:
+            return None, (f"'{reference}' подходит нескольким кошелькам или "
+                          f"БК, укажите страну (БК / профиль / страна) "
+                          f"или id (bk:7)")
+        if party is None:
+            return None, f"Не найден кошелек или БК '{reference}'"
+        return party, None
+
+
+def _reference_key(*parts) -> str:
+    """Ключ ссылки: части через "/" без учета регистра и пробелов"""
+    key = "/".join(name_key(part) or "" for part in parts)
+    return key.replace(" :", ":").replace(": ", ":")
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _parse_sum(value) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(" ", "").replace(",", "."))
+    except ValueError:
+        return None
+
+
+def parse_row(number: int, row: dict, entities: TransferEntities):
+    """Проверка строки: (TransferRow, None) или (None, ошибка)"""
+    missing = [column for column in TRANSFER_COLUMNS
+               if column != 'Корзина' and _is_empty(row.get(column))]
+    if missing:
+        return None, f"Не хватает полей: {', '.join(missing)}"
+
+    sender, error = entities.resolve(row['Отправитель'])
+    if error:
+        return None, error
+    receiver, error = entities.resolve(row['Получатель'])
+    if error:
+        return None, error
+    if sender == receiver:
+        return None, "Отправитель и получатель совпадают"
+
+    bucket = None
+    if "bk" in (sender.entity, receiver.entity):
+        bucket = BUCKETS.get(name_key(row.get('Корзина')))
+        if bucket is None:
+            return None, "Для БК укажите корзину: balance или deposit"
+
+    sent = _parse_sum(row['Отправлено'])
+    received = _parse_sum(row['Получено'])
+    if sent is None or received is None:
+        return None, "Суммы должны быть числами"
+    if sent <= 0 or received < 0:
+        return None, "Суммы должны быть положительными"
+    if received > sent:
+        return None, "Получено больше, чем отправлено"
+
+    return TransferRow(
+        number=number, sender=sender, receiver=receiver,
+        from_=bucket if sender.entity == "bk" else None,
+        where=bucket if receiver.entity == "bk" else None,
+        sent=sent, received=received), None
+
+
+def read_transfer_rows(file_path: str):
+    """Строки файла .xlsx или .csv: (номер строки, {колонка: значение})"""
+    if file_path.lower().endswith(".csv"):
+        with open(file_path, encoding="utf-8-sig", newline="") as file:
+            text = file.read()
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(io.StringIO(text), dialect)
+        yield from _numbered_rows(rows)
+        return
+    workbook = openpyxl.load_workbook(file_path, read_only=True,
+                                      data_only=True)
+    try:
+        yield from _numbered_rows(
+            workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _numbered_rows(rows):
+    header = [str(name).strip() if name is not None else None
+              for name in next(rows, ())]
+    header = [COLUMN_ALIASES.get((name or "").lower(), name)
+              for name in header]
+    for number, values in enumerate(rows, start=1):
+        if all(_is_empty(value) for value in values):
+            continue
+        yield number, dict(zip(header, values))
+
+
+def _history(row: TransferRow, transaction_id, user_id, username,
+             timestamp):
+    """Записи истории операций и комиссий, как в диалоге перевода"""
+    sender, receiver = row.sender, row.receiver
+    route = (f"с {sender.entity} '{sender.name}' "
+             f"на {receiver.entity} '{receiver.name}'")
+    return [
+        OperationHistory(
+            date=timestamp, user_name=user_id, operation_type="transfer",
+            operation_description=(f"Переведено {row.received} {route} "
+                                   f"пользователем {username}")),
+        CommissionHistory(
+            date=timestamp, user_name=username, commission=row.commission,
+            commission_type="transfer", transaction_id=transaction_id,
+            commission_description=(f"Комиссия {row.commission} при "
+                                    f"переводе {route} пользователем "
+                                    f"{username}")),
+    ]
+
+
+async def import_transfers(file_path: str, user_id=None,
+                           username=None) -> TransferImportResult:
+    """
+    Загрузка переводов из файла одной транзакцией базы
+
+    Если хотя бы одна строка не прошла проверку, ничего не создается и
+    result.errors содержит ошибки всех строк.
+    """
+    result = TransferImportResult()
+    async with session_scope() as session:
+        entities = TransferEntities()
+        await entities.load(session)
+
+        transfers = []
+        for number, row in read_transfer_rows(file_path):
+            result.rows += 1
+            transfer, error = parse_row(number, row, entities)
+            if error:
+                result.errors.append((number, error))
+            else:
+                transfers.append(transfer)
+        if result.errors or not transfers:
+            return result
+
+        timestamp = datetime.datetime.now()
+        transactions = [
+            Transaction(
+                sender_wallet_id=_party_id(row.sender, "wallet"),
+                receiver_wallet_id=_party_id(row.receiver, "wallet"),
+                sender_bookmaker_id=_party_id(row.sender, "bk"),
+                receiver_bookmaker_id=_party_id(row.receiver, "bk"),
+                amount=row.sent,
+                commission=row.commission,
+                from_=row.from_,
+                where=row.where,
+                timestamp=timestamp)
+            for row in transfers]
+        session.add_all(transactions)
+        await session.flush()
+        for transaction, row in zip(transactions, transfers):
+            session.add_all(transaction.postings())
+            session.add_all(_history(row, transaction.id, user_id, username,
+                                     timestamp))
+
+    result.created = len(transfers)
+    result.sent = money_sum(row.sent for row in transfers)
+    result.commission = money_sum(row.commission for row in transfers)
+    return result
+
+
+def _party_id(party: TransferParty, entity: str) -> Optional[int]:
+    return party.id if party.entity == entity else None